@@ -1,48 +1,496 @@
 from __future__ import annotations
 
+import asyncio
+from contextlib import asynccontextmanager
+import os
 from pathlib import Path
 import uuid
 
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
 import torch
 
-from .model_loader import load_cubicasa_model
-from .pipeline import estimate_lengths_from_pdf
+from .cache import GeometryCache
+from .encodings import (
+    MEDIA_TYPES,
+    iter_json,
+    iter_ndjson,
+    negotiate,
+    to_arrow,
+    to_columnar,
+    to_msgpack,
+    to_verbose,
+)
+from .instrumentation import Metrics
+from .jobs import WorkerPool, PoolUnavailableError, QueueFullError, JobTimeoutError
+from .pipeline import (
+    OptionsError,
+    PipelineOptions,
+    estimate_document_from_pdf,
+    estimate_lengths_from_pdf,
+)
+from .results import ResultStore
+from .revisions import estimate_revision_from_pdf
+from .pdf_render import UnreadablePdfError
+from .units import InvalidRequestError
+from .uploads import PdfForm, SpooledPdf, UploadRejected, receive_pdf_form
 
 APP_DIR = Path(__file__).resolve().parent.parent
-WEIGHTS_PATH = APP_DIR / "weights" / "model_best_val_loss_var.pkl"
+WEIGHTS_PATH = Path(os.environ.get("WALL_WEIGHTS_PATH", APP_DIR / "weights" / "model_best_val_loss_var.pkl"))
 UPLOAD_DIR = APP_DIR / "outputs"
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
+# Worker pool settings
+WORKERS = int(os.environ.get("WALL_WORKERS", "1"))
+WORKER_MODE = os.environ.get("WALL_WORKER_MODE", "thread")  # thread | process
+QUEUE_SIZE = int(os.environ.get("WALL_QUEUE_SIZE", "8"))
+JOB_TIMEOUT_S = float(os.environ.get("WALL_JOB_TIMEOUT_S", "300"))
+MAX_BATCH = int(os.environ.get("WALL_MAX_BATCH", "1"))  # 1 disables micro-batching
+MAX_WAIT_MS = float(os.environ.get("WALL_MAX_WAIT_MS", "10"))
+BUFFER_POOL_MB = float(os.environ.get("WALL_BUFFER_POOL_MB", "512"))  # free scratch buffers kept per process
+
+# Inference backend (see backends.py)
+BACKEND = os.environ.get("WALL_BACKEND", "eager")  # eager | fused | torchscript | onnx | onnx-int8
+CHANNELS_LAST = os.environ.get("WALL_CHANNELS_LAST", "0") == "1"
+EXPORT_DIR = Path(os.environ.get("WALL_EXPORT_DIR", APP_DIR / "weights" / "export"))
+HEAD = os.environ.get("WALL_HEAD", "full")  # full | wall | wall-rooms (see wall_head.py)
+
+# Startup
+LOAD_MODE = os.environ.get("WALL_LOAD", "background")  # background (at startup) | lazy (first request)
+WARMUP = os.environ.get("WALL_WARMUP", "0") == "1"
+
+# Upload settings
+MAX_UPLOAD_MB = float(os.environ.get("WALL_MAX_UPLOAD_MB", "200"))
+UPLOAD_MEMORY_MB = float(os.environ.get("WALL_UPLOAD_MEMORY_MB", "16"))  # larger uploads are spooled to disk
+
+# Geometry cache settings
+CACHE_DIR = Path(os.environ.get("WALL_CACHE_DIR", APP_DIR / "cache"))
+CACHE_MAX_MB = float(os.environ.get("WALL_CACHE_MAX_MB", "2048"))  # 0 disables the cache
+
 device = "cuda" if torch.cuda.is_available() else "cpu"
-model = load_cubicasa_model(str(WEIGHTS_PATH), device=device)
+pool = WorkerPool(
+    str(WEIGHTS_PATH),
+    device=device,
+    workers=WORKERS,
+    mode=WORKER_MODE,
+    queue_size=QUEUE_SIZE,
+    timeout_s=JOB_TIMEOUT_S,
+    max_batch=MAX_BATCH,
+    max_wait_ms=MAX_WAIT_MS,
+    backend=BACKEND,
+    channels_last=CHANNELS_LAST,
+    export_dir=str(EXPORT_DIR),
+    head=HEAD,
+    warmup=WARMUP,
+    buffer_pool_mb=BUFFER_POOL_MB,
+)
+
+cache = None
+if CACHE_MAX_MB > 0:
+    cache = GeometryCache(
+        str(CACHE_DIR),
+        max_bytes=int(CACHE_MAX_MB * 1024 * 1024),
+        # other backends and heads give (slightly) different masks, keep their geometry apart
+        namespace=("" if BACKEND == "eager" else f":{BACKEND}") + ("" if HEAD == "full" else f":{HEAD}"),
+        namespace_file=str(WEIGHTS_PATH),  # hashed on first use, not at import
+    )
 
-app = FastAPI()
+metrics = Metrics()
+results = ResultStore(str(UPLOAD_DIR))
 
 
-@app.post("/estimate")
-async def estimate(
-    pdf: UploadFile = File(...),
-    page_index: int = Form(0),
-    scale_inch_per_foot: str = Form("3/16"),
-):
-    if not pdf.filename.lower().endswith(".pdf"):
-        return JSONResponse({"error": "Only PDF files are supported"}, status_code=400)
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    if LOAD_MODE != "lazy":
+        pool.start()
+    yield
+    pool.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.exception_handler(OptionsError)
+async def _options_error(_request: Request, exc: OptionsError):
+    return JSONResponse({"error": str(exc)}, status_code=400)
+
+
+# Form fields of the estimation endpoints besides the pdf file: name -> (type, default).
+# The body is read by receive_pdf_form, not by FastAPI (which would spool the file once more).
+OPTION_FIELDS = {
+    "inference": (str, "full"),
+    "tile_size": (int, 1024),
+    "tile_overlap": (int, 128),
+    "tile_dpi": (int, 150),
+    "roi": (bool, False),
+    "line_engine": (str, "hough"),
+    "network_size": (int, 1024),
+    "tta": (bool, False),
+}
+PAGE_FIELDS = {
+    "page_index": (int, 0),
+    "scale_inch_per_foot": (str, "3/16"),
+    "timings": (bool, False),
+}
+DOCUMENT_FIELDS = {
+    "pages": (str, None),
+    "prior_result_id": (str, None),
+}
+_TRUE = ("true", "1", "yes", "on")
+_FALSE = ("false", "0", "no", "off")
+
 
+def form_value(fields: dict[str, str], name: str, kind: type, default):
+    """A form field converted to kind (str, int or bool); UploadRejected when it doesn't convert."""
+    raw = fields.get(name)
+    if raw is None:
+        return default
+    if kind is int:
+        try:
+            return int(raw)
+        except ValueError:
+            raise UploadRejected(f"{name} must be an integer") from None
+    if kind is bool:
+        if raw.strip().lower() in _TRUE + _FALSE:
+            return raw.strip().lower() in _TRUE
+        raise UploadRejected(f"{name} must be true or false")
+    return raw
+
+
+def pipeline_options(fields: dict[str, str]) -> PipelineOptions:
+    return PipelineOptions(**{name: form_value(fields, name, *spec) for name, spec in OPTION_FIELDS.items()})
+
+
+def _form_openapi(*specs: dict, pages_default: str | None = None) -> dict:
+    """The multipart request body of an estimation endpoint, for the OpenAPI schema."""
+    types = {str: "string", int: "integer", bool: "boolean"}
+    properties = {"pdf": {"type": "string", "format": "binary"}}
+    for spec in specs:
+        for name, (kind, default) in spec.items():
+            if name == "pages":
+                default = pages_default
+            properties[name] = {"type": types[kind], **({"default": default} if default is not None else {})}
+    schema = {"type": "object", "required": ["pdf"], "properties": properties}
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": schema}}}}
+
+
+async def _receive_upload(request: Request) -> tuple[str, PdfForm]:
     file_id = str(uuid.uuid4())
-    out_path = UPLOAD_DIR / f"{file_id}.pdf"
-    out_path.write_bytes(await pdf.read())
-    debug_dir = str(UPLOAD_DIR / file_id)
-    Path(debug_dir).mkdir(parents=True, exist_ok=True)
-    result = estimate_lengths_from_pdf(
-        pdf_path=str(out_path),
-        model=model,
-        device=device,
+    form = await receive_pdf_form(
+        request,
+        dest=UPLOAD_DIR / f"{file_id}.pdf",
+        max_bytes=int(MAX_UPLOAD_MB * 1024 * 1024),
+        memory_bytes=int(UPLOAD_MEMORY_MB * 1024 * 1024),
+    )
+    return file_id, form
+
+
+def _submit(
+    file_id: str,
+    spooled: SpooledPdf,
+    scale_inch_per_foot: str,
+    options: PipelineOptions,
+    page_index: int = 0,
+    pages: str | None = None,
+    prior_result_id: str | None = None,
+):
+    # only the geometry is stored, overlays are drawn on request (GET /results/{id}/overlay)
+    result_dir = str(results.result_dir(file_id))
+    if prior_result_id is not None:
+        return pool.submit(
+            estimate_revision_from_pdf,
+            **spooled.source_kwargs(),
+            prior_pdf_path=str(results.source_path(prior_result_id)),
+            prior_geometry_dir=str(results.result_dir(prior_result_id)),
+            pages=pages or "all",
+            scale_inch_per_foot=scale_inch_per_foot,
+            geometry_dir=result_dir,
+            options=options,
+        )
+    if pages is not None:
+        return pool.submit(
+            estimate_document_from_pdf,
+            **spooled.source_kwargs(),
+            pages=pages,
+            scale_inch_per_foot=scale_inch_per_foot,
+            geometry_dir=result_dir,
+            cache=cache,
+            file_hash=spooled.sha256,
+            options=options,
+        )
+    return pool.submit(
+        estimate_lengths_from_pdf,
+        **spooled.source_kwargs(),
         page_index=page_index,
         scale_inch_per_foot=scale_inch_per_foot,
-        debug_outputs_dir=debug_dir,
+        geometry_dir=result_dir,
+        cache=cache,
+        file_hash=spooled.sha256,
+        options=options,
     )
 
-    return result
+
+def _observe(future):
+    if future.cancelled():
+        return
+    if future.exception() is None:
+        metrics.observe_result(future.result())
+    else:
+        metrics.observe_failure()
+
+
+def _public(result: dict, meta: dict) -> dict:
+    """
+    The result as sent to clients: with its result_id and overlay URLs, stage
+    timings only when they were asked for.
+    """
+    result_id = meta.get("result_id")
+
+    def page(r):
+        out = dict(r)
+        if not meta.get("timings"):
+            out.pop("timings", None)
+        if result_id:
+            for kind in ("lines", "outer"):
+                out[f"{kind}_overlay_url"] = f"/results/{result_id}/overlay?kind={kind}&page={r['page_index']}"
+        return out
+
+    if "pages" not in result:
+        out = page(result)
+    else:
+        out = {k: v for k, v in result.items() if k != "pages"}
+        if not meta.get("timings"):
+            out.pop("timings", None)
+        out["pages"] = [page(r) for r in result["pages"]]
+    if result_id:
+        out = {"result_id": result_id, **out}
+    return out
+
+
+def _respond(result: dict, meta: dict, accept: str | None):
+    """
+    The public result in the format asked for in Accept (see encodings.py).
+    Documents are streamed as JSON / NDJSON.
+    """
+    fmt = negotiate(accept)
+    out = _public(result, meta)
+    media_type = MEDIA_TYPES[fmt]
+    if fmt == "json" and "pages" in out:
+        return StreamingResponse(iter_json(out), media_type=media_type)
+    if fmt == "json":
+        return Response(b"".join(iter_json(out)), media_type=media_type)
+    if fmt == "ndjson":
+        return StreamingResponse(iter_ndjson(out), media_type=media_type)
+    if fmt == "columnar":
+        return JSONResponse(to_columnar(out), media_type=media_type)
+    try:
+        body = to_msgpack(to_columnar(out)) if fmt == "msgpack" else to_arrow(out)
+    except RuntimeError as e:  # optional package missing
+        return JSONResponse({"error": str(e)}, status_code=406)
+    return Response(body, media_type=media_type)
+
+
+async def _accept(request: Request, document: bool = True, pages_default: str | None = None):
+    """
+    Receives the upload form and queues its job; returns the Job or an error
+    response. Only with `document` are pages (default pages_default) and
+    prior_result_id read.
+    """
+    try:
+        file_id, form = await _receive_upload(request)
+    except UploadRejected as e:
+        return JSONResponse({"error": str(e)}, status_code=e.status_code)
+
+    spooled = form.pdf
+    try:
+        fields = form.fields
+        options = pipeline_options(fields)
+        page_index, scale_inch_per_foot, timings = (form_value(fields, k, *spec) for k, spec in PAGE_FIELDS.items())
+        pages = prior_result_id = None
+        if document:
+            pages = form_value(fields, "pages", str, pages_default)
+            prior_result_id = form_value(fields, "prior_result_id", str, None) or None
+        if prior_result_id is not None and not results.exists(prior_result_id):
+            spooled.discard()
+            return JSONResponse({"error": "Unknown prior result"}, status_code=404)
+        job = _submit(
+            file_id,
+            spooled,
+            scale_inch_per_foot,
+            options,
+            page_index=page_index,
+            pages=pages,
+            prior_result_id=prior_result_id,
+        )
+    except (UploadRejected, OptionsError) as e:
+        spooled.discard()
+        return JSONResponse({"error": str(e)}, status_code=getattr(e, "status_code", 400))
+    except QueueFullError as e:
+        spooled.discard()
+        return JSONResponse({"error": str(e)}, status_code=429)
+    except PoolUnavailableError as e:
+        spooled.discard()
+        return JSONResponse({"error": str(e)}, status_code=503)
+    job.meta.update(timings=timings, result_id=file_id)
+    job.future.add_done_callback(_observe)
+    if spooled.data is not None:
+        # overlays are rendered from the PDF later, keep in-memory uploads once done
+        job.future.add_done_callback(lambda f: _keep_source(f, file_id, spooled))
+    return job
+
+
+def _keep_source(future, file_id: str, spooled: SpooledPdf):
+    if not future.cancelled() and future.exception() is None:
+        results.save_source(file_id, spooled.data)
+
+
+async def _wait(job, accept: str | None = None):
+    try:
+        result = await asyncio.wait_for(asyncio.wrap_future(job.future), timeout=JOB_TIMEOUT_S)
+    except (asyncio.TimeoutError, JobTimeoutError):
+        pool.cancel(job.id)
+        return JSONResponse({"error": "Estimation timed out"}, status_code=504)
+    except InvalidRequestError as e:  # bad page selection or scale
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except UnreadablePdfError as e:
+        return JSONResponse({"error": str(e)}, status_code=422)
+    except Exception as e:  # reported like a failed job of the job API
+        return JSONResponse({"error": repr(e)}, status_code=500)
+    return _respond(result, job.meta, accept)
+
+
+@app.post("/estimate", openapi_extra=_form_openapi(PAGE_FIELDS, OPTION_FIELDS))
+async def estimate(request: Request):
+    """One page (page_index) of the uploaded PDF."""
+    job = await _accept(request, document=False)
+    if isinstance(job, JSONResponse):
+        return job
+    return await _wait(job, request.headers.get("accept"))
+
+
+@app.post(
+    "/estimate_document",
+    openapi_extra=_form_openapi(PAGE_FIELDS, DOCUMENT_FIELDS, OPTION_FIELDS, pages_default="all"),
+)
+async def estimate_document(request: Request):
+    """
+    Every selected page of the PDF. With prior_result_id, a revision of that
+    result: unchanged pages and regions keep their geometry, only changed
+    tiles are re-run, and the response carries length deltas (see revisions.py).
+    """
+    job = await _accept(request, pages_default="all")
+    if isinstance(job, JSONResponse):
+        return job
+    return await _wait(job, request.headers.get("accept"))
+
+
+@app.post("/jobs", status_code=202, openapi_extra=_form_openapi(PAGE_FIELDS, DOCUMENT_FIELDS, OPTION_FIELDS))
+async def submit_job(request: Request):
+    """
+    Queues a single page, or a whole document when `pages` is given ("all" or
+    e.g. "0,2-4") or when it revises prior_result_id.
+    """
+    job = await _accept(request)
+    if isinstance(job, JSONResponse):
+        return job
+    return {"job_id": job.id, "status": job.status}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, request: Request):
+    """The job's status, with its result once done (JSON, columnar JSON or MessagePack per Accept)."""
+    job = pool.get(job_id)
+    if job is None:
+        return JSONResponse({"error": "Unknown job"}, status_code=404)
+    fmt = negotiate(request.headers.get("accept"), ("json", "columnar", "msgpack"))
+    out = job.to_dict()
+    if "result" in out:
+        result = _public(out["result"], job.meta)
+        out["result"] = to_verbose(result) if fmt == "json" else to_columnar(result)
+    if fmt != "msgpack":
+        return JSONResponse(out, media_type=MEDIA_TYPES[fmt])
+    try:
+        return Response(to_msgpack(out), media_type=MEDIA_TYPES[fmt])
+    except RuntimeError as e:
+        return JSONResponse({"error": str(e)}, status_code=406)
+
+
+@app.get("/results/{result_id}/overlay")
+async def get_overlay(
+    result_id: str,
+    kind: str = "lines",
+    page: int = 0,
+    dpi: int = 100,
+    box: str | None = None,
+):
+    """
+    PNG debug overlay (kind=lines|outer) of an estimated page, drawn on first
+    request and cached. `dpi` sets the resolution (up to 300), `box` =
+    "x0,y0,x1,y1" in pixels at that dpi returns only a tile of the page.
+    """
+    try:
+        tile = tuple(int(v) for v in box.split(",")) if box else None
+        if tile is not None and len(tile) != 4:
+            raise ValueError("box must be x0,y0,x1,y1")
+        path = await run_in_threadpool(results.overlay_png, result_id, page, kind, dpi, tile)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if path is None:
+        return JSONResponse({"error": "Unknown result or page"}, status_code=404)
+    return FileResponse(path, media_type="image/png")
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process answers, whether or not the model is loaded."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 200 once the model is loaded (and warmed up), 503 before or if loading failed."""
+    status = pool.status()
+    if status["status"] == "ready":
+        return status
+    return JSONResponse(status, status_code=503)
+
+
+@app.get("/stats")
+async def stats():
+    return pool.stats()
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Stage timing histograms and pool gauges in the Prometheus text format."""
+    s = pool.stats()
+    gauges = {
+        "wall_pool_workers": s["workers"],
+        "wall_pool_capacity": s["capacity"],
+        "wall_pool_in_flight": s["in_flight"],
+        "wall_pool_tracked_jobs": s["tracked_jobs"],
+    }
+    if "batching" in s:
+        b = s["batching"]
+        gauges["wall_batching_batches"] = b["batches"]
+        gauges["wall_batching_images"] = b["images"]
+        gauges["wall_batching_mean_batch_size"] = b["mean_batch_size"]
+        gauges["wall_batching_mean_wait_ms"] = b["mean_wait_ms"]
+    b = s["buffers"]
+    gauges["wall_buffers_free_bytes"] = b["free_bytes"]
+    gauges["wall_buffers_lent_bytes"] = b["lent_bytes"]
+    gauges["wall_buffers_peak_lent_bytes"] = b["peak_lent_bytes"]
+    gauges["wall_buffers_allocations"] = b["allocations"]
+    gauges["wall_buffers_reuses"] = b["reuses"]
+    gauges["wall_process_peak_rss_bytes"] = s["peak_rss_bytes"]
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = pool.cancel(job_id)
+    if job is None:
+        return JSONResponse({"error": "Unknown job"}, status_code=404)
+    return {"job_id": job.id, "status": job.status}
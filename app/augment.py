@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import math
+import random
+
+import cv2
+import numpy as np
+import torch
+
+HEATMAP_CHANNELS = 21  # junction types of the CubiCasa heatmaps (see floortrans/loaders/augmentations.py)
+HEATMAP_KERNEL = 30  # DictToTensor's gaussian size at scale 1
+
+# junction type after one clockwise turn, as in RandomRotations.cubi
+TURN_CHANNELS = np.array([1, 2, 3, 0, 5, 6, 7, 4, 9, 10, 11, 8, 12, 15, 16, 14, 13, 18, 20, 17, 19])
+
+
+def random_crop(sample: dict, size: int) -> dict:
+    """
+    RandomCropToSizeTorch(data_format="dict") on a raw sample (see
+    ShardDataset.raw): pads by size / 2 (image white, labels 0), cuts a random
+    size x size window and keeps the points inside it. Only the window is copied.
+    """
+    image, label, points = sample["image"], sample["label"], sample["points"]
+    _, h, w = image.shape
+    pad = size // 2
+    y0 = random.randint(0, h) - pad  # window origin in image coordinates
+    x0 = random.randint(0, w) - pad
+
+    out_image = np.full((image.shape[0], size, size), 255, dtype=np.uint8)
+    out_label = np.zeros((label.shape[0], size, size), dtype=np.uint8)
+    sy0, sy1 = max(0, y0), min(h, y0 + size)
+    sx0, sx1 = max(0, x0), min(w, x0 + size)
+    if sy0 < sy1 and sx0 < sx1:
+        out_image[:, sy0 - y0 : sy1 - y0, sx0 - x0 : sx1 - x0] = image[:, sy0:sy1, sx0:sx1]
+        out_label[:, sy0 - y0 : sy1 - y0, sx0 - x0 : sx1 - x0] = label[:, sy0:sy1, sx0:sx1]
+
+    p = points - (0, x0, y0)
+    p = p[(p[:, 1] >= 0) & (p[:, 1] < size) & (p[:, 2] >= 0) & (p[:, 2] < size)]
+    return {"image": out_image, "label": out_label, "points": p, "scale": sample["scale"]}
+
+
+def resize_padded(sample: dict, size: int) -> dict:
+    """
+    ResizePaddedTorch((0, 0), data_format="dict") on a raw sample: shrinks
+    (never enlarges) to fit size x size, bilinear for the image and nearest
+    for labels, centred on a fill of 1 for the image and 0 for labels as
+    that transform does. Points are scaled and kept if inside.
+    """
+    image, label, points = sample["image"], sample["label"], sample["points"]
+    _, h, w = image.shape
+    ratio = min(1.0, size / h, size / w)
+    nh, nw = min(size, math.ceil(ratio * h)), min(size, math.ceil(ratio * w))
+    y_pad, x_pad = (size - nh) // 2, (size - nw) // 2
+
+    out_image = np.full((image.shape[0], size, size), 1, dtype=np.uint8)
+    out_label = np.zeros((label.shape[0], size, size), dtype=np.uint8)
+    hwc = cv2.resize(np.ascontiguousarray(image.transpose(1, 2, 0)), (nw, nh), interpolation=cv2.INTER_LINEAR)
+    out_image[:, y_pad : y_pad + nh, x_pad : x_pad + nw] = hwc.transpose(2, 0, 1)
+    for c in range(label.shape[0]):
+        out_label[c, y_pad : y_pad + nh, x_pad : x_pad + nw] = cv2.resize(
+            label[c], (nw, nh), interpolation=cv2.INTER_NEAREST
+        )
+
+    xy = points[:, 1:] * ratio + (x_pad, y_pad)
+    keep = (xy >= 0).all(axis=1) & (xy < size).all(axis=1)
+    p = np.column_stack([points[keep, 0], xy[keep].astype(np.int32)]).astype(np.int32)
+    return {"image": out_image, "label": out_label, "points": p, "scale": sample["scale"]}
+
+
+class RandomCropOrResize:
+    """Per sample, random_crop or resize_padded with equal odds (RandomChoice of the two in training)."""
+
+    def __init__(self, size: int = 256):
+        self.size = size
+
+    def __call__(self, sample: dict) -> dict:
+        if random.random() < 0.5:
+            return random_crop(sample, self.size)
+        return resize_padded(sample, self.size)
+
+
+def rotate_batch(image: torch.Tensor, label: torch.Tensor, points: list[np.ndarray]):
+    """
+    RandomRotations("cubi") for a batch of square samples: each gets 0, 1 or 2
+    clockwise turns, applied to all samples with the same count at once.
+    Point coordinates and junction types turn with them.
+    """
+    size = image.shape[-1]
+    turns = torch.randint(0, 3, (image.shape[0],))
+    image, label, points = image.clone(), label.clone(), list(points)
+    for k in (1, 2):
+        sel = (turns == k).nonzero().flatten()
+        if len(sel) == 0:
+            continue
+        image[sel] = torch.rot90(image[sel], -k, dims=(2, 3))
+        label[sel] = torch.rot90(label[sel], -k, dims=(2, 3))
+        for i in sel.tolist():
+            p = points[i]
+            for _ in range(k):
+                p = np.column_stack([TURN_CHANNELS[p[:, 0]], size - 1 - p[:, 2], p[:, 1]]).astype(np.int32)
+            points[i] = p
+    return image, label, points
+
+
+def gaussian_kernel(n: int, sigma: float = 0.25) -> np.ndarray:
+    """svg_utils.get_gaussian2D, vectorized: the n x n kernel DictToTensor blurs points with."""
+    d = (np.arange(n) + 1 - (0.5 * n + 0.5)) / (sigma * n)
+    return np.exp(-0.5 * (d[:, None] ** 2 + d[None, :] ** 2))
+
+
+def _mirrors(v: int, n: int, reach: tuple[int, int]) -> list[int]:
+    # sources that BORDER_REFLECT_101 makes v visible as, within reach of the image
+    out = [v]
+    if v > 0 and -v + reach[1] >= 0:
+        out.append(-v)
+    if v < n - 1 and 2 * (n - 1) - v + reach[0] <= n - 1:
+        out.append(2 * (n - 1) - v)
+    return out
+
+
+def render_heatmaps(points: list[np.ndarray], scales: list[float], size: int) -> torch.Tensor:
+    """
+    DictToTensor("cubi")'s heatmaps for a batch: [B,21,size,size] float32.
+    Instead of setting the points in 21 planes per sample and filtering each
+    plane, the (flipped) kernel is added around every point, including the
+    mirrored copies cv2.filter2D's default border reflects in, which gives the
+    same values.
+    """
+    out = np.zeros((len(points), HEATMAP_CHANNELS, size, size), dtype=np.float32)
+    for b, (p, scale) in enumerate(zip(points, scales)):
+        n = int(HEATMAP_KERNEL * scale)
+        if n < 1 or len(p) == 0:
+            continue
+        k = gaussian_kernel(n)[::-1, ::-1].astype(np.float32)
+        anchor = n // 2
+        lo, hi = -(n - 1 - anchor), anchor  # the kernel covers v + lo .. v + hi
+        # DictToTensor sets (doesn't add) a pixel per point, and moves the last row/column in by one
+        p = np.unique(np.minimum(p, (HEATMAP_CHANNELS - 1, size - 1, size - 1)), axis=0)
+        for ch, x, y in p.tolist():
+            plane = out[b, ch]
+            for sy in _mirrors(y, size, (lo, hi)):
+                for sx in _mirrors(x, size, (lo, hi)):
+                    y0, y1 = max(0, sy + lo), min(size, sy + hi + 1)
+                    x0, x1 = max(0, sx + lo), min(size, sx + hi + 1)
+                    if y0 < y1 and x0 < x1:
+                        plane[y0:y1, x0:x1] += k[y0 - sy - lo : y1 - sy - lo, x0 - sx - lo : x1 - sx - lo]
+    return torch.from_numpy(out)
+
+
+def color_jitter_batch(image: torch.Tensor, b_var: float = 0.4, c_var: float = 0.4, s_var: float = 0.4) -> torch.Tensor:
+    """ColorJitterTorch for a float batch [B,3,H,W] in 0..255: brightness, contrast, saturation per sample."""
+    def alpha(var):
+        return 1 + torch.empty(image.shape[0], 1, 1, 1).uniform_(-var, var)
+
+    def gray(img):
+        g = (img[:, 0] * 0.299 + img[:, 1] * 0.587 + img[:, 2] * 0.114).clamp(0, 255)
+        return g.unsqueeze(1).expand_as(img)
+
+    a = alpha(b_var)
+    image = (image * a).clamp(0, 255)
+    a = alpha(c_var)
+    mean = gray(image).mean(dim=(1, 2, 3), keepdim=True)
+    image = (image * a + (1 - a) * mean).clamp(0, 255)
+    a = alpha(s_var)
+    return (image * a + (1 - a) * gray(image)).clamp(0, 255)
+
+
+class BatchAugment:
+    """
+    collate_fn turning cropped raw samples into a training batch: rotations,
+    heatmap rendering, colour jitter and the [-1, 1] normalization of
+    FloorplanSVG.transform, each applied to the whole batch.
+    """
+
+    def __init__(self, size: int = 256, rotate: bool = True, jitter: bool = True):
+        self.size = size
+        self.rotate = rotate
+        self.jitter = jitter
+
+    def __call__(self, samples: list[dict]) -> dict:
+        image = torch.from_numpy(np.stack([s["image"] for s in samples]))
+        label = torch.from_numpy(np.stack([s["label"] for s in samples]))
+        points = [s["points"] for s in samples]
+        if self.rotate:
+            image, label, points = rotate_batch(image, label, points)
+
+        heatmaps = render_heatmaps(points, [s["scale"] for s in samples], self.size)
+        image = image.float()
+        if self.jitter:
+            image = color_jitter_batch(image)
+        return {
+            "image": 2 * (image / 255.0) - 1,
+            "label": torch.cat((heatmaps, label.float()), dim=1),
+        }
@@ -0,0 +1,425 @@
+from __future__ import annotations
+
+import argparse
+import os
+from pathlib import Path
+import time
+import uuid
+import warnings
+
+import numpy as np
+import torch
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+from .augment import HEATMAP_CHANNELS, TURN_CHANNELS
+from .cache import file_sha256
+from .model_loader import load_cubicasa_model
+from .preprocess import pick_seg_tensor
+from .wall_head import HEADS, wall_head
+
+# eager        the checkpoint as loaded (default)
+# fused        BatchNorms folded into the preceding convolutions
+# torchscript  fused, traced and frozen with TorchScript
+# onnx         ONNX Runtime on CPU, fp32
+# onnx-int8    ONNX Runtime on CPU, int8 weights/activations (static QDQ, calibrated)
+BACKENDS = ("eager", "fused", "torchscript", "onnx", "onnx-int8")
+
+# The hourglass only has exact-size skip connections (and so a traced graph is
+# only valid) for inputs whose sides are multiples of this; the full 1024 px
+# input and tiles (see PipelineOptions.tile_size) always are.
+INPUT_MULTIPLE = 64
+
+# Calibration runs on tiles of the network input, at the same pixel scale: the
+# ranges of every activation of a full 1024 px input take several GB.
+CALIBRATION_TILE = 256
+CALIBRATION_TILES_PER_PAGE = 4  # the busiest ones
+SYNTHETIC_CALIBRATION_PAGES = 4
+
+
+def fold_batchnorm(model: torch.nn.Module) -> torch.nn.Module:
+    """
+    Folds every BatchNorm that directly follows a convolution into it (in place,
+    eval mode only). The pre-activation BatchNorm at the start of each Residual
+    block follows a residual sum and stays.
+    """
+    from floortrans.models.hg_furukawa_original import Residual
+
+    pairs = [(model, "conv1_", "bn1"), (model, "conv2_", "bn2"), (model, "conv3_", "bn3")]
+    for m in model.modules():
+        if isinstance(m, Residual):
+            pairs += [(m, "conv1", "bn1"), (m, "conv2", "bn2")]
+
+    for owner, conv, bn in pairs:
+        setattr(owner, conv, fuse_conv_bn_eval(getattr(owner, conv), getattr(owner, bn)))
+        setattr(owner, bn, torch.nn.Identity())
+    return model
+
+
+class TorchBackend:
+    """Calls a torch module, optionally feeding it channels-last inputs."""
+
+    def __init__(self, module, channels_last: bool = False):
+        self.module = module
+        self.channels_last = channels_last
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        return self.module(x)
+
+
+class OrtBackend:
+    """ONNX Runtime session on CPU behind the `model(x) -> tensor` interface."""
+
+    def __init__(self, onnx_path: str, threads: int = 0):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError("The onnx backends need the onnx and onnxruntime packages") from e
+
+        so = ort.SessionOptions()
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            so.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(onnx_path), so, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        x = x.detach().cpu().numpy().astype(np.float32, copy=False)
+        return torch.from_numpy(self.session.run(None, {self.input_name: x})[0])
+
+
+class RotationTTA:
+    """
+    Test-time augmentation: the mean of the model's outputs for the input
+    turned 0, 1, 2 and 3 quarter turns, each turned back, as CubiCasa
+    evaluates (metrics.get_evaluation_tensors). A junction heatmap turns into
+    another junction type, so the heatmap channels are mapped back as well.
+    """
+
+    def __init__(self, model, turns: tuple[int, ...] = (0, 1, 2, 3)):
+        self.model = model
+        self.turns = turns
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        total = None
+        for k in self.turns:
+            # k clockwise turns in, k counter-clockwise out
+            out = torch.rot90(pick_seg_tensor(self.model(torch.rot90(x, -k, dims=(2, 3)))), k, dims=(2, 3))
+            if out.shape[1] > HEATMAP_CHANNELS:
+                turned = np.arange(HEATMAP_CHANNELS)
+                for _ in range(k):
+                    turned = TURN_CHANNELS[turned]
+                out = torch.cat([out[:, torch.from_numpy(turned)], out[:, HEATMAP_CHANNELS:]], dim=1)
+            total = out if total is None else total + out
+        return total / len(self.turns)
+
+
+def export_torchscript(model: torch.nn.Module, size: int = 1024):
+    """Traces and freezes a (preferably fused) model for inputs of multiples of INPUT_MULTIPLE."""
+    example = torch.zeros(1, 3, size, size)
+    with torch.no_grad(), warnings.catch_warnings():
+        # the skip connections' shape test is traced as "equal", see INPUT_MULTIPLE
+        warnings.simplefilter("ignore", torch.jit.TracerWarning)
+        traced = torch.jit.trace(model, example, check_trace=False)
+    return torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+
+
+def _replace_when_written(path: str, write) -> str:
+    """
+    Calls write(tmp) with a temp path next to `path` and renames it into place,
+    so workers exporting at the same time never load a half-written model.
+    """
+    p = Path(path)
+    tmp = p.with_name(f"{p.stem}.tmp-{uuid.uuid4().hex}{p.suffix}")
+    try:
+        write(str(tmp))
+        os.replace(tmp, p)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return path
+
+
+def export_onnx(model: torch.nn.Module, path: str, size: int = 256, opset: int = 17) -> str:
+    """Exports with dynamic batch and spatial axes (sides must stay multiples of INPUT_MULTIPLE)."""
+    example = torch.zeros(1, 3, size, size)
+    axes = {0: "batch", 2: "height", 3: "width"}
+
+    def write(tmp):
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                example,
+                tmp,
+                input_names=["image"],
+                output_names=["seg"],
+                dynamic_axes={"image": axes, "seg": axes},
+                opset_version=opset,
+                dynamo=False,
+            )
+
+    return _replace_when_written(path, write)
+
+
+def quantize_onnx(fp32_path: str, int8_path: str, calibration: list[np.ndarray]) -> str:
+    """
+    int8 ONNX model: static QDQ quantization (per-channel int8 weights, uint8
+    activations) with activation ranges calibrated on `calibration`, network
+    inputs [1,3,H,W] float32 (see calibration_inputs).
+    """
+    try:
+        from onnxruntime import quantization as q
+    except ImportError as e:
+        raise RuntimeError("The onnx backends need the onnx and onnxruntime packages") from e
+    if not calibration:
+        raise ValueError("int8 quantization needs calibration inputs")
+
+    class Reader(q.CalibrationDataReader):
+        def __init__(self):
+            self._it = iter(calibration)
+
+        def get_next(self):
+            x = next(self._it, None)
+            return None if x is None else {"image": x}
+
+    def write(tmp):
+        q.quantize_static(
+            fp32_path,
+            tmp,
+            Reader(),
+            quant_format=q.QuantFormat.QDQ,
+            activation_type=q.QuantType.QUInt8,
+            weight_type=q.QuantType.QInt8,
+            per_channel=True,
+        )
+
+    return _replace_when_written(int8_path, write)
+
+
+def artifact_paths(weights_path: str, export_dir: str, head: str = "full") -> dict[str, Path]:
+    """Exported model files, named by the checkpoint hash so they never go stale."""
+    stem = file_sha256(weights_path)[:16]
+    if head != "full":
+        stem += f".{head}"
+    d = Path(export_dir)
+    return {"onnx": d / f"{stem}.onnx", "onnx-int8": d / f"{stem}.int8.onnx"}
+
+
+def load_backend(
+    weights_path: str,
+    device: str,
+    backend: str = "eager",
+    channels_last: bool = False,
+    export_dir: str | None = None,
+    threads: int = 0,
+    head: str = "full",
+    wall_label: int = 23,
+    quantize: bool = False,
+):
+    """
+    Loads the checkpoint and prepares it for `backend` (see BACKENDS). The
+    result is called like the model, model(x) -> segmentation tensor, or with
+    a wall `head` (see wall_head.HEADS) the single-channel wall margin.
+
+    The onnx backends run on CPU from files in export_dir. The fp32 model is
+    exported on first use; the int8 one has to be built beforehand with
+    `python -m app.backends export` (calibrating takes minutes, workers only
+    load it), unless quantize is set, as the offline tools do.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {BACKENDS}, got {backend!r}")
+
+    model = load_cubicasa_model(weights_path, device=device)
+    if backend == "eager":
+        model = wall_head(model, head, wall_label)
+        if channels_last:
+            return TorchBackend(model.to(memory_format=torch.channels_last), channels_last=True)
+        return model
+
+    model = wall_head(fold_batchnorm(model), head, wall_label)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    if backend == "fused":
+        return TorchBackend(model, channels_last=channels_last)
+    if backend == "torchscript":
+        return TorchBackend(export_torchscript(model), channels_last=channels_last)
+
+    if export_dir is None:
+        raise ValueError("The onnx backends need an export_dir")
+    paths = artifact_paths(weights_path, export_dir, head)
+    Path(export_dir).mkdir(parents=True, exist_ok=True)
+    if not paths["onnx"].exists():
+        export_onnx(model.to(memory_format=torch.contiguous_format).cpu(), str(paths["onnx"]))
+    if backend == "onnx-int8" and not paths["onnx-int8"].exists():
+        if not quantize:
+            raise FileNotFoundError(
+                f"No int8 model {paths['onnx-int8']}, build it with: python -m app.backends export "
+                f"--weights {weights_path} --out {export_dir} --head {head}"
+            )
+        quantize_onnx(str(paths["onnx"]), str(paths["onnx-int8"]), synthetic_calibration_inputs())
+    return OrtBackend(str(paths[backend]), threads=threads)
+
+
+def calibration_inputs(pdfs: list[str | bytes], max_pages: int = 16) -> list[np.ndarray]:
+    """
+    Calibration inputs from the first max_pages pages of the given PDFs (paths
+    or bytes): of each page's network input, as the pipeline builds it, the
+    CALIBRATION_TILES_PER_PAGE CALIBRATION_TILE tiles with the most contrast.
+    """
+    from .pdf_render import open_pdf
+    from .pipeline import NETWORK_SIZE, render_for_pipeline
+    from .preprocess import preprocess_image_rgb
+
+    out = []
+    pages = 0
+    for pdf in pdfs:
+        doc = open_pdf(pdf_bytes=pdf) if isinstance(pdf, bytes) else open_pdf(pdf)
+        try:
+            for i in range(len(doc)):
+                if pages >= max_pages:
+                    return out
+                rgb = render_for_pipeline(doc, i)[0]
+                x = preprocess_image_rgb(rgb, target_long_side=NETWORK_SIZE)[2].numpy()
+                t = CALIBRATION_TILE
+                tiles = [
+                    x[:, :, y : y + t, z : z + t]
+                    for y in range(0, x.shape[2] - t + 1, t)
+                    for z in range(0, x.shape[3] - t + 1, t)
+                ]
+                tiles.sort(key=lambda tile: -float(tile.std()))
+                out += [np.ascontiguousarray(tile) for tile in tiles[:CALIBRATION_TILES_PER_PAGE]]
+                pages += 1
+        finally:
+            doc.close()
+    return out
+
+
+def synthetic_calibration_inputs(max_pages: int = SYNTHETIC_CALIBRATION_PAGES) -> list[np.ndarray]:
+    """calibration_inputs on synthetic plans (see synthetic.py) (each sheet size, sparse or dense), when no real sheets are given."""
+    from .synthetic import DENSITIES, SHEETS, PlanSpec, synthetic_plan
+
+    rooms = [*DENSITIES.values()] * len(SHEETS)
+    specs = [PlanSpec(sheet, rooms[i], seed=i) for i, sheet in enumerate(SHEETS.values())]
+    return calibration_inputs([synthetic_plan(spec, dpi=72)[0] for spec in specs[:max_pages]], max_pages)
+
+
+def check_backend(
+    weights_path: str,
+    backend: str,
+    pdf_paths: list[str],
+    channels_last: bool = False,
+    export_dir: str | None = None,
+    max_pages: int = 8,
+) -> list[dict]:
+    """
+    Runs the eager model and `backend` on the same pages and compares their
+    wall masks (IoU, share of differing pixels), total wall length at 3/16"
+    and forward time. One dict per page.
+    """
+    from .instrumentation import Timings
+    from .pdf_render import open_pdf
+    from .pipeline import DPI, _full_wall_mask, render_for_pipeline
+    from .units import feet_per_pixel_from_scale, parse_inches_per_foot
+    from .wall_lines import extract_wall_lines, remove_sheet_margins
+
+    reference = load_cubicasa_model(weights_path, device="cpu")
+    candidate = load_backend(
+        weights_path, "cpu", backend, channels_last=channels_last, export_dir=export_dir, quantize=True
+    )
+    fpp = feet_per_pixel_from_scale(DPI, parse_inches_per_foot("3/16"))
+
+    def run(model, rgb, page_size):
+        timings = Timings()
+        with torch.no_grad():
+            wall = remove_sheet_margins(_full_wall_mask(rgb, model, "cpu", timings, out_size=page_size)[0])
+        lines = extract_wall_lines(wall)
+        total_ft = float(np.hypot(lines[:, 2] - lines[:, 0], lines[:, 3] - lines[:, 1]).sum()) * fpp
+        return wall > 0, total_ft, timings.stages["inference"]["wall_s"]
+
+    rows = []
+    for path in pdf_paths:
+        doc = open_pdf(path)
+        try:
+            for i in range(len(doc)):
+                if len(rows) >= max_pages:
+                    return rows
+                rgb, _origin, page_size, _region = render_for_pipeline(doc, i)
+                ref_mask, ref_ft, ref_s = run(reference, rgb, page_size)
+                mask, ft, s = run(candidate, rgb, page_size)
+                union = np.count_nonzero(ref_mask | mask)
+                rows.append(
+                    {
+                        "pdf": path,
+                        "page": i,
+                        "iou": np.count_nonzero(ref_mask & mask) / union if union else 1.0,
+                        "pixels_differing": float(np.mean(ref_mask != mask)),
+                        "total_ft_eager": ref_ft,
+                        "total_ft": ft,
+                        "forward_s_eager": ref_s,
+                        "forward_s": s,
+                    }
+                )
+        finally:
+            doc.close()
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.backends", description="Export and check inference backends")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    ex = sub.add_parser("export", help="write the ONNX fp32 and int8 models")
+    ex.add_argument("--weights", required=True)
+    ex.add_argument("--out", required=True, help="export directory (WALL_EXPORT_DIR)")
+    ex.add_argument("--head", choices=HEADS, default="full", help="the WALL_HEAD the server runs with")
+    ex.add_argument("--calib", nargs="*", default=[], help="PDFs whose pages calibrate the int8 model (default synthetic plans)")
+    ex.add_argument("--calib-pages", type=int, default=16)
+
+    ck = sub.add_parser("check", help="compare a backend's wall masks with the eager model")
+    ck.add_argument("--weights", required=True)
+    ck.add_argument("--backend", required=True, choices=BACKENDS)
+    ck.add_argument("--channels-last", action="store_true")
+    ck.add_argument("--export-dir", default=None)
+    ck.add_argument("--max-pages", type=int, default=8)
+    ck.add_argument("pdfs", nargs="+")
+
+    args = parser.parse_args(argv)
+
+    if args.cmd == "export":
+        from .pipeline import WALL_LABEL
+
+        paths = artifact_paths(args.weights, args.out, args.head)
+        Path(args.out).mkdir(parents=True, exist_ok=True)
+        model = wall_head(fold_batchnorm(load_cubicasa_model(args.weights, device="cpu")), args.head, WALL_LABEL)
+        export_onnx(model, str(paths["onnx"]))
+        calibration = calibration_inputs(args.calib, args.calib_pages) if args.calib else synthetic_calibration_inputs()
+        quantize_onnx(str(paths["onnx"]), str(paths["onnx-int8"]), calibration)
+        print(f"wrote {paths['onnx']} and {paths['onnx-int8']}")
+        return
+
+    t0 = time.perf_counter()
+    rows = check_backend(
+        args.weights,
+        args.backend,
+        args.pdfs,
+        channels_last=args.channels_last,
+        export_dir=args.export_dir,
+        max_pages=args.max_pages,
+    )
+    print("pdf\tpage\tiou\tdiff_px\ttotal_ft_eager\ttotal_ft\tforward_s_eager\tforward_s")
+    for r in rows:
+        print(
+            f"{r['pdf']}\t{r['page']}\t{r['iou']:.4f}\t{r['pixels_differing']:.5f}\t"
+            f"{r['total_ft_eager']:.1f}\t{r['total_ft']:.1f}\t{r['forward_s_eager']:.2f}\t{r['forward_s']:.2f}"
+        )
+    if rows:
+        print(
+            f"mean iou {np.mean([r['iou'] for r in rows]):.4f}, "
+            f"forward speedup {np.sum([r['forward_s_eager'] for r in rows]) / np.sum([r['forward_s'] for r in rows]):.2f}x, "
+            f"{time.perf_counter() - t0:.1f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
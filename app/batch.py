@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import argparse
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+import json
+import os
+from pathlib import Path
+import sys
+import time
+
+import torch
+
+from .backends import BACKENDS
+from .jobs import PoolUnavailableError, QueueFullError, WorkerPool
+from .pipeline import INFERENCE_MODES, LINE_ENGINES, PipelineOptions, estimate_document_from_pdf
+from .wall_head import HEADS
+
+APP_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_WEIGHTS = APP_DIR / "weights" / "model_best_val_loss_var.pkl"
+
+
+def list_pdfs(inputs: list[str]) -> list[str]:
+    """
+    PDFs to process, in a stable order: directories are searched recursively
+    for *.pdf, .pdf files are taken as they are, any other file is a manifest
+    with one path per line (blank lines and # comments are skipped).
+    """
+    out = []
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            out.extend(sorted(str(p) for p in path.rglob("*") if p.suffix.lower() == ".pdf" and p.is_file()))
+        elif path.suffix.lower() == ".pdf":
+            out.append(str(path))
+        else:
+            for line in path.read_text(encoding="utf-8").splitlines():
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    out.append(line)
+    return list(dict.fromkeys(out))
+
+
+def read_records(out_path: str) -> dict[str, dict]:
+    """
+    The last record of every PDF in a JSONL output. A line cut off by an
+    interrupted run is truncated away so appending continues cleanly.
+    """
+    path = Path(out_path)
+    if not path.exists():
+        return {}
+    data = path.read_bytes()
+    if data and not data.endswith(b"\n"):
+        data = data[: data.rfind(b"\n") + 1]
+        with open(path, "r+b") as f:
+            f.truncate(len(data))
+
+    records = {}
+    for line in data.decode("utf-8").splitlines():
+        if line.strip():
+            rec = json.loads(line)
+            records[rec["pdf"]] = rec
+    return records
+
+
+def document_record(pdf: str, result: dict, keep_lines: bool = False) -> dict:
+    """One JSONL line for a processed document: totals plus a summary per page."""
+    pages = []
+    for r in result["pages"]:
+        page = {
+            "page_index": r["page_index"],
+            "total_ft": r["total_ft"],
+            "outer_ft": r["outer_ft"],
+            "inner_ft": r["inner_ft"],
+            "line_count": len(r["lines"]),
+        }
+        if keep_lines:
+            page["lines"] = r["lines"].tolist()
+        pages.append(page)
+    return {
+        "pdf": pdf,
+        "status": "done",
+        "page_count": result["page_count"],
+        "scale_inch_per_foot": result["scale_inch_per_foot"],
+        "total_ft": result["total_ft"],
+        "outer_ft": result["outer_ft"],
+        "inner_ft": result["inner_ft"],
+        "seconds": result["timings"]["total_s"],
+        "pages": pages,
+    }
+
+
+def run_batch(
+    pdfs: list[str],
+    out_path: str,
+    pool: WorkerPool,
+    pages: str = "all",
+    scale_inch_per_foot: str = "3/16",
+    options: PipelineOptions | None = None,
+    retry_failed: bool = False,
+    keep_lines: bool = False,
+    log=sys.stderr,
+) -> dict:
+    """
+    Estimates every PDF not yet in out_path (JSONL, one record per document)
+    and appends its record as soon as it finishes, so an interrupted run
+    resumes where it stopped. Failed documents are recorded too and only
+    retried with retry_failed; if a worker process dies (or can't load the
+    model) the run stops without recording the documents it was given
+    (RuntimeError, or PoolUnavailableError when the pool can't take jobs).
+    Returns run totals including pages/s.
+    """
+    previous = read_records(out_path)
+    todo = deque(
+        p for p in pdfs
+        if p not in previous or (retry_failed and previous[p]["status"] != "done")
+    )
+    skipped = len(pdfs) - len(todo)
+    total = len(todo)
+    print(f"{total} documents to process, {skipped} already done", file=log)
+
+    t0 = time.perf_counter()
+    done = failed = page_count = 0
+    pending = {}
+    with open(out_path, "a", encoding="utf-8") as out:
+        while todo or pending:
+            # keep the pool full, but never beyond what it accepts
+            while todo and len(pending) < pool.capacity:
+                pdf = todo[0]
+                try:
+                    job = pool.submit(
+                        estimate_document_from_pdf,
+                        pdf_path=pdf,
+                        pages=pages,
+                        scale_inch_per_foot=scale_inch_per_foot,
+                        options=options,
+                        max_parallel_pages=1,
+                    )
+                except QueueFullError:
+                    break
+                todo.popleft()
+                pending[job.future] = pdf
+            finished, _ = wait(list(pending), timeout=1.0, return_when=FIRST_COMPLETED)
+
+            for future in finished:
+                pdf = pending.pop(future)
+                if isinstance(future.exception(), BrokenProcessPool):
+                    raise RuntimeError(f"A worker process died while processing {pdf}, rerun to resume") from future.exception()
+                if future.exception() is None:
+                    record = document_record(pdf, future.result(), keep_lines)
+                    done += 1
+                    page_count += record["page_count"]
+                else:
+                    record = {"pdf": pdf, "status": "failed", "error": repr(future.exception())}
+                    failed += 1
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                os.fsync(out.fileno())
+
+                elapsed = time.perf_counter() - t0
+                print(
+                    f"[{done + failed}/{total}] {pdf}: {record['status']}, "
+                    f"{page_count} pages in {elapsed:.1f}s ({page_count / elapsed:.2f} pages/s)",
+                    file=log,
+                )
+
+    elapsed = time.perf_counter() - t0
+    return {
+        "documents": len(pdfs),
+        "skipped": skipped,
+        "done": done,
+        "failed": failed,
+        "pages": page_count,
+        "seconds": elapsed,
+        "pages_per_s": page_count / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def write_parquet(jsonl_path: str, parquet_path: str):
+    """One row per page of every finished document in the JSONL output."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("Parquet output needs the pyarrow package") from e
+
+    rows = []
+    for rec in read_records(jsonl_path).values():
+        if rec["status"] != "done":
+            continue
+        for page in rec["pages"]:
+            rows.append(
+                {
+                    "pdf": rec["pdf"],
+                    "page_index": page["page_index"],
+                    "scale_inch_per_foot": rec["scale_inch_per_foot"],
+                    "total_ft": page["total_ft"],
+                    "outer_ft": page["outer_ft"],
+                    "inner_ft": page["inner_ft"],
+                    "line_count": page["line_count"],
+                }
+            )
+    pq.write_table(pa.Table.from_pylist(rows), parquet_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m app.batch",
+        description="Estimate wall lengths of many PDFs offline; rerun with the same --out to resume",
+    )
+    parser.add_argument("inputs", nargs="+", help="directories (searched for *.pdf), PDFs or manifest files")
+    parser.add_argument("--out", required=True, help="JSONL output, one record per document")
+    parser.add_argument("--parquet", default=None, help="also write one row per page to this Parquet file")
+    parser.add_argument("--pages", default="all")
+    parser.add_argument("--scale", default="3/16", help="scale_inch_per_foot")
+    parser.add_argument("--lines", action="store_true", help="keep the wall line coordinates in the records")
+    parser.add_argument("--retry-failed", action="store_true")
+
+    parser.add_argument("--weights", default=os.environ.get("WALL_WEIGHTS_PATH", str(DEFAULT_WEIGHTS)))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--mode", choices=("process", "thread"), default="process")
+    parser.add_argument("--timeout-s", type=float, default=None, help="per-document timeout")
+    parser.add_argument("--backend", choices=BACKENDS, default="eager")
+    parser.add_argument("--head", choices=HEADS, default="full")
+    parser.add_argument("--channels-last", action="store_true")
+    parser.add_argument("--export-dir", default=str(APP_DIR / "weights" / "export"))
+
+    parser.add_argument("--inference", choices=INFERENCE_MODES, default="full")
+    parser.add_argument("--tile-dpi", type=int, default=150)
+    parser.add_argument("--roi", action="store_true")
+    parser.add_argument("--line-engine", choices=LINE_ENGINES, default="hough")
+    parser.add_argument("--network-size", type=int, default=1024)
+    parser.add_argument("--tta", action="store_true")
+    args = parser.parse_args(argv)
+
+    options = PipelineOptions(
+        inference=args.inference,
+        tile_dpi=args.tile_dpi,
+        roi=args.roi,
+        line_engine=args.line_engine,
+        network_size=args.network_size,
+        tta=args.tta,
+    )
+    pdfs = list_pdfs(args.inputs)
+    pool = WorkerPool(
+        args.weights,
+        device="cuda" if torch.cuda.is_available() else "cpu",
+        workers=args.workers,
+        mode=args.mode,
+        queue_size=args.workers,
+        timeout_s=args.timeout_s,
+        backend=args.backend,
+        channels_last=args.channels_last,
+        export_dir=args.export_dir,
+        head=args.head,
+    )
+    try:
+        summary = run_batch(
+            pdfs,
+            args.out,
+            pool,
+            pages=args.pages,
+            scale_inch_per_foot=args.scale,
+            options=options,
+            retry_failed=args.retry_failed,
+            keep_lines=args.lines,
+        )
+    except PoolUnavailableError as e:
+        parser.exit(1, f"{e}, rerun to resume\n")
+    finally:
+        pool.shutdown()
+    if args.parquet:
+        write_parquet(args.out, args.parquet)
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
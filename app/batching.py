@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+from collections import Counter
+import queue
+import threading
+import time
+
+import torch
+
+from .preprocess import pick_seg_tensor
+
+
+class _Request:
+    __slots__ = ("x", "out", "error", "done", "enqueued_at")
+
+    def __init__(self, x: torch.Tensor):
+        self.x = x
+        self.out: torch.Tensor | None = None
+        self.error: BaseException | None = None
+        self.done = threading.Event()
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """
+    Drop-in replacement for `model(x)` that batches concurrent callers.
+
+    Calls from several threads are collected for up to max_wait_ms or until
+    max_batch images are queued, inputs of the same shape are stacked into one
+    forward pass and each caller gets back its own slice of the segmentation
+    tensor. Only useful when several worker threads share one model.
+    """
+
+    def __init__(self, model: torch.nn.Module, max_batch: int = 4, max_wait_ms: float = 10.0):
+        self.model = model
+        self.max_batch = max(1, max_batch)
+        self.max_wait_s = max(0.0, max_wait_ms) / 1000.0
+
+        self._queue: queue.Queue[_Request] = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes: Counter[int] = Counter()
+        self._images = 0
+        self._wait_s = 0.0
+
+        self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        req = _Request(x)
+        self._queue.put(req)
+        req.done.wait()
+        if req.error is not None:
+            raise req.error
+        return req.out
+
+    def stats(self) -> dict:
+        with self._lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait_s * 1000.0,
+                "batches": batches,
+                "images": self._images,
+                "mean_batch_size": self._images / batches if batches else 0.0,
+                "mean_wait_ms": 1000.0 * self._wait_s / self._images if self._images else 0.0,
+                "batch_size_counts": dict(sorted(self._batch_sizes.items())),
+            }
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            n_images = batch[0].x.shape[0]
+            deadline = time.perf_counter() + self.max_wait_s
+            while n_images < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    req = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(req)
+                n_images += req.x.shape[0]
+
+            groups: dict[tuple, list[_Request]] = {}
+            for req in batch:
+                groups.setdefault((tuple(req.x.shape[1:]), req.x.device), []).append(req)
+            for reqs in groups.values():
+                self._run(reqs)
+
+    def _run(self, reqs: list[_Request]):
+        started = time.perf_counter()
+        n_images = sum(r.x.shape[0] for r in reqs)
+        try:
+            x = reqs[0].x if len(reqs) == 1 else torch.cat([r.x for r in reqs], dim=0)
+            with torch.no_grad():
+                seg = pick_seg_tensor(self.model(x))
+            outs = torch.split(seg, [r.x.shape[0] for r in reqs], dim=0)
+            for r, o in zip(reqs, outs):
+                r.out = o
+        except BaseException as e:  # hand the failure to every caller in the batch
+            for r in reqs:
+                r.error = e
+
+        with self._lock:
+            self._batch_sizes[n_images] += 1
+            self._images += n_images
+            for r in reqs:
+                self._wait_s += (started - r.enqueued_at) * r.x.shape[0]
+
+        for r in reqs:
+            r.done.set()
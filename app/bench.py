@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from pathlib import Path
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from .buffers import scratch
+from .geometry import PageGeometry
+from .instrumentation import peak_rss_bytes
+from .junctions import DIRECTIONS, junction_wall_lines
+from .outer_contour import (
+    default_pre_dilate_k,
+    get_building_outer_contour,
+    get_building_outer_contour_downsampled,
+    remove_border_touching_components,
+)
+from .pdf_render import open_pdf, render_page, render_pdf_page
+from .pdf_vectors import page_segments
+from .pipeline import (
+    CONTOUR_DOWNSAMPLE,
+    DPI,
+    NETWORK_SIZE,
+    WALL_LABEL,
+    estimate_lengths_from_pdf,
+    render_for_pipeline,
+)
+from .preprocess import pick_seg_tensor, preprocess_image_rgb
+from .results import render_overlay
+from .synthetic import DENSITIES, SHEETS, PlanSpec, synthetic_plan, wall_rects
+from .wall_lines import LINE_ENGINES, extract_wall_lines, wall_mask_from_pred
+
+APP_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = APP_DIR / "bench-results"
+
+STUB_CLASSES = 44
+
+
+def junction_heatmaps(spec: PlanSpec, width: int, height: int) -> np.ndarray:
+    """
+    The 13 wall junction heatmaps [13,height,width] of a synthetic plan drawn
+    at width x height: a blob at every grid point walls meet at, in the
+    channel of the directions they leave it in.
+    """
+    W, H = spec.sheet_in[0] * 72, spec.sheet_in[1] * 72
+    rects = np.array(wall_rects(spec))
+    t = spec.wall_in * 72
+    nx, ny = spec.rooms
+    xs = 0.22 * W + np.arange(nx + 1) * (0.68 * W / nx)
+    ys = 0.12 * H + np.arange(ny + 1) * (0.76 * H / ny)
+    sx, sy = width / W, height / H
+    yy, xx = np.mgrid[0:height, 0:width]
+    out = np.zeros((DIRECTIONS.shape[0], height, width), dtype=np.float32)
+
+    def on_wall(x, y):
+        return bool(((rects[:, 0] <= x) & (x <= rects[:, 2]) & (rects[:, 1] <= y) & (y <= rects[:, 3])).any())
+
+    for x in xs:
+        for y in ys:
+            dirs = [on_wall(x, y - 2 * t), on_wall(x + 2 * t, y), on_wall(x, y + 2 * t), on_wall(x - 2 * t, y)]
+            c = np.nonzero((DIRECTIONS == dirs).all(axis=1))[0]
+            if len(c):
+                blob = np.exp(-((xx - x * sx) ** 2 + (yy - y * sy) ** 2) / 8.0)
+                out[c[0]] = np.maximum(out[c[0]], blob)
+    return out
+
+
+class StubModel(torch.nn.Module):
+    """
+    Stands in for the network, with its output layout: the wall class wins
+    wherever the input stays dark under a 5x5 average, so filled walls come out
+    as walls and thin lines and text mostly don't. No weights needed.
+    """
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        dark = F.avg_pool2d(1.0 - x.mean(dim=1, keepdim=True), 5, stride=1, padding=2)
+        out = x.new_zeros(x.shape[0], STUB_CLASSES, x.shape[2], x.shape[3])
+        out[:, WALL_LABEL] = (dark[:, 0] - 0.5) * 10.0
+        return out
+
+
+def measure(fn, repeat: int = 3):
+    """
+    Runs fn repeat times for wall time, then once more under tracemalloc for
+    the peak memory allocated through Python and numpy (not torch's allocator).
+    Returns (stats, result of the last call).
+    """
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - t0)
+    del out
+    tracemalloc.start()
+    try:
+        out = fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    stats = {"median_s": float(np.median(times)), "min_s": float(np.min(times)), "runs": repeat, "peak_mb": peak / 2**20}
+    return stats, out
+
+
+def bench_plan(spec: PlanSpec, repeat: int = 3, engines=LINE_ENGINES, log=sys.stderr) -> list[dict]:
+    """Times every pipeline stage on one synthetic plan, one row per stage."""
+    pdf, mask = synthetic_plan(spec)
+    H, W = mask.shape
+    model = StubModel().eval()
+    rows = []
+
+    def run(stage, fn):
+        stats, out = measure(fn, repeat)
+        rows.append({"case": spec.name, "stage": stage, **stats})
+        print(f"{spec.name:28s} {stage:22s} {stats['median_s'] * 1000:9.1f} ms {stats['peak_mb']:8.1f} MB", file=log)
+        return out
+
+    run("render_pdf_page_300dpi", lambda: render_pdf_page(None, DPI, 0, pdf_bytes=pdf))
+    doc = open_pdf(pdf_bytes=pdf)
+    try:
+        rgb = run("render_for_pipeline", lambda: render_for_pipeline(doc, 0)[0])
+        segments = run("vector_paths", lambda: page_segments(doc, 0, DPI))
+        rgb_overlay = render_page(doc, 100, 0)
+    finally:
+        doc.close()
+
+    _orig, _pad, x, (nh, nw) = run("preprocess_image_rgb", lambda: preprocess_image_rgb(rgb, NETWORK_SIZE))
+
+    def infer():
+        with torch.no_grad():
+            return pick_seg_tensor(model(x))[0].argmax(dim=0).numpy()[:nh, :nw]
+
+    pred = run("inference_stub", infer)
+    run("wall_mask_from_pred", lambda: wall_mask_from_pred(pred, WALL_LABEL, W, H))
+
+    # the stub's output with heatmaps at the plan's junctions; lines scaled to the mask
+    with torch.no_grad():
+        logits = pick_seg_tensor(model(x))[0].numpy()[:, :nh, :nw].copy()
+    logits[: DIRECTIONS.shape[0]] = junction_heatmaps(spec, nw, nh)
+    junction_lines = run("junctions", lambda: junction_wall_lines(logits))
+    junction_lines = (junction_lines + 0.5) * (W / nw, H / nh, W / nw, H / nh) - 0.5
+
+    # the geometry stages run on the exact synthetic mask, independent of the stub
+    lines = None
+    for engine in engines:
+        out = run(
+            f"wall_lines_{engine}",
+            lambda: extract_wall_lines(
+                mask, engine=engine, vector_segments_in=segments, junction_lines_in=junction_lines
+            ),
+        )
+        if lines is None:
+            lines = out
+
+    no_border = run("border_components", lambda: remove_border_touching_components(mask))
+    pre_dilate_k = default_pre_dilate_k(H, W)
+    run("outer_contour_full", lambda: get_building_outer_contour(no_border, 121, 2, pre_dilate_k))
+    contour = run(
+        "outer_contour",
+        lambda: get_building_outer_contour_downsampled(no_border, 121, 2, pre_dilate_k, factor=CONTOUR_DOWNSAMPLE)[0],
+    )
+    geom = PageGeometry(width=W, height=H, dpi=DPI, lines=lines, contour=contour)
+    run("overlays_100dpi", lambda: [render_overlay(rgb_overlay, geom, kind, 100) for kind in ("lines", "outer")])
+    run("end_to_end", lambda: estimate_lengths_from_pdf(None, model, "cpu", pdf_bytes=pdf))
+    return rows
+
+
+def _git_commit() -> str | None:
+    try:
+        sha = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--", "app"], cwd=APP_DIR, capture_output=True, text=True)
+        return sha + ("-dirty" if dirty.stdout.strip() else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(sizes: list[str], densities: list[str], repeat: int = 3, engines=LINE_ENGINES) -> dict:
+    rows = []
+    for size in sizes:
+        for density in densities:
+            rows.extend(bench_plan(PlanSpec(sheet_in=SHEETS[size], rooms=DENSITIES[density]), repeat, engines))
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "torch": torch.__version__,
+            "opencv": cv2.__version__,
+            "cpus": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+            "peak_rss_mb": peak_rss_bytes() / 2**20,
+            "buffers": scratch.stats(),
+        },
+        "results": rows,
+    }
+
+
+def compare(base: dict, new: dict, threshold: float = 0.1, min_delta_s: float = 0.005) -> tuple[list[str], bool]:
+    """
+    Report lines per (case, stage) in both runs and whether any stage got slower
+    by more than threshold (relative) and min_delta_s (absolute).
+    """
+    old = {(r["case"], r["stage"]): r for r in base["results"]}
+    lines = [f"{'case':28s} {'stage':22s} {'base ms':>9s} {'new ms':>9s} {'ratio':>6s} {'base MB':>8s} {'new MB':>8s}"]
+    regressed = False
+    for r in new["results"]:
+        b = old.get((r["case"], r["stage"]))
+        if b is None:
+            continue
+        ratio = r["median_s"] / b["median_s"] if b["median_s"] > 0 else float("inf")
+        slower = ratio > 1 + threshold and r["median_s"] - b["median_s"] > min_delta_s
+        regressed |= slower
+        lines.append(
+            f"{r['case']:28s} {r['stage']:22s} {b['median_s'] * 1000:9.1f} {r['median_s'] * 1000:9.1f} "
+            f"{ratio:6.2f} {b['peak_mb']:8.1f} {r['peak_mb']:8.1f}" + ("  SLOWER" if slower else "")
+        )
+    return lines, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.bench", description="Benchmark the pipeline stages on synthetic plans")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    rn = sub.add_parser("run", help="time every stage and store the results")
+    rn.add_argument("--sizes", default="24x18,36x24", help=f"comma separated, of {', '.join(SHEETS)}")
+    rn.add_argument("--densities", default="sparse,dense", help=f"comma separated, of {', '.join(DENSITIES)}")
+    rn.add_argument("--engines", default=",".join(LINE_ENGINES), help="line engines to time")
+    rn.add_argument("--repeat", type=int, default=3)
+    rn.add_argument("--out", default=None, help="results JSON (default bench-results/<commit>.json)")
+
+    cp = sub.add_parser("compare", help="compare two stored runs")
+    cp.add_argument("base")
+    cp.add_argument("new")
+    cp.add_argument("--threshold", type=float, default=0.1, help="relative slowdown reported as a regression")
+
+    args = parser.parse_args(argv)
+
+    if args.cmd == "compare":
+        lines, regressed = compare(
+            json.loads(Path(args.base).read_text()), json.loads(Path(args.new).read_text()), args.threshold
+        )
+        print("\n".join(lines))
+        sys.exit(1 if regressed else 0)
+
+    suite = run_suite(args.sizes.split(","), args.densities.split(","), args.repeat, args.engines.split(","))
+    out = Path(args.out) if args.out else RESULTS_DIR / f"{suite['meta']['commit'] or 'local'}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(suite, indent=1))
+    print(f"wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
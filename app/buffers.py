@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+import threading
+import weakref
+
+import numpy as np
+
+MIN_BLOCK = 1 << 16  # smallest bucket; arrays this small are cheap to allocate anyway
+
+
+def bucket_bytes(nbytes: int) -> int:
+    """nbytes rounded up to one of 8 sizes per power of two (at most 1/8 unused)."""
+    if nbytes <= MIN_BLOCK:
+        return MIN_BLOCK
+    step = (1 << (nbytes - 1).bit_length()) // 16
+    return -(-nbytes // step) * step
+
+
+class BufferPool:
+    """
+    Scratch arrays for the page-size intermediates of the pipeline (wall
+    masks, labels, distance maps, renders, overlays), so every page reuses
+    the blocks earlier pages freed instead of allocating and faulting in
+    hundreds of MB anew.
+
+    take() returns an array of the given shape and dtype backed by a free
+    block of its size bucket (see bucket_bytes), allocating one only when
+    there is none; give() hands it back. Up to max_bytes of free blocks are
+    kept, blocks given back beyond that are released. Arrays from take() must
+    not be used after give(); borrow() does both for a with block. An array
+    that is never given back is only counted as lent until it is garbage
+    collected, its block is not reused. Thread safe.
+    """
+
+    def __init__(self, max_bytes: int = 512 << 20):
+        self.max_bytes = max_bytes
+        self._free: dict[int, list[np.ndarray]] = {}
+        self._lent: dict[int, tuple[weakref.ref, weakref.finalize]] = {}  # id(array) -> (array, release)
+        # reentrant: a finalizer may run from garbage collection while the lock is held
+        self._lock = threading.RLock()
+        self.free_bytes = 0
+        self.lent_bytes = 0
+        self.peak_lent_bytes = 0
+        self.allocations = 0
+        self.reuses = 0
+
+    def take(self, shape, dtype=np.uint8, fill=None) -> np.ndarray:
+        """An array of shape and dtype, uninitialized unless `fill` is given."""
+        dtype = np.dtype(dtype)
+        shape = tuple(int(v) for v in np.atleast_1d(shape))
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        size = bucket_bytes(nbytes)
+        with self._lock:
+            blocks = self._free.get(size)
+            block = blocks.pop() if blocks else None
+            if block is not None:
+                self.free_bytes -= size
+                self.reuses += 1
+        if block is None:
+            block = np.empty(size, dtype=np.uint8)
+            with self._lock:
+                self.allocations += 1
+
+        out = block[:nbytes].view(dtype).reshape(shape)
+        with self._lock:
+            self._lent[id(out)] = (weakref.ref(out), weakref.finalize(out, self._release, id(out), block, False))
+            self.lent_bytes += size
+            self.peak_lent_bytes = max(self.peak_lent_bytes, self.lent_bytes)
+        if fill is not None:
+            out.fill(fill)
+        return out
+
+    def give(self, a: np.ndarray | None):
+        """Returns an array from take(); anything else (or None) is ignored."""
+        if a is None:
+            return
+        with self._lock:
+            lent = self._lent.get(id(a))
+            if lent is None or lent[0]() is not a:
+                return
+            detached = lent[1].detach()  # (array, _release, args, kwargs), None once collected
+            if detached is not None:
+                key, block, _reuse = detached[2]
+                self._release(key, block, True)
+
+    def _release(self, key: int, block: np.ndarray, reuse: bool):
+        with self._lock:
+            self._lent.pop(key, None)
+            self.lent_bytes -= block.nbytes
+            if reuse and self.free_bytes + block.nbytes <= self.max_bytes:
+                self._free.setdefault(block.nbytes, []).append(block)
+                self.free_bytes += block.nbytes
+
+    @contextmanager
+    def borrow(self, shape, dtype=np.uint8, fill=None):
+        a = self.take(shape, dtype, fill)
+        try:
+            yield a
+        finally:
+            self.give(a)
+
+    def clear(self):
+        """Releases the free blocks (lent ones stay lent)."""
+        with self._lock:
+            self._free.clear()
+            self.free_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_bytes": self.max_bytes,
+                "free_bytes": self.free_bytes,
+                "lent_bytes": self.lent_bytes,
+                "peak_lent_bytes": self.peak_lent_bytes,
+                "allocations": self.allocations,
+                "reuses": self.reuses,
+            }
+
+
+# the process' pool, sized by the worker pool (WALL_BUFFER_POOL_MB)
+scratch = BufferPool()
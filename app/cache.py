@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import threading
+import time
+import uuid
+
+from .geometry import PageGeometry
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def bytes_sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class GeometryCache:
+    """
+    Content-addressed disk cache of PageGeometry (plus optional overlay images).
+
+    Entries are directories named by the key hash under `root`; they are written
+    to a temp name and renamed into place, so several workers or processes can
+    share one cache directory. Reading an entry bumps its mtime, and put() evicts
+    least recently used entries until the directory fits in max_bytes.
+    `namespace` should identify the model weights and pipeline version so stale
+    geometry is never served after either changes; the content hash of
+    `namespace_file` (the weights) is added to it, computed on first use so
+    creating the cache doesn't read the checkpoint.
+    """
+
+    GEOMETRY_FILE = "geometry.npz"
+
+    def __init__(self, root: str, max_bytes: int, namespace: str = "", namespace_file: str | None = None):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._namespace = namespace
+        self.namespace_file = namespace_file
+        self._file_hash: str | None = None
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._total: int | None = None  # bytes under root, see _stored
+        self._lock = threading.Lock()
+
+    @property
+    def namespace(self) -> str:
+        if self.namespace_file is None:
+            return self._namespace
+        if self._file_hash is None:
+            self._file_hash = file_sha256(self.namespace_file)
+        return self._file_hash + self._namespace
+
+    def key(self, file_hash: str, page_index: int, **config) -> str:
+        payload = json.dumps(
+            {"ns": self.namespace, "file": file_hash, "page": page_index, "config": config},
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> tuple[PageGeometry, Path] | None:
+        entry = self.root / key
+        try:
+            geom = PageGeometry.load(entry / self.GEOMETRY_FILE)
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            return None
+        now = time.time()
+        try:
+            os.utime(entry, (now, now))
+        except OSError:
+            pass
+        return geom, entry
+
+    def put(self, key: str, geom: PageGeometry, files: dict[str, str] | None = None) -> Path:
+        """Stores geom and copies `files` ({name: source path}) into the entry."""
+        entry = self.root / key
+        tmp = self.root / f".tmp-{uuid.uuid4().hex}"
+        tmp.mkdir()
+        try:
+            geom.save(tmp / self.GEOMETRY_FILE)
+            for name, src in (files or {}).items():
+                if src:
+                    shutil.copyfile(src, tmp / name)
+            try:
+                os.replace(tmp, entry)
+            except OSError:
+                # another worker stored the same key first, its put counted it
+                shutil.rmtree(tmp, ignore_errors=True)
+                return entry
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        self._stored(_entry_size(entry))
+        return entry
+
+    def _stored(self, size: int):
+        # A running estimate of the directory size (other processes' puts are
+        # only seen by a rescan), so a put rescans the cache only when it
+        # pushes the estimate over max_bytes, not every time.
+        with self._lock:
+            if self._total is not None:
+                self._total += size
+                if self._total <= self.max_bytes:
+                    return
+            self._total = evict_lru(self.root, self.max_bytes)
+
+    def __getstate__(self):
+        # pickled into process workers, which keep their own estimate
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_total"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+def _entry_size(path) -> int:
+    """Bytes of a cache entry, a file or a directory of files; 0 once another process removed it."""
+    try:
+        if not os.path.isdir(path):
+            return os.stat(path).st_size
+        total = 0
+        for f in os.scandir(path):
+            try:
+                if f.is_file():
+                    total += f.stat().st_size
+            except FileNotFoundError:
+                continue
+        return total
+    except FileNotFoundError:
+        return 0
+
+
+def evict_lru(root, max_bytes: int) -> int:
+    """
+    Removes the least recently used entries (files or directories, by mtime)
+    under root until the rest fits in max_bytes, skipping ".tmp-" writes in
+    progress. Entries other processes remove meanwhile are skipped. Returns
+    the bytes left.
+    """
+    entries = []
+    total = 0
+    for e in os.scandir(root):
+        if ".tmp-" in e.name:
+            continue
+        try:
+            mtime = e.stat().st_mtime
+        except FileNotFoundError:
+            continue
+        size = _entry_size(e.path)
+        entries.append((mtime, size, e.path))
+        total += size
+
+    entries.sort()
+    for _mtime, size, path in entries:
+        if total <= max_bytes:
+            break
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total -= size
+    return total
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import json
+from typing import Iterator
+
+import numpy as np
+
+from .units import feet_to_arch
+
+# response formats by the media type a client asks for in Accept
+MEDIA_TYPES = {
+    "json": "application/json",
+    "columnar": "application/vnd.wall.columnar+json",
+    "ndjson": "application/x-ndjson",
+    "msgpack": "application/msgpack",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+FORMATS = tuple(MEDIA_TYPES)
+_ALIASES = {
+    "application/x-msgpack": "msgpack",
+    "application/vnd.msgpack": "msgpack",
+}
+
+LINE_COLUMNS = ("x1", "y1", "x2", "y2")
+LINE_CHUNK = 2048  # lines per chunk of streamed JSON
+
+
+def negotiate(accept: str | None, allowed: tuple[str, ...] = FORMATS) -> str:
+    """
+    The format for an Accept header: the allowed one with the highest q,
+    first listed on a tie. JSON when the header is missing or names none.
+    """
+    best, best_q = "json", 0.0
+    for part in (accept or "").split(","):
+        media, *params = [p.strip() for p in part.split(";")]
+        fmt = _ALIASES.get(media.lower()) or next((f for f, m in MEDIA_TYPES.items() if m == media.lower()), None)
+        if fmt not in allowed:
+            continue
+        q = 1.0
+        for p in params:
+            if p.startswith("q="):
+                try:
+                    q = float(p[2:])
+                except ValueError:
+                    q = 0.0
+        if q > best_q:
+            best, best_q = fmt, q
+    return best
+
+
+def _dumps(obj) -> str:
+    # the same settings as starlette's JSONResponse
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+
+
+def _pages(result: dict) -> list[dict]:
+    return result["pages"] if "pages" in result else [result]
+
+
+def _head(result: dict) -> dict:
+    """A page without its lines, or a document without its pages."""
+    return {k: v for k, v in result.items() if k not in ("pages", "lines", "line_lengths_ft")}
+
+
+def verbose_lines(lines: np.ndarray, lengths_ft: np.ndarray) -> Iterator[dict]:
+    """The per line dicts of the JSON response, arch strings formatted as they're needed."""
+    for i, ((x1, y1, x2, y2), ft) in enumerate(zip(lines.tolist(), lengths_ft.tolist()), start=1):
+        yield {
+            "id": i,
+            "x1": x1,
+            "y1": y1,
+            "x2": x2,
+            "y2": y2,
+            "length_ft_decimal": ft,
+            "length_arch": feet_to_arch(ft),
+        }
+
+
+def columnar_lines(page: dict) -> dict:
+    """The lines of a page as one list per coordinate plus their lengths in feet."""
+    lines = page["lines"]
+    out = {name: lines[:, i].tolist() for i, name in enumerate(LINE_COLUMNS)}
+    out["length_ft"] = page["line_lengths_ft"].tolist()
+    return out
+
+
+def to_verbose(result: dict) -> dict:
+    """The result with lines as a list of dicts per line (the default JSON)."""
+    def page(r):
+        return {**_head(r), "lines": list(verbose_lines(r["lines"], r["line_lengths_ft"]))}
+
+    if "pages" not in result:
+        return page(result)
+    return {**_head(result), "pages": [page(r) for r in result["pages"]]}
+
+
+def to_columnar(result: dict) -> dict:
+    """The result with the lines of each page as columns, without per line arch strings."""
+    def page(r):
+        return {**_head(r), "lines": columnar_lines(r)}
+
+    if "pages" not in result:
+        return page(result)
+    return {**_head(result), "pages": [page(r) for r in result["pages"]]}
+
+
+def iter_json(result: dict) -> Iterator[bytes]:
+    """
+    The verbose JSON of a result in chunks: page by page and LINE_CHUNK lines
+    at a time, so the text of a large document never exists in one piece.
+    """
+    def page(r):
+        yield _dumps(_head(r))[:-1] + ',"lines":['
+        lines = verbose_lines(r["lines"], r["line_lengths_ft"])
+        n = len(r["lines"])
+        for start in range(0, n, LINE_CHUNK):
+            chunk = [next(lines) for _ in range(min(LINE_CHUNK, n - start))]
+            yield ("," if start else "") + _dumps(chunk)[1:-1]
+        yield "]}"
+
+    if "pages" not in result:
+        for text in page(result):
+            yield text.encode("utf-8")
+        return
+
+    yield (_dumps(_head(result))[:-1] + ',"pages":[').encode("utf-8")
+    for i, r in enumerate(result["pages"]):
+        if i:
+            yield b","
+        for text in page(r):
+            yield text.encode("utf-8")
+    yield b"]}"
+
+
+def iter_ndjson(result: dict) -> Iterator[bytes]:
+    """One line for the document (without pages) and one columnar line per page."""
+    if "pages" in result:
+        yield (_dumps(_head(result)) + "\n").encode("utf-8")
+    for r in _pages(result):
+        yield (_dumps({**_head(r), "lines": columnar_lines(r)}) + "\n").encode("utf-8")
+
+
+def to_msgpack(obj) -> bytes:
+    """MessagePack of a JSON-like object, e.g. to_columnar() of a result."""
+    try:
+        import msgpack
+    except ImportError as e:
+        raise RuntimeError("MessagePack responses need the msgpack package") from e
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def to_arrow(result: dict) -> bytes:
+    """
+    The result as an Arrow IPC stream: one record batch of lines per page
+    (page_index, x1, y1, x2, y2, length_ft), everything else as JSON in the
+    "result" schema metadata.
+    """
+    try:
+        import pyarrow as pa
+    except ImportError as e:
+        raise RuntimeError("Arrow responses need the pyarrow package") from e
+
+    head = _head(result)
+    if "pages" in result:
+        head["pages"] = [_head(r) for r in result["pages"]]
+    schema = pa.schema(
+        [("page_index", pa.int32())] + [(name, pa.float64()) for name in LINE_COLUMNS + ("length_ft",)],
+        metadata={"result": _dumps(head)},
+    )
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for r in _pages(result):
+            lines = r["lines"]
+            columns = [pa.array(np.full(len(lines), r["page_index"], dtype=np.int32))]
+            columns += [pa.array(lines[:, i]) for i in range(4)]
+            columns.append(pa.array(r["line_lengths_ft"]))
+            writer.write_batch(pa.record_batch(columns, schema=schema))
+    return sink.getvalue().to_pybytes()
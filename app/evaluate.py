@@ -0,0 +1,371 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+from pathlib import Path
+import sys
+import time
+import uuid
+
+import numpy as np
+import torch
+
+from .backends import BACKENDS, load_backend
+from .batch import DEFAULT_WEIGHTS
+from .cache import evict_lru, file_sha256
+from .pipeline import (
+    INFERENCE_MODES,
+    LINE_ENGINES,
+    NETWORK_SIZE,
+    WALL_LABEL,
+    OptionsError,
+    PipelineOptions,
+    estimate_lengths_from_pdf,
+)
+from .preprocess import pick_seg_tensor
+from .tiling import wall_margin_from_logits
+
+APP_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = APP_DIR / "eval-results"
+CACHE_DIR = APP_DIR / "eval-cache"
+CACHE_MAX_BYTES = 4 << 30
+
+LENGTHS = ("total_ft", "outer_ft", "inner_ft")  # labeled lengths an evaluation compares
+
+
+class CachedModel:
+    """
+    model(x) with its output stored in cache_dir under the hash of the input
+    and `namespace` (weights and backend), so configurations that feed the
+    network the same input share one forward pass, also across runs.
+    saved_s adds up the forward time that cache hits did not spend.
+
+    keep="margin" stores and returns only the wall margin [B,1,H,W] (see
+    tiling.wall_margin_from_logits), all the mask based engines use;
+    keep="full" the whole output as float16, for TTA (which averages all
+    channels) and the junction engine. Files are compressed, and the least
+    recently used ones are evicted once the directory exceeds max_bytes.
+    """
+
+    KEEP = ("margin", "full")
+
+    def __init__(self, model, cache_dir: str, namespace: str, keep: str = "margin", max_bytes: int = CACHE_MAX_BYTES):
+        if keep not in self.KEEP:
+            raise ValueError(f"keep must be one of {self.KEEP}, got {keep!r}")
+        self.model = model
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.namespace = f"{namespace}/{keep}"
+        self.keep = keep
+        self.max_bytes = max_bytes
+        self._total: int | None = None  # bytes in cache_dir
+        self.saved_s = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, x: torch.Tensor) -> Path:
+        h = hashlib.sha256(self.namespace.encode())
+        h.update(str(tuple(x.shape)).encode())
+        h.update(np.ascontiguousarray(x.detach().cpu().numpy()).tobytes())
+        return self.cache_dir / f"{h.hexdigest()}.npz"
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        path = self._path(x)
+        t0 = time.perf_counter()
+        try:
+            with np.load(path) as data:
+                out, forward_s = torch.from_numpy(data["out"]).float(), float(data["forward_s"])
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            pass
+        else:
+            now = time.time()
+            try:
+                os.utime(path, (now, now))
+            except OSError:
+                pass
+            self.hits += 1
+            self.saved_s += forward_s - (time.perf_counter() - t0)
+            return out
+
+        t0 = time.perf_counter()
+        seg = pick_seg_tensor(self.model(x)).detach().cpu()
+        forward_s = time.perf_counter() - t0
+        self.misses += 1
+        if self.keep == "margin":
+            out = wall_margin_from_logits(seg, WALL_LABEL)[:, None]
+            stored = out.numpy()
+        else:
+            out = seg
+            stored = seg.numpy().astype(np.float16)
+        tmp = path.with_name(f"{path.stem}.tmp-{uuid.uuid4().hex}.npz")
+        np.savez_compressed(tmp, out=stored, forward_s=forward_s)
+        os.replace(tmp, path)
+        # rescan the directory only when the running total says it may not fit
+        size = path.stat().st_size
+        if self._total is None or self._total + size > self.max_bytes:
+            self._total = evict_lru(self.cache_dir, self.max_bytes)
+        else:
+            self._total += size
+        return out if self.keep == "margin" else torch.from_numpy(stored).float()
+
+
+def load_labels(path: str) -> list[dict]:
+    """
+    The labeled plans: a JSON list of {"pdf", "page" (default 0), "scale"
+    (default "3/16") and at least one of total_ft, outer_ft, inner_ft}, with
+    pdf paths relative to the file.
+    """
+    root = Path(path).resolve().parent
+    labels = json.loads(Path(path).read_text(encoding="utf-8"))
+    out = []
+    for i, item in enumerate(labels):
+        if "pdf" not in item or not any(k in item for k in LENGTHS):
+            raise ValueError(f"label {i} needs a pdf and one of {LENGTHS}")
+        out.append(
+            {
+                **item,
+                "pdf": str(root / item["pdf"]),
+                "page": int(item.get("page", 0)),
+                "scale": str(item.get("scale", "3/16")),
+            }
+        )
+    return out
+
+
+def config_grid(
+    backends=("eager",),
+    engines=("hough",),
+    tta=(False,),
+    network_sizes=(NETWORK_SIZE,),
+    inference=("full",),
+    tile_dpis=(150,),
+    roi=(False,),
+) -> list[tuple[str, PipelineOptions]]:
+    """
+    Every combination as (backend, PipelineOptions), without invalid ones
+    and without repeats (network_size only matters to full inference,
+    tile_dpi only to tiled).
+    """
+    out, seen = [], set()
+    for backend, engine, t, size, mode, dpi, r in itertools.product(
+        backends, engines, tta, network_sizes, inference, tile_dpis, roi
+    ):
+        try:
+            options = PipelineOptions(
+                inference=mode, tile_dpi=dpi, roi=r, line_engine=engine, network_size=size, tta=t
+            )
+        except OptionsError:
+            continue
+        key = (backend, json.dumps(options.cache_fields(), sort_keys=True))
+        if key not in seen:
+            seen.add(key)
+            out.append((backend, options))
+    return out
+
+
+def config_name(backend: str, options: PipelineOptions) -> str:
+    parts = [backend, options.inference]
+    if options.inference == "tiled":
+        parts.append(f"{options.tile_dpi}dpi")
+    else:
+        parts.append(f"{options.network_size}px")
+    parts.append(options.line_engine)
+    if options.tta:
+        parts.append("tta")
+    if options.roi:
+        parts.append("roi")
+    return "/".join(parts)
+
+
+def evaluate(
+    labels: list[dict],
+    configs: list[tuple[str, PipelineOptions]],
+    weights_path: str,
+    cache_dir: str = str(CACHE_DIR),
+    export_dir: str | None = None,
+    log=sys.stderr,
+    cache_max_bytes: int = CACHE_MAX_BYTES,
+) -> dict:
+    """
+    Runs every labeled page through estimate_lengths_from_pdf under every
+    configuration (on CPU, without the geometry cache). One row per config
+    and page: the lengths, their relative errors against the labels and the
+    stage timings, where "inference" counts the forward passes the output
+    cache saved at what they cost when computed.
+    """
+    weights_hash = file_sha256(weights_path)
+    loaded, models = {}, {}
+    rows = []
+    for backend, options in configs:
+        keep = "full" if options.tta or options.line_engine == "junctions" else "margin"
+        if backend not in loaded:
+            loaded[backend] = load_backend(weights_path, "cpu", backend, export_dir=export_dir, quantize=True)
+        if (backend, keep) not in models:
+            models[backend, keep] = CachedModel(
+                loaded[backend], cache_dir, f"{weights_hash}/{backend}", keep, cache_max_bytes
+            )
+        model = models[backend, keep]
+        name = config_name(backend, options)
+        for label in labels:
+            model.saved_s = 0.0
+            with torch.no_grad():
+                r = estimate_lengths_from_pdf(
+                    label["pdf"],
+                    model,
+                    "cpu",
+                    page_index=label["page"],
+                    scale_inch_per_foot=label["scale"],
+                    options=options,
+                )
+            stages = {k: v["wall_s"] for k, v in r["timings"]["stages"].items()}
+            stages["inference"] = stages.get("inference", 0.0) + model.saved_s
+            row = {"config": name, "pdf": label["pdf"], "page": label["page"], "page_s": sum(stages.values())}
+            for k in LENGTHS:
+                row[k] = r[k]
+                if k in label:
+                    row[f"{k}_label"] = label[k]
+                    row[f"{k}_error"] = (r[k] - label[k]) / label[k] if label[k] else float(r[k] != 0)
+            row["stages"] = stages
+            rows.append(row)
+            print(
+                f"{name:36s} {Path(label['pdf']).name}:{label['page']:<3d} "
+                f"{r['total_ft']:9.1f} ft {row['page_s']:7.2f} s",
+                file=log,
+            )
+    cache = {}
+    for (backend, _keep), m in models.items():
+        c = cache.setdefault(backend, {"hits": 0, "misses": 0})
+        c["hits"] += m.hits
+        c["misses"] += m.misses
+    return {"rows": rows, "cache": cache}
+
+
+def summarize(rows: list[dict], target: float = 0.05) -> dict:
+    """
+    Per config: mean and max absolute relative error of each labeled length,
+    median and max page time and median time per stage. "best" is the
+    fastest config (median page time) whose mean total_ft error is within
+    target, None if there is none.
+    """
+    configs = {}
+    for r in rows:
+        configs.setdefault(r["config"], []).append(r)
+
+    out = []
+    for name, rs in configs.items():
+        s = {
+            "config": name,
+            "pages": len(rs),
+            "median_page_s": float(np.median([r["page_s"] for r in rs])),
+            "max_page_s": float(np.max([r["page_s"] for r in rs])),
+        }
+        for k in LENGTHS:
+            errors = [abs(r[f"{k}_error"]) for r in rs if f"{k}_error" in r]
+            if errors:
+                s[f"{k}_mean_error"] = float(np.mean(errors))
+                s[f"{k}_max_error"] = float(np.max(errors))
+        stages = sorted({k for r in rs for k in r["stages"]})
+        s["stages_s"] = {k: float(np.median([r["stages"].get(k, 0.0) for r in rs])) for k in stages}
+        out.append(s)
+
+    out.sort(key=lambda s: s["median_page_s"])
+    ok = [s for s in out if s.get("total_ft_mean_error", float("inf")) <= target]
+    return {"target": target, "configs": out, "best": ok[0]["config"] if ok else None}
+
+
+def _bools(text: str) -> list[bool]:
+    values = {"off": False, "on": True}
+    out = [values.get(v.strip()) for v in text.split(",")]
+    if None in out:
+        raise argparse.ArgumentTypeError(f"expected off/on values, got {text!r}")
+    return out
+
+
+def _choices(allowed):
+    def parse(text: str) -> list[str]:
+        out = [v.strip() for v in text.split(",")]
+        bad = [v for v in out if v not in allowed]
+        if bad:
+            raise argparse.ArgumentTypeError(f"{', '.join(bad)} not in {', '.join(allowed)}")
+        return out
+
+    return parse
+
+
+def _ints(text: str) -> list[int]:
+    return [int(v) for v in text.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m app.evaluate", description="Wall length error and latency of pipeline configurations"
+    )
+    parser.add_argument("labels", help="JSON list of labeled pages (see load_labels)")
+    parser.add_argument("--weights", default=os.environ.get("WALL_WEIGHTS_PATH", str(DEFAULT_WEIGHTS)))
+    parser.add_argument("--backends", type=_choices(BACKENDS), default=["eager"])
+    parser.add_argument("--engines", type=_choices(LINE_ENGINES), default=["hough"])
+    parser.add_argument("--tta", type=_bools, default=[False], help="off, on or off,on")
+    parser.add_argument("--network-sizes", type=_ints, default=[NETWORK_SIZE])
+    parser.add_argument("--inference", type=_choices(INFERENCE_MODES), default=["full"])
+    parser.add_argument("--tile-dpis", type=_ints, default=[150])
+    parser.add_argument("--roi", type=_bools, default=[False])
+    parser.add_argument("--target", type=float, default=0.05, help="acceptable mean relative total_ft error")
+    parser.add_argument("--cache-dir", default=str(CACHE_DIR), help="model outputs, reused across runs")
+    parser.add_argument("--cache-max-gb", type=float, default=CACHE_MAX_BYTES / (1 << 30))
+    parser.add_argument("--export-dir", default=str(APP_DIR / "weights" / "export"))
+    parser.add_argument("--out", default=None, help="results JSON (default eval-results/<time>.json)")
+    args = parser.parse_args(argv)
+
+    labels = load_labels(args.labels)
+    configs = config_grid(
+        args.backends, args.engines, args.tta, args.network_sizes, args.inference, args.tile_dpis, args.roi
+    )
+    if not configs:
+        parser.error("no valid configuration in the grid")
+    t0 = time.perf_counter()
+    run = evaluate(
+        labels,
+        configs,
+        args.weights,
+        cache_dir=args.cache_dir,
+        export_dir=args.export_dir,
+        cache_max_bytes=int(args.cache_max_gb * (1 << 30)),
+    )
+    summary = summarize(run["rows"], args.target)
+
+    print(f"{'config':36s} {'total err':>9s} {'max err':>8s} {'page s':>7s} {'infer s':>7s}")
+    for s in summary["configs"]:
+        err = s.get("total_ft_mean_error")
+        print(
+            f"{s['config']:36s} "
+            + (f"{err:9.1%} {s['total_ft_max_error']:8.1%}" if err is not None else f"{'-':>9s} {'-':>8s}")
+            + f" {s['median_page_s']:7.2f} {s['stages_s'].get('inference', 0.0):7.2f}"
+        )
+    print(f"best within {args.target:.0%}: {summary['best']}")
+
+    out = Path(args.out) if args.out else RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(
+        json.dumps(
+            {
+                "meta": {
+                    "labels": args.labels,
+                    "weights": args.weights,
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "elapsed_s": time.perf_counter() - t0,
+                    "cache": run["cache"],
+                },
+                "summary": summary,
+                "rows": run["rows"],
+            },
+            indent=1,
+        )
+    )
+    print(f"wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+
+@dataclass
+class PageGeometry:
+    """
+    Pixel-space result of the expensive part of the pipeline for one page.
+
+    Everything here is independent of the drawing scale, so lengths for any
+    scale_inch_per_foot can be derived from it without re-running the model.
+    """
+
+    width: int
+    height: int
+    dpi: int
+    lines: np.ndarray  # [N,4] float64, x1 y1 x2 y2
+    contour: np.ndarray | None  # OpenCV contour [M,1,2] int32, or None
+    # the wall mask the geometry was measured on (uint8 0/255, at wall_origin),
+    # kept next to the page as a sidecar for revisions (see revisions.py), not
+    # part of the arrays
+    wall: np.ndarray | None = field(default=None, repr=False, compare=False)
+    wall_origin: tuple[int, int] = (0, 0)
+
+    def line_lengths_px(self) -> np.ndarray:
+        if len(self.lines) == 0:
+            return np.zeros(0, dtype=np.float64)
+        return np.hypot(self.lines[:, 2] - self.lines[:, 0], self.lines[:, 3] - self.lines[:, 1])
+
+    def perimeter_px(self) -> float:
+        if self.contour is None:
+            return 0.0
+        return float(cv2.arcLength(self.contour, True))
+
+    def to_arrays(self) -> dict:
+        return {
+            "size": np.array([self.width, self.height, self.dpi], dtype=np.int64),
+            "lines": np.asarray(self.lines, dtype=np.float64).reshape(-1, 4),
+            "contour": np.zeros((0, 1, 2), np.int32) if self.contour is None else self.contour,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays) -> "PageGeometry":
+        w, h, dpi = (int(v) for v in arrays["size"])
+        contour = arrays["contour"]
+        return cls(
+            width=w,
+            height=h,
+            dpi=dpi,
+            lines=arrays["lines"],
+            contour=contour if len(contour) else None,
+        )
+
+    def save(self, path) -> None:
+        np.savez(path, **self.to_arrays())
+
+    @classmethod
+    def load(cls, path) -> "PageGeometry":
+        with np.load(path) as arrays:
+            return cls.from_arrays(arrays)
+
+
+def page_geometry_path(result_dir, page_index: int) -> Path:
+    return Path(result_dir) / f"page_{page_index}.npz"
+
+
+def page_wall_path(result_dir, page_index: int) -> Path:
+    return Path(result_dir) / f"page_{page_index}.wall.npz"
+
+
+def save_wall_mask(path, wall: np.ndarray, origin: tuple[int, int] = (0, 0)) -> None:
+    """A wall mask packed 8 pixels per byte (a 36x24" sheet at 300 DPI is ~100 KB)."""
+    np.savez_compressed(
+        path,
+        bits=np.packbits(wall > 0, axis=1),
+        shape=np.array(wall.shape, dtype=np.int64),
+        origin=np.array(origin, dtype=np.int64),
+    )
+
+
+def load_wall_mask(path) -> tuple[np.ndarray, tuple[int, int]]:
+    """(uint8 0/255 wall mask, its (x, y) origin on the page), see save_wall_mask."""
+    with np.load(path) as arrays:
+        h, w = (int(v) for v in arrays["shape"])
+        wall = np.unpackbits(arrays["bits"], axis=1, count=w) * np.uint8(255)
+        return wall, tuple(int(v) for v in arrays["origin"])
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+import resource
+import sys
+import threading
+import time
+
+import numpy as np
+
+# ru_maxrss is in KiB on Linux, bytes on macOS
+_RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def peak_rss_bytes() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNIT
+
+
+class Timings:
+    """
+    Per-page stage timings, filled in with `with timings.stage("name"):`.
+
+    Each stage records wall time, CPU time of the calling thread (torch's
+    intra-op threads are not included), the growth of the process' peak RSS
+    while it ran and the shapes/sizes of arrays attached with array().
+    Peak RSS is process wide, so with concurrent pages the growth is only
+    attributed to whichever stage happened to push the peak. A stage entered
+    again adds to its earlier figures.
+    """
+
+    def __init__(self):
+        self.stages: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def stage(self, name: str):
+        prev = getattr(self._local, "current", None)
+        self._local.current = name
+        rss0 = peak_rss_bytes()
+        cpu0 = time.thread_time()
+        t0 = time.perf_counter()
+        try:
+            yield self
+        finally:
+            wall = time.perf_counter() - t0
+            cpu = time.thread_time() - cpu0
+            rss = peak_rss_bytes() - rss0
+            self._local.current = prev
+            with self._lock:
+                rec = self.stages.setdefault(name, {"wall_s": 0.0, "cpu_s": 0.0, "peak_rss_delta_bytes": 0, "calls": 0})
+                rec["wall_s"] += wall
+                rec["cpu_s"] += cpu
+                rec["peak_rss_delta_bytes"] += rss
+                rec["calls"] += 1
+
+    def array(self, name: str, arr: np.ndarray | None):
+        """Records shape and nbytes of an array under the stage being run."""
+        if arr is None:
+            return
+        stage = getattr(self._local, "current", None) or "other"
+        with self._lock:
+            rec = self.stages.setdefault(stage, {"wall_s": 0.0, "cpu_s": 0.0, "peak_rss_delta_bytes": 0, "calls": 0})
+            rec.setdefault("arrays", {})[name] = {"shape": list(arr.shape), "nbytes": int(arr.nbytes)}
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            stages = {k: dict(v) for k, v in self.stages.items()}
+        return {
+            "stages": stages,
+            "total_s": sum(v["wall_s"] for v in stages.values()),
+        }
+
+
+# Upper bounds (seconds) of the stage histogram buckets
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class Metrics:
+    """
+    Process-wide aggregates of stage timings, rendered in the Prometheus text
+    exposition format. observe_result() takes a pipeline result (one page or a
+    document with "pages") carrying "timings".
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = STAGE_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._hist: dict[str, list] = {}  # stage -> [bucket counts..., sum, count]
+        self._cpu: dict[str, float] = {}
+        self._rss: dict[str, int] = {}
+        self._pages = {"hit": 0, "miss": 0}
+        self._jobs = {"done": 0, "failed": 0}
+
+    def observe_result(self, result: dict):
+        pages = result.get("pages", [result])
+        with self._lock:
+            self._jobs["done"] += 1
+            for page in pages:
+                self._pages["hit" if page.get("cache_hit") else "miss"] += 1
+                stages = (page.get("timings") or {}).get("stages", {})
+                for name, rec in stages.items():
+                    self._observe(name, rec)
+
+    def observe_failure(self):
+        with self._lock:
+            self._jobs["failed"] += 1
+
+    def _observe(self, name: str, rec: dict):
+        h = self._hist.setdefault(name, [0] * (len(self.buckets) + 2))
+        wall = rec["wall_s"]
+        for i, le in enumerate(self.buckets):
+            if wall <= le:
+                h[i] += 1
+        h[-2] += wall
+        h[-1] += 1
+        self._cpu[name] = self._cpu.get(name, 0.0) + rec["cpu_s"]
+        self._rss[name] = self._rss.get(name, 0) + rec["peak_rss_delta_bytes"]
+
+    def render(self, gauges: dict[str, float] | None = None) -> str:
+        """Text exposition; `gauges` ({name: value}) are appended as-is."""
+        out = []
+        with self._lock:
+            out.append("# HELP wall_stage_seconds Wall time of a pipeline stage per page.")
+            out.append("# TYPE wall_stage_seconds histogram")
+            for name, h in sorted(self._hist.items()):
+                for le, n in zip(self.buckets, h):
+                    out.append(f'wall_stage_seconds_bucket{{stage="{name}",le="{le:g}"}} {n}')
+                out.append(f'wall_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {h[-1]}')
+                out.append(f'wall_stage_seconds_sum{{stage="{name}"}} {h[-2]:.6f}')
+                out.append(f'wall_stage_seconds_count{{stage="{name}"}} {h[-1]}')
+
+            out.append("# HELP wall_stage_cpu_seconds_total CPU time of a pipeline stage (calling thread).")
+            out.append("# TYPE wall_stage_cpu_seconds_total counter")
+            for name, v in sorted(self._cpu.items()):
+                out.append(f'wall_stage_cpu_seconds_total{{stage="{name}"}} {v:.6f}')
+
+            out.append("# HELP wall_stage_peak_rss_growth_bytes_total Growth of peak RSS while a stage ran.")
+            out.append("# TYPE wall_stage_peak_rss_growth_bytes_total counter")
+            for name, v in sorted(self._rss.items()):
+                out.append(f'wall_stage_peak_rss_growth_bytes_total{{stage="{name}"}} {v}')
+
+            out.append("# HELP wall_pages_total Pages estimated, by cache outcome.")
+            out.append("# TYPE wall_pages_total counter")
+            for k, v in self._pages.items():
+                out.append(f'wall_pages_total{{cache="{k}"}} {v}')
+
+            out.append("# HELP wall_jobs_total Finished estimation jobs, by outcome.")
+            out.append("# TYPE wall_jobs_total counter")
+            for k, v in self._jobs.items():
+                out.append(f'wall_jobs_total{{outcome="{k}"}} {v}')
+
+        for name, v in (gauges or {}).items():
+            out.append(f"# TYPE {name} gauge")
+            out.append(f"{name} {v:g}")
+        return "\n".join(out) + "\n"
@@ -0,0 +1,325 @@
+from __future__ import annotations
+
+import multiprocessing as mp
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import torch
+
+from .backends import load_backend
+from .batching import MicroBatcher
+from .buffers import scratch
+from .instrumentation import peak_rss_bytes
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+class JobTimeoutError(TimeoutError):
+    pass
+
+
+class PoolUnavailableError(RuntimeError):
+    """The pool can't take jobs at all: shut down, or a worker process failed to start."""
+
+
+# Model owned by the current worker (a pool thread shares the one loaded in the
+# main process, a pool process loads its own copy in init_worker).
+_worker_model = None
+_worker_device: str = "cpu"
+_worker_ready = threading.Event()  # set once init_worker finished, successfully or not
+_worker_error: BaseException | None = None
+
+
+def init_worker(
+    weights_path: str,
+    device: str,
+    torch_threads: int = 0,
+    max_batch: int = 1,
+    max_wait_ms: float = 10.0,
+    backend: str = "eager",
+    channels_last: bool = False,
+    export_dir: str | None = None,
+    head: str = "full",
+    warmup: bool = False,
+    buffer_pool_mb: float = 512.0,
+):
+    global _worker_model, _worker_device, _worker_error
+    scratch.max_bytes = int(buffer_pool_mb * 1024 * 1024)
+    try:
+        if torch_threads > 0:
+            torch.set_num_threads(torch_threads)
+        model = load_backend(
+            weights_path,
+            device=device,
+            backend=backend,
+            channels_last=channels_last,
+            export_dir=export_dir,
+            threads=torch_threads,
+            head=head,
+        )
+        if warmup:
+            warm_up(model, device)
+        if max_batch > 1:
+            model = MicroBatcher(model, max_batch=max_batch, max_wait_ms=max_wait_ms)
+        _worker_device = device
+        _worker_model = model
+    except BaseException as e:
+        _worker_error = e
+        raise
+    finally:
+        _worker_ready.set()
+
+
+def warm_up(model, device: str, size: int = 1024):
+    """One forward pass on a blank input, so lazy allocations and kernel selection don't hit the first page."""
+    with torch.no_grad():
+        model(torch.zeros(1, 3, size, size, device=device))
+
+
+def worker_pid() -> int:
+    return os.getpid()
+
+
+def run_job(fn, deadline: float | None, kwargs: dict) -> dict:
+    """Runs a pipeline entry point (e.g. estimate_lengths_from_pdf) with the worker's model."""
+    if deadline is not None and time.time() > deadline:
+        raise JobTimeoutError("Job timed out while waiting in the queue")
+    # a thread worker may start before the model has finished loading in the background
+    if not _worker_ready.wait(None if deadline is None else max(0.0, deadline - time.time())):
+        raise JobTimeoutError("Job timed out while the model was loading")
+    if _worker_model is None:
+        raise RuntimeError("Worker has no model") from _worker_error
+    return fn(model=_worker_model, device=_worker_device, **kwargs)
+
+
+@dataclass
+class Job:
+    id: str
+    kwargs: dict
+    deadline: float | None
+    created_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+    cancelled: bool = False
+    future: Future | None = field(default=None, repr=False)
+    meta: dict = field(default_factory=dict)  # request details kept by the caller
+
+    @property
+    def status(self) -> str:
+        if self.cancelled:
+            return "cancelled"
+        f = self.future
+        if f is None or not (f.running() or f.done()):
+            if self.deadline is not None and time.time() > self.deadline:
+                return "timeout"
+            return "queued"
+        if not f.done():
+            if self.deadline is not None and time.time() > self.deadline:
+                return "timeout"
+            return "running"
+        exc = f.exception()
+        if exc is None:
+            return "done"
+        if isinstance(exc, JobTimeoutError):
+            return "timeout"
+        return "failed"
+
+    def to_dict(self) -> dict:
+        status = self.status
+        out = {
+            "job_id": self.id,
+            "status": status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+        if status == "done":
+            out["result"] = self.future.result()
+        elif status == "failed":
+            out["error"] = repr(self.future.exception())
+        return out
+
+
+class WorkerPool:
+    """
+    Bounded pool of inference workers.
+
+    mode="thread" shares one model between worker threads (torch releases the GIL
+    in its kernels), mode="process" gives each worker process its own model.
+    At most workers + queue_size jobs are accepted at a time; submit() raises
+    QueueFullError beyond that, and PoolUnavailableError once the pool is shut
+    down or broken (a worker process died or failed to load the model). A running job cannot be interrupted: cancelling
+    it or letting it time out only discards its result, its slot is freed when
+    the worker finishes.
+
+    With max_batch > 1 the forward passes of concurrent thread workers are
+    micro-batched (see MicroBatcher); in process mode each process batches only
+    its own calls, so batching is meant for thread mode.
+
+    `backend` and friends choose how the model runs and which head it has,
+    see backends.load_backend.
+
+    Nothing is loaded until start() (or the first submit()): thread mode then
+    loads the model in a background thread, process mode spawns the worker
+    processes, which load theirs. Jobs submitted meanwhile wait for it;
+    status() tells whether the workers are ready. With warmup each worker
+    runs one blank forward pass before it counts as ready.
+
+    buffer_pool_mb bounds the free page-size buffers each worker process (and
+    this one, which thread workers share) keeps for reuse, see buffers.py.
+    """
+
+    def __init__(
+        self,
+        weights_path: str,
+        device: str,
+        workers: int = 1,
+        mode: str = "thread",
+        queue_size: int = 8,
+        timeout_s: float | None = 300.0,
+        keep_finished_s: float = 3600.0,
+        max_batch: int = 1,
+        max_wait_ms: float = 10.0,
+        backend: str = "eager",
+        channels_last: bool = False,
+        export_dir: str | None = None,
+        head: str = "full",
+        warmup: bool = False,
+        buffer_pool_mb: float = 512.0,
+    ):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown worker mode: {mode!r}")
+        self.workers = max(1, workers)
+        self.mode = mode
+        self.capacity = self.workers + max(0, queue_size)
+        self.timeout_s = timeout_s
+        self.keep_finished_s = keep_finished_s
+
+        # split cores between workers so concurrent forward passes don't oversubscribe,
+        # unless a single batching thread runs all of them
+        torch_threads = max(1, (os.cpu_count() or 1) // self.workers)
+        if mode == "thread" and max_batch > 1:
+            torch_threads = os.cpu_count() or 1
+        self._worker_args = (
+            weights_path,
+            device,
+            torch_threads,
+            max_batch,
+            max_wait_ms,
+            backend,
+            channels_last,
+            export_dir,
+            head,
+            warmup,
+            buffer_pool_mb,
+        )
+        scratch.max_bytes = int(buffer_pool_mb * 1024 * 1024)
+        if mode == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="estimate")
+        else:
+            # processes are only spawned by the first submissions
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=mp.get_context("spawn"),
+                initializer=init_worker,
+                initargs=self._worker_args,
+            )
+
+        self._jobs: dict[str, Job] = {}
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._loading: list[Future] | None = None
+        self._loader: ThreadPoolExecutor | None = None
+
+    def start(self):
+        """Starts loading the model(s) in the background; returns immediately."""
+        with self._lock:
+            if self._loading is not None:
+                return
+            if self.mode == "thread":
+                self._loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+                self._loading = [self._loader.submit(init_worker, *self._worker_args)]
+            else:
+                # one no-op per worker makes the executor spawn (and initialize) all of them
+                self._loading = [self._executor.submit(worker_pid) for _ in range(self.workers)]
+
+    def status(self) -> dict:
+        """{"status": "idle" | "loading" | "ready" | "failed"}, plus "error" when failed."""
+        loading = self._loading
+        if loading is None:
+            return {"status": "idle"}
+        if not all(f.done() for f in loading):
+            return {"status": "loading"}
+        for f in loading:
+            if f.exception() is not None:
+                return {"status": "failed", "error": repr(f.exception())}
+        return {"status": "ready"}
+
+    def submit(self, fn, **kwargs) -> Job:
+        self.start()
+        deadline = time.time() + self.timeout_s if self.timeout_s else None
+        job = Job(id=str(uuid.uuid4()), kwargs=kwargs, deadline=deadline)
+        with self._lock:
+            self._prune()
+            if self._in_flight >= self.capacity:
+                raise QueueFullError(f"Job queue is full ({self.capacity} jobs in flight)")
+            self._in_flight += 1
+            self._jobs[job.id] = job
+        try:
+            job.future = self._executor.submit(run_job, fn, deadline, kwargs)
+        except RuntimeError as e:
+            # BrokenProcessPool once a worker process failed init_worker, or submit after shutdown()
+            with self._lock:
+                self._in_flight -= 1
+                del self._jobs[job.id]
+            raise PoolUnavailableError(f"Workers unavailable: {e}") from e
+        job.future.add_done_callback(lambda _f, job=job: self._on_done(job))
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Job | None:
+        job = self.get(job_id)
+        if job is not None and not job.future.done():
+            job.future.cancel()
+            job.cancelled = True
+        return job
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = {
+                "mode": self.mode,
+                "workers": self.workers,
+                "capacity": self.capacity,
+                "in_flight": self._in_flight,
+                "tracked_jobs": len(self._jobs),
+            }
+        out["model"] = self.status()["status"]
+        if self.mode == "thread" and isinstance(_worker_model, MicroBatcher):
+            out["batching"] = _worker_model.stats()
+        # this process' buffers, the workers' own in thread mode
+        out["buffers"] = scratch.stats()
+        out["peak_rss_bytes"] = peak_rss_bytes()
+        return out
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._loader is not None:
+            self._loader.shutdown(wait=False)
+
+    def _on_done(self, job: Job):
+        job.finished_at = time.time()
+        with self._lock:
+            self._in_flight -= 1
+
+    def _prune(self):
+        cutoff = time.time() - self.keep_finished_s
+        stale = [k for k, j in self._jobs.items() if j.finished_at is not None and j.finished_at < cutoff]
+        for k in stale:
+            del self._jobs[k]
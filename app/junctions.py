@@ -0,0 +1,316 @@
+from __future__ import annotations
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+import torch
+
+from .wall_head import HEATMAP_CHANNELS, ROOM_CLASSES
+
+# The wall junction heatmaps: I (4 orientations), L (4), T (4) and X (1), i.e.
+# channel c is junction kind c // 4 in orientation c % 4.
+WALL_JUNCTION_CHANNELS = 13
+WALL_CLASSES = (2, 8)  # room classes a wall line has to run over: wall, railing
+JUNCTION_THRESHOLD = 0.2
+JUNCTION_GAP = 10  # px at network resolution
+MAX_POINTS = 100  # per heatmap channel
+PEAK_CHUNK = 4096  # candidates decided at once (bounds the pairs on flat heatmaps)
+LINE_PIXEL_CHUNK = 1 << 20  # line pixels scored at once
+NEIGHBOURS = ((0, 1), (2, 1), (1, 0), (1, 2))  # up, down, left, right as offsets into a 1 px padded array
+
+# directions (0 up, 1 right, 2 down, 3 left) a junction connects to, by
+# [kind][orientation], as in floortrans post_prosessing.get_polygons
+POINT_ORIENTATIONS = (
+    ((2,), (3,), (0,), (1,)),
+    ((0, 3), (0, 1), (1, 2), (2, 3)),
+    ((1, 2, 3), (0, 2, 3), (0, 1, 3), (0, 1, 2)),
+    ((0, 1, 2, 3),),
+)
+
+
+def _directions() -> np.ndarray:
+    out = np.zeros((WALL_JUNCTION_CHANNELS, 4), dtype=bool)
+    for c in range(WALL_JUNCTION_CHANNELS):
+        out[c, list(POINT_ORIENTATIONS[c // 4][c % 4])] = True
+    return out
+
+
+DIRECTIONS = _directions()  # [channel, direction]
+
+
+def heatmap_peaks(
+    heatmaps: np.ndarray,
+    threshold: float = JUNCTION_THRESHOLD,
+    gap: int = JUNCTION_GAP,
+    max_points: int = MAX_POINTS,
+) -> np.ndarray:
+    """
+    Junction points of [C,H,W] heatmaps, [N,4] int64 rows of x, y, channel and
+    rank (order of decreasing value within the channel), sorted by channel then
+    rank.
+
+    post_prosessing.extract_local_max with close point suppression, per
+    channel repeatedly the highest remaining value above threshold, removing
+    its flood fill and what lies within gap of it (short of the last row and
+    column, as there). Candidates are the heatmaps' own maxima, a plateau
+    counting once at its first pixel, in all channels at once, and the greedy
+    pass runs over all of them together.
+
+    Not quite the same points: extract_local_max zeroes the gap box around a
+    point, which can cut a neighbouring peak off its slope, and then takes
+    what is left of the slope as a point of its own. Here a suppressed peak
+    takes its slope with it, so those box-edge points are missing; otherwise
+    the points agree (tests/test_junctions.py).
+    """
+    _, h, w = heatmaps.shape
+    padded = np.pad(heatmaps, ((0, 0), (1, 1), (1, 1)), constant_values=-np.inf)
+    center = padded[:, 1:-1, 1:-1]
+    peak = center > threshold
+    for dy, dx in NEIGHBOURS:
+        peak &= center >= padded[:, dy : dy + h, dx : dx + w]
+    c, y, x = np.nonzero(peak)
+    if len(c) == 0:
+        return np.zeros((0, 4), dtype=np.int64)
+    c, y, x = _plateau_firsts(padded, peak, c, y, x)
+    v = heatmaps[c, y, x]
+
+    # priority: channel, then value, then the first in raster order (argmax's pick)
+    order = np.lexsort((y * w + x, -v, c))
+    c, y, x, v = c[order], y[order], x[order], v[order]
+
+    # in chunks of candidates in priority order, each decided against the
+    # points kept before it (the greedy pass only looks back), until a
+    # channel has max_points
+    kept = np.zeros(0, dtype=np.int64)
+    full = np.zeros(heatmaps.shape[0], dtype=bool)
+    todo = np.arange(len(c))
+    while len(todo):
+        chunk, todo = todo[:PEAK_CHUNK], todo[PEAK_CHUNK:]
+        won = _suppress(x, y, c, (h, w), gap, kept, chunk)
+        kept = np.concatenate([kept, won])
+        full = np.bincount(c[kept], minlength=len(full)) >= max_points
+        todo = todo[~full[c[todo]]]
+
+    kept = np.sort(kept)
+    rank = np.arange(len(kept)) - np.searchsorted(c[kept], c[kept])
+    kept, rank = kept[rank < max_points], rank[rank < max_points]
+    return np.column_stack([x[kept], y[kept], c[kept], rank]).astype(np.int64)
+
+
+def _plateau_firsts(padded: np.ndarray, peak: np.ndarray, c, y, x):
+    # of the candidates (c, y, x in raster order), those extract_local_max
+    # can pick: one per plateau, its first pixel, and no plateau that reaches
+    # a higher pixel (it goes with that one's flood fill). Adjacent candidates
+    # are equal, so a plateau is a connected set of them.
+    _, h, w = peak.shape
+    n = len(c)
+    v = padded[c, y + 1, x + 1]
+    tied = np.zeros(n, dtype=bool)
+    for dy, dx in NEIGHBOURS:
+        tied |= padded[c, y + dy, x + dx] == v
+    if not tied.any():
+        return c, y, x
+
+    flat = (c * h + y) * w + x
+    pairs, spill = [], np.zeros(n, dtype=bool)
+    for dy, dx in NEIGHBOURS:
+        ny, nx = y + dy - 1, x + dx - 1
+        inside = tied & (ny >= 0) & (ny < h) & (nx >= 0) & (nx < w)
+        i = np.flatnonzero(inside)
+        equal = padded[c[i], ny[i] + 1, nx[i] + 1] == v[i]
+        other = peak[c[i], ny[i], nx[i]]
+        spill[i[equal & ~other]] = True
+        i = i[equal & other]
+        pairs.append(np.column_stack([i, np.searchsorted(flat, flat[i] + (dy - 1) * w + (dx - 1))]))
+    pairs = np.concatenate(pairs)
+    graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+    _, label = connected_components(graph, directed=False)
+    _, first = np.unique(label, return_index=True)
+    first = first[~np.bincount(label, weights=spill, minlength=len(first))[label[first]].astype(bool)]
+    first.sort()
+    return c[first], y[first], x[first]
+
+
+def _suppress(x, y, c, shape: tuple[int, int], gap: int, kept: np.ndarray, chunk: np.ndarray) -> np.ndarray:
+    # the candidates of chunk (in priority order, after those kept) that
+    # survive; each round keeps every one no kept or undecided higher one suppresses
+    h, w = shape
+    idx = np.concatenate([kept, chunk])
+    xs, ys, cs = x[idx], y[idx], c[idx]
+    # p suppresses q when q is in [p - gap, p + gap) on both axes, same
+    # channel, and not in the last row or column (extract_local_max's box stops short of them)
+    tree = cKDTree(np.column_stack([xs + cs * (w + 2 * gap + 1), ys]))
+    pairs = tree.query_pairs(gap, p=np.inf, output_type="ndarray")
+    p, q = pairs[:, 0], pairs[:, 1]
+    p, q = np.minimum(p, q), np.maximum(p, q)  # p has priority
+    dx, dy = xs[q] - xs[p], ys[q] - ys[p]
+    near = (dx >= -gap) & (dx < gap) & (dy >= -gap) & (dy < gap) & (xs[q] < w - 1) & (ys[q] < h - 1)
+    p, q = p[near], q[near]
+
+    state = np.zeros(len(idx), dtype=np.int8)  # 0 undecided, 1 kept, -1 suppressed
+    state[: len(kept)] = 1
+    state[q[p < len(kept)]] = -1
+    while (state == 0).any():
+        blocked = np.zeros(len(idx), dtype=bool)
+        blocked[q[state[p] >= 0]] = True
+        won = (state == 0) & ~blocked
+        state[won] = 1
+        state[q[won[p] & (state[q] == 0)]] = -1
+    return idx[len(kept) :][state[len(kept) :] == 1]
+
+
+def pair_junctions(points: np.ndarray, width: int, height: int, gap: int = JUNCTION_GAP) -> np.ndarray:
+    """
+    Candidate wall lines between junction points, [M,2] point indices, as
+    post_prosessing.calc_point_info finds them: point i and a later point j
+    are joined in direction d when i opens towards d, j towards the opposite
+    side, j lies in i's band (gap px wide) in that direction and further
+    along it than across. Each direction is one [N,N] mask.
+    """
+    n = len(points)
+    x, y, c = points[:, 0], points[:, 1], points[:, 2]
+    dirs = DIRECTIONS[c]
+    later = np.triu(np.ones((n, n), dtype=bool), 1)
+    dx = x[None, :] - x[:, None]  # [i, j] = x_j - x_i
+    dy = y[None, :] - y[:, None]
+
+    found = []
+    for d in range(4):
+        vertical = d in (0, 2)
+        along, across = (dy, dx) if vertical else (dx, dy)
+        sign = -1 if d in (0, 3) else 1  # up and left go to smaller coordinates
+        ok = later & dirs[:, d][:, None] & dirs[:, (d + 2) % 4][None, :]
+        ok &= (np.abs(across) <= gap) & (sign * along >= 0)
+        ok &= np.abs(along) >= np.maximum(np.abs(across), 1)
+        i, j = np.nonzero(ok)
+        found.append(np.column_stack([i, j, np.full(len(i), d)]))
+
+    found = np.concatenate(found)
+    # calc_point_info's order: by point, then direction, then neighbour
+    found = found[np.lexsort((found[:, 1], found[:, 2], found[:, 0]))]
+    i, j = found[:, 0], found[:, 1]
+    # the end nearer the top left first
+    swap = x[i] + y[i] >= x[j] + y[j]
+    return np.column_stack([np.where(swap, j, i), np.where(swap, i, j)])
+
+
+def bresenham_pixels(lines: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The pixels of post_prosessing.bresenham_line for every [x1, y1, x2, y2]
+    row at once: rows, cols and the start offset of each line in them.
+    """
+    x0, y0, x1, y1 = (lines[:, k].astype(np.int64) for k in range(4))
+    dx, dy = x1 - x0, y1 - y0
+    sx, sy = np.where(dx > 0, 1, -1), np.where(dy > 0, 1, -1)
+    dx, dy = np.abs(dx), np.abs(dy)
+    x_major = dx > dy
+    major, minor = np.where(x_major, dx, dy), np.where(x_major, dy, dx)
+
+    counts = major + 1
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    k = np.arange(counts.sum()) - np.repeat(starts, counts)
+    line = np.repeat(np.arange(len(lines)), counts)
+    # the minor coordinate after k steps of the error term loop
+    m = np.where(major[line] > 0, (2 * minor[line] * k + major[line]) // np.maximum(2 * major[line], 1), 0)
+    xm = x_major[line]
+    cols = x0[line] + sx[line] * np.where(xm, k, m)
+    rows = y0[line] + sy[line] * np.where(xm, m, k)
+    return rows, cols, starts
+
+
+def _room_classes(rooms: np.ndarray, lines: np.ndarray) -> np.ndarray:
+    # per line the room class with the most probability mass over its pixels,
+    # lines taken about LINE_PIXEL_CHUNK pixels at a time
+    rooms = np.ascontiguousarray(rooms.transpose(1, 2, 0))  # a pixel's classes side by side
+    out = np.zeros(len(lines), dtype=np.int64)
+    pixels = np.cumsum(np.abs(lines[:, 2:] - lines[:, :2]).max(axis=1) + 1)
+    start = 0
+    while start < len(lines):
+        stop = max(start + 1, int(np.searchsorted(pixels, pixels[start] + LINE_PIXEL_CHUNK)))
+        rows, cols, starts = bresenham_pixels(lines[start:stop])
+        out[start:stop] = np.add.reduceat(rooms[rows, cols], starts, axis=0).argmax(axis=1)
+        start = stop
+    return out
+
+
+def _drop_long_walls(walls: np.ndarray, points: np.ndarray) -> np.ndarray:
+    # post_prosessing.drop_long_walls: of two walls along the same axis from
+    # the same first (or the same second) point, the longer goes, pairs taken
+    # in order. Per wall a, its pairs with later walls b in one go: the b no
+    # shorter than a up to the first shorter one go, and then a.
+    xy = points[:, :2]
+    vertical = _is_vertical(walls, xy)
+    length = np.hypot(*(xy[walls[:, 0]] - xy[walls[:, 1]]).T)
+    groups = []
+    for end in (0, 1):
+        key = walls[:, end] * 2 + vertical
+        order = np.argsort(key, kind="stable")
+        groups.append((order, np.searchsorted(key[order], key), np.searchsorted(key[order], key, side="right")))
+
+    bad = np.zeros(len(walls), dtype=bool)
+    for a in range(len(walls)):
+        if bad[a]:
+            continue
+        b = np.union1d(*(order[lo[a] : hi[a]] for order, lo, hi in groups))
+        b = b[(b > a) & ~bad[b]]
+        shorter = np.nonzero(length[b] < length[a])[0]
+        bad[b[: shorter[0] if len(shorter) else len(b)]] = True
+        bad[a] = len(shorter) > 0
+    return walls[~bad]
+
+
+def _is_vertical(walls: np.ndarray, xy: np.ndarray) -> np.ndarray:
+    # post_prosessing.calc_line_dim
+    d = xy[walls[:, 1]] - xy[walls[:, 0]]
+    return d[:, 0] <= d[:, 1]
+
+
+def _align(walls: np.ndarray, xy: np.ndarray, axis: int) -> np.ndarray:
+    # post_prosessing.points_to_manhantan: points joined by walls share their mean coordinate
+    n = len(xy)
+    if len(walls) == 0:
+        return xy
+    graph = coo_matrix((np.ones(len(walls)), (walls[:, 0], walls[:, 1])), shape=(n, n))
+    _, label = connected_components(graph, directed=False)
+    used = np.zeros(n, dtype=bool)
+    used[walls[:, :2].ravel()] = True
+    total = np.bincount(label[used], weights=xy[used, axis], minlength=n)
+    count = np.bincount(label[used], minlength=n)
+    xy = xy.copy()
+    xy[used, axis] = np.round(total[label[used]] / count[label[used]]).astype(xy.dtype)
+    return xy
+
+
+def junction_wall_lines(
+    logits: np.ndarray,
+    threshold: float = JUNCTION_THRESHOLD,
+    gap: int = JUNCTION_GAP,
+) -> np.ndarray:
+    """
+    Wall lines from the model output [C,H,W] (sigmoid heatmaps first, then
+    room and icon logits), [N,4] float64 in its pixels: junction peaks are
+    paired into candidate lines, lines whose pixels are mostly not a wall
+    room class are dropped, then the longer of two walls from the same point
+    and the points are aligned (post_prosessing.get_wall_lines).
+    """
+    _, height, width = logits.shape
+    points = heatmap_peaks(logits[:WALL_JUNCTION_CHANNELS], threshold, gap)
+    if len(points) < 2:
+        return np.zeros((0, 4), dtype=np.float64)
+    walls = pair_junctions(points, width, height, gap)
+    if len(walls) == 0:
+        return np.zeros((0, 4), dtype=np.float64)
+
+    rooms = torch.softmax(torch.from_numpy(np.ascontiguousarray(logits[HEATMAP_CHANNELS : HEATMAP_CHANNELS + ROOM_CLASSES])), 0)
+    xy = points[:, :2]
+    room_class = _room_classes(rooms.numpy(), np.column_stack([xy[walls[:, 0]], xy[walls[:, 1]]]))
+    walls = walls[np.isin(room_class, WALL_CLASSES)]
+    if len(walls) == 0:
+        return np.zeros((0, 4), dtype=np.float64)
+
+    walls = _drop_long_walls(walls, points)
+    vertical = _is_vertical(walls, xy)
+    xy = _align(walls[vertical], xy, 0)
+    xy = _align(walls[~vertical], xy, 1)
+    return np.column_stack([xy[walls[:, 0]], xy[walls[:, 1]]]).astype(np.float64)
@@ -1,7 +1,9 @@
 from __future__ import annotations
 
+import argparse
 import sys
 from pathlib import Path
+import zipfile
 import torch
 
 # Add vendor/ to Python path so we can import floortrans
@@ -11,8 +13,18 @@ sys.path.insert(0, str(ROOT / "vendor"))
 from floortrans.models import get_model
 
 
-def load_cubicasa_model(weights_path: str, device: str) -> torch.nn.Module:
-    ckpt = torch.load(weights_path, map_location="cpu")
+def load_checkpoint(weights_path: str, mmap: bool = True) -> dict:
+    """
+    torch.load on CPU. Checkpoints in torch's zip format are memory-mapped, so
+    tensors are read from the page cache on use and processes loading the same
+    file share those pages; legacy (non-zip) files are read in full.
+    """
+    mmap = mmap and zipfile.is_zipfile(weights_path)
+    return torch.load(weights_path, map_location="cpu", mmap=mmap, weights_only=False)
+
+
+def load_cubicasa_model(weights_path: str, device: str, mmap: bool = True) -> torch.nn.Module:
+    ckpt = load_checkpoint(weights_path, mmap=mmap)
     if not isinstance(ckpt, dict) or "model_state" not in ckpt:
         raise ValueError("Expected checkpoint dict with key 'model_state'")
 
@@ -22,7 +34,27 @@ def load_cubicasa_model(weights_path: str, device: str) -> torch.nn.Module:
         raise ValueError("Missing conv4_.weight in model_state, cannot infer n_classes")
 
     n_classes = state["conv4_.weight"].shape[0]
-    model = get_model("hg_furukawa_original", n_classes).to(device)
-    model.load_state_dict(state)
+    # built without storage, the (memory-mapped) checkpoint tensors become the parameters
+    with torch.device("meta"):
+        model = get_model("hg_furukawa_original", n_classes)
+    model.load_state_dict(state, assign=True)
+    model = model.to(device)
     model.eval()
     return model
+
+
+def convert_checkpoint(src: str, dst: str):
+    """Writes only the model_state of a checkpoint, in the zip format load_checkpoint can mmap."""
+    ckpt = torch.load(src, map_location="cpu", weights_only=False)
+    torch.save({"model_state": ckpt["model_state"]}, dst)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="python -m app.model_loader",
+        description="Convert a checkpoint to a weights-only file that can be memory-mapped",
+    )
+    parser.add_argument("src")
+    parser.add_argument("dst")
+    args = parser.parse_args()
+    convert_checkpoint(args.src, args.dst)
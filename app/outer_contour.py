@@ -2,20 +2,26 @@ from __future__ import annotations
 import cv2
 import numpy as np
 
+from .buffers import scratch
 
-def remove_border_touching_components(bin255: np.ndarray) -> np.ndarray:
-    bin01 = (bin255 > 0).astype(np.uint8)
-    num, lab, stats, _ = cv2.connectedComponentsWithStats(bin01, connectivity=8)
-    h, w = bin01.shape
-    out = np.zeros_like(bin01)
 
-    for cid in range(1, num):
-        x, y, ww, hh, _area = stats[cid]
-        touches = (x == 0) or (y == 0) or (x + ww >= w) or (y + hh >= h)
-        if not touches:
-            out[lab == cid] = 1
-
-    return (out * 255).astype(np.uint8)
+def remove_border_touching_components(bin255: np.ndarray, dst: np.ndarray | None = None) -> np.ndarray:
+    """The mask without the components touching the image border, in dst when given."""
+    h, w = bin255.shape
+    with scratch.borrow((h, w), np.int32) as lab:
+        num, lab, stats, _ = cv2.connectedComponentsWithStats(bin255, labels=lab, connectivity=8)
+
+        # one lookup table over all labels instead of a pass over the image per component
+        x, y, ww, hh = stats[:, 0], stats[:, 1], stats[:, 2], stats[:, 3]
+        keep = ~((x == 0) | (y == 0) | (x + ww >= w) | (y + hh >= h))
+        keep[0] = False
+        lut = np.where(keep, 255, 0).astype(np.uint8)
+        if dst is None:
+            return lut[lab]
+        # in stripes: np.take(..., out=dst) would make an int64 copy of all labels
+        for y in range(0, h, 1024):
+            dst[y : y + 1024] = lut[lab[y : y + 1024]]
+        return dst
 
 
 def fill_holes(bin255: np.ndarray) -> np.ndarray:
@@ -31,6 +37,10 @@ def _odd(n: int) -> int:
     return n if n % 2 == 1 else n + 1
 
 
+def default_pre_dilate_k(h: int, w: int) -> int:
+    return _odd(max(9, int(0.006 * min(h, w))))   # ~0.6% of min dimension
+
+
 def get_building_outer_contour(
     wall255: np.ndarray,
     close_k: int | None = None,
@@ -49,25 +59,130 @@ def get_building_outer_contour(
 
     # adaptive defaults
     if pre_dilate_k is None:
-        pre_dilate_k = _odd(max(9, int(0.006 * m)))   # ~0.6% of min dimension
+        pre_dilate_k = default_pre_dilate_k(h, w)
     if close_k is None:
         close_k = _odd(max(61, int(0.03 * m)))        # ~3% of min dimension
 
-    img = wall255.copy()
+    _dilated, img = _close_walls(wall255, close_k, close_iter, pre_dilate_k, pre_dilate_iter)
+
+    # 3) fill interior to make a solid building region
+    img = fill_holes((img > 0).astype(np.uint8) * 255)
+
+    return _largest_contour(img)
+
 
+def _close_walls(wall255: np.ndarray, close_k: int, close_iter: int, pre_dilate_k: int, pre_dilate_iter: int):
+    """(pre-dilated walls, their closing): steps 1) and 2) of get_building_outer_contour."""
     # 1) dilate to merge parallel wall lines
     kd = cv2.getStructuringElement(cv2.MORPH_RECT, (pre_dilate_k, pre_dilate_k))
-    img = cv2.dilate(img, kd, iterations=pre_dilate_iter)
+    dilated = cv2.dilate(wall255, kd, iterations=pre_dilate_iter)
 
     # 2) strong close to seal gaps
     kc = cv2.getStructuringElement(cv2.MORPH_RECT, (close_k, close_k))
-    img = cv2.morphologyEx(img, cv2.MORPH_CLOSE, kc, iterations=close_iter)
+    closed = cv2.morphologyEx(dilated, cv2.MORPH_CLOSE, kc, iterations=close_iter)
+    return dilated, closed
 
-    # 3) fill interior to make a solid building region
-    img = fill_holes((img > 0).astype(np.uint8) * 255)
 
+def _largest_contour(img: np.ndarray):
     contours, _ = cv2.findContours(img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
     if not contours:
         return None, img
     c = max(contours, key=cv2.contourArea)
     return c, img
+
+
+def get_building_outer_contour_downsampled(
+    wall255: np.ndarray,
+    close_k: int | None = None,
+    close_iter: int = 2,
+    pre_dilate_k: int | None = None,
+    pre_dilate_iter: int = 2,
+    factor: int = 4,
+    dst: np.ndarray | None = None,
+):
+    """
+    get_building_outer_contour with the expensive part at 1/factor resolution.
+
+    The blob (dilate, close, fill) is built on a max-pooled copy of the mask
+    with kernels scaled down, so its cost no longer grows with kernel area x
+    sheet area. Upsampled, it is off by up to a few factor px, so the boundary
+    is refined at full resolution in a band of that width: there the blob
+    is the full-resolution pre-dilated walls, as in the full engine, and
+    where the close bridged a gap at the edge (a door in an exterior wall)
+    the walls are closed at full resolution around it. Same arguments and
+    return value as get_building_outer_contour; the blob is written into dst
+    (uint8, the mask's shape) when given.
+    """
+    h, w = wall255.shape[:2]
+    if pre_dilate_k is None:
+        pre_dilate_k = default_pre_dilate_k(h, w)
+    if close_k is None:
+        close_k = _odd(max(61, int(0.03 * min(h, w))))
+    f = max(1, int(factor))
+    if f == 1:
+        return get_building_outer_contour(wall255, close_k, close_iter, pre_dilate_k, pre_dilate_iter)
+
+    # max-pool: a block is wall if any of its pixels is
+    sh, sw = -(-h // f), -(-w // f)
+    with scratch.borrow((sh * f, sw * f), np.uint8) as padded:
+        padded[h:] = 0
+        padded[:h, w:] = 0
+        np.greater(wall255, 0, out=padded[:h, :w].view(bool))
+        small = padded.reshape(sh, f, sw, f).max(axis=(1, 3)) * np.uint8(255)
+
+    def scaled(k):
+        return _odd(max(1, -(-k // f)))
+
+    coarse = get_building_outer_contour(small, scaled(close_k), close_iter, scaled(pre_dilate_k), pre_dilate_iter)[1]
+    img = np.zeros((h, w), dtype=np.uint8) if dst is None else dst
+    if dst is not None:
+        img.fill(0)
+    if not coarse.any():
+        return None, img
+
+    # full-resolution work only inside the coarse blob's bounding box
+    ys, xs = np.nonzero(coarse)
+    cy0, cy1 = max(0, ys.min() - 1), min(sh, ys.max() + 2)
+    cx0, cx1 = max(0, xs.min() - 1), min(sw, xs.max() + 2)
+    y0, y1 = cy0 * f, min(h, cy1 * f)
+    x0, x1 = cx0 * f, min(w, cx1 * f)
+    bh, bw = y1 - y0, x1 - x0
+    band = _odd(4 * f + 1)
+    kd = cv2.getStructuringElement(cv2.MORPH_RECT, (pre_dilate_k, pre_dilate_k))
+    with scratch.borrow(((cy1 - cy0) * f, (cx1 - cx0) * f), np.uint8) as up, scratch.borrow(
+        (bh, bw), np.uint8
+    ) as inner, scratch.borrow((bh, bw), np.uint8) as walls:
+        # nearest upsampling by an integer factor, of the crop only
+        cv2.resize(coarse[cy0:cy1, cx0:cx1], (up.shape[1], up.shape[0]), dst=up, interpolation=cv2.INTER_NEAREST)
+        blob = up[:bh, :bw]
+        cv2.erode(blob, cv2.getStructuringElement(cv2.MORPH_RECT, (band, band)), dst=inner)
+        cv2.dilate(wall255[y0:y1, x0:x1], kd, dst=walls, iterations=pre_dilate_iter)
+        refined = img[y0:y1, x0:x1]
+        cv2.bitwise_and(walls, blob, dst=refined)
+        cv2.bitwise_or(inner, refined, dst=refined)
+
+        # the pre-dilated walls stop at gaps the close bridged (doors in
+        # exterior walls), which leaves notches in the band: the blob's pixels
+        # left out there reach the eroded blob, unlike the few px it overhangs
+        # the walls by elsewhere. Around each, close at full resolution.
+        cv2.bitwise_and(blob, cv2.bitwise_not(refined), dst=walls)
+        cv2.dilate(inner, None, dst=inner)
+        cv2.bitwise_and(walls, inner, dst=walls)
+        seeds = cv2.findNonZero(walls)
+    if seeds is None:
+        return _largest_contour(img)
+    seeds = seeds.reshape(-1, 2) // f
+    marks = np.zeros((cy1 - cy0, cx1 - cx0), np.uint8)
+    marks[seeds[:, 1], seeds[:, 0]] = 1
+    _num, _lab, stats, _ = cv2.connectedComponentsWithStats(marks, connectivity=8)
+    margin = band // 2 + 2 * f  # from a notch's bottom to its mouth
+    pad = 2 * close_iter * (close_k // 2) + pre_dilate_iter * (pre_dilate_k // 2)  # the walls a closed pixel depends on
+    for gx, gy, gw, gh, _area in stats[1:]:
+        ry0, ry1 = max(0, y0 + gy * f - margin), min(h, y0 + (gy + gh) * f + margin)
+        rx0, rx1 = max(0, x0 + gx * f - margin), min(w, x0 + (gx + gw) * f + margin)
+        wy0, wy1 = max(0, ry0 - pad), min(h, ry1 + pad)
+        wx0, wx1 = max(0, rx0 - pad), min(w, rx1 + pad)
+        win = _close_walls(wall255[wy0:wy1, wx0:wx1], close_k, close_iter, pre_dilate_k, pre_dilate_iter)[1]
+        region = img[ry0:ry1, rx0:rx1]
+        cv2.bitwise_or(region, win[ry0 - wy0 : ry1 - wy0, rx0 - wx0 : rx1 - wx0], dst=region)
+    return _largest_contour(img)
@@ -1,16 +1,118 @@
 import numpy as np
 import fitz  # PyMuPDF
 
-def render_pdf_page(pdf_path: str, dpi: int, page_index: int) -> np.ndarray:
-    doc = fitz.open(pdf_path)
+from .units import InvalidRequestError
+
+
+def _pixmap_array(pix: fitz.Pixmap, pool=None) -> np.ndarray:
+    """The RGB samples of a pixmap as [H,W,3] uint8, copied into an array taken from `pool` when given."""
+    samples = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width, 3)
+    if pool is None:
+        return samples.copy()
+    out = pool.take(samples.shape, np.uint8)
+    np.copyto(out, samples)
+    return out
+
+
+def render_page(doc: fitz.Document, dpi: int, page_index: int, pool=None) -> np.ndarray:
+    """
+    The page rendered at dpi, [H,W,3] uint8. With a buffers.BufferPool the
+    image is taken from it, for the caller to give back.
+    """
     if page_index < 0 or page_index >= len(doc):
-        raise ValueError(f"Invalid page_index={page_index}. PDF has {len(doc)} pages.")
+        raise InvalidRequestError(f"Invalid page_index={page_index}. PDF has {len(doc)} pages.")
 
     page = doc[page_index]
     zoom = dpi / 72.0
     mat = fitz.Matrix(zoom, zoom)
     pix = page.get_pixmap(matrix=mat, alpha=False)
+    return _pixmap_array(pix, pool)
+
+
+def render_page_region(
+    doc: fitz.Document,
+    dpi: int,
+    page_index: int,
+    box_px: tuple[int, int, int, int],
+    pool=None,
+) -> tuple[np.ndarray, tuple[int, int]]:
+    """
+    Renders only the part of a page inside box_px = (x0, y0, x1, y1), given in
+    pixels of the full page at `dpi`. Returns the image and its (x, y) origin in
+    those page pixels; pixels are identical to the same crop of a full render.
+    `pool` as for render_page.
+    """
+    if page_index < 0 or page_index >= len(doc):
+        raise InvalidRequestError(f"Invalid page_index={page_index}. PDF has {len(doc)} pages.")
+
+    page = doc[page_index]
+    zoom = dpi / 72.0
+    x0, y0, x1, y1 = box_px
+    px, py = page.rect.x0, page.rect.y0
+    clip = fitz.Rect(px + x0 / zoom, py + y0 / zoom, px + x1 / zoom, py + y1 / zoom)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, alpha=False)
+
+    img = _pixmap_array(pix, pool)
+    return img, (pix.x - int(round(page.rect.x0 * zoom)), pix.y - int(round(page.rect.y0 * zoom)))
+
+
+def page_pixel_size(doc: fitz.Document, dpi: int, page_index: int) -> tuple[int, int]:
+    """(width, height) of a full render of the page at `dpi`."""
+    if page_index < 0 or page_index >= len(doc):
+        raise InvalidRequestError(f"Invalid page_index={page_index}. PDF has {len(doc)} pages.")
+
+    zoom = dpi / 72.0
+    r = (doc[page_index].rect * fitz.Matrix(zoom, zoom)).irect
+    return r.width, r.height
+
+
+class UnreadablePdfError(ValueError):
+    """The file looks like a PDF but PyMuPDF can't open it (the API answers 422)."""
+
+
+def open_pdf(pdf_path: str | None = None, pdf_bytes: bytes | None = None) -> fitz.Document:
+    """Opens a PDF from disk, or straight from memory when pdf_bytes is given."""
+    try:
+        if pdf_bytes is not None:
+            return fitz.open(stream=pdf_bytes, filetype="pdf")
+        return fitz.open(pdf_path)
+    except RuntimeError as e:  # fitz.FileDataError, EmptyFileError
+        raise UnreadablePdfError(f"Cannot read the PDF: {e}") from e
+
+
+def render_pdf_page(pdf_path: str | None, dpi: int, page_index: int, pdf_bytes: bytes | None = None) -> np.ndarray:
+    doc = open_pdf(pdf_path, pdf_bytes)
+    try:
+        return render_page(doc, dpi, page_index)
+    finally:
+        doc.close()
+
+
+def parse_page_list(pages: str, page_count: int) -> list[int]:
+    """
+    "all" -> every page, otherwise comma separated 0-based indices and ranges,
+    e.g. "0,2,5-7".
+    """
+    pages = pages.strip().lower()
+    if pages in ("", "all"):
+        return list(range(page_count))
+
+    out = []
+    for part in pages.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            a, b = map(int, part.split("-", 1)) if "-" in part else (int(part), int(part))
+        except ValueError:
+            raise InvalidRequestError(f"Invalid pages {pages!r}, expected e.g. 0,2,5-7 or all") from None
+        if b < a:
+            raise InvalidRequestError(f"Invalid page range {part!r}, it ends before it starts")
+        out.extend(range(a, b + 1))
+    if not out:
+        raise InvalidRequestError(f"Invalid pages {pages!r}, no page selected")
 
-    img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, 3)
-    doc.close()
-    return img
+    for i in out:
+        if i < 0 or i >= page_count:
+            raise InvalidRequestError(f"Invalid page_index={i}. PDF has {page_count} pages.")
+    return list(dict.fromkeys(out))
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import fitz  # PyMuPDF
+import numpy as np
+
+from .units import InvalidRequestError
+
+
+def page_segments(
+    doc: fitz.Document,
+    page_index: int,
+    dpi: int,
+    min_width_pt: float = 0.0,
+    max_width_pt: float | None = None,
+    max_luminance: float = 0.8,
+    layers: set[str] | None = None,
+) -> np.ndarray:
+    """
+    Straight segments of a page's vector drawing, [N,4] float64 in page pixels
+    at `dpi` (the coordinates of render_page): lines, rectangle and quad edges;
+    curves are skipped.
+
+    A path is used if its colour (the stroke, or the fill for paths that are
+    only filled) is at most max_luminance (0 black .. 1 white), its stroke width
+    in points is within [min_width_pt, max_width_pt] and, when `layers` is
+    given, its optional content layer is one of them.
+    """
+    if page_index < 0 or page_index >= len(doc):
+        raise InvalidRequestError(f"Invalid page_index={page_index}. PDF has {len(doc)} pages.")
+
+    page = doc[page_index]
+    pts = []
+    for path in page.get_drawings():
+        color = path.get("color") or path.get("fill")
+        if color is None or _luminance(color) > max_luminance:
+            continue
+        width = path.get("width") or 0.0
+        if width < min_width_pt or (max_width_pt is not None and width > max_width_pt):
+            continue
+        if layers is not None and path.get("layer") not in layers:
+            continue
+
+        for item in path["items"]:
+            kind = item[0]
+            if kind == "l":
+                pts.append((item[1], item[2]))
+            elif kind == "re":
+                r = item[1]
+                corners = (r.tl, r.tr, r.br, r.bl)
+                pts.extend(zip(corners, corners[1:] + corners[:1]))
+            elif kind == "qu":
+                q = item[1]
+                corners = (q.ul, q.ur, q.lr, q.ll)
+                pts.extend(zip(corners, corners[1:] + corners[:1]))
+
+    if not pts:
+        return np.zeros((0, 4), dtype=np.float64)
+
+    # drawings are in unrotated page space, renders show the rotated page
+    m = page.rotation_matrix * fitz.Matrix(dpi / 72.0, dpi / 72.0)
+    xy = np.array([(p.x, p.y) for pair in pts for p in pair], dtype=np.float64)
+    xy = xy @ np.array([[m.a, m.b], [m.c, m.d]]) + (m.e, m.f)
+    xy -= (page.rect.x0 * dpi / 72.0, page.rect.y0 * dpi / 72.0)
+    return xy.reshape(-1, 4)
+
+
+def _luminance(color) -> float:
+    """0 (black) .. 1 (white) for gray, RGB and CMYK colour tuples."""
+    if len(color) == 1:
+        return float(color[0])
+    if len(color) == 4:
+        c, m, y, k = color
+        color = ((1 - c) * (1 - k), (1 - m) * (1 - k), (1 - y) * (1 - k))
+    r, g, b = color[:3]
+    return 0.299 * r + 0.587 * g + 0.114 * b
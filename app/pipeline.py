@@ -1,123 +1,817 @@
 from __future__ import annotations
 
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
 from pathlib import Path
 import math
-import torch
+import os
+import shutil
+import threading
+import time
 import cv2
+import numpy as np
+import torch
 
+from .buffers import scratch
+from .cache import GeometryCache, bytes_sha256, file_sha256
+from .geometry import PageGeometry, page_geometry_path, page_wall_path, save_wall_mask
+from .backends import RotationTTA
+from .instrumentation import Timings
+from .junctions import WALL_JUNCTION_CHANNELS, junction_wall_lines
 from .preprocess import preprocess_image_rgb, pick_seg_tensor
-from .pdf_render import render_pdf_page
+from .tiling import predict_wall_margin_tiled
+from .pdf_render import open_pdf, render_page, render_page_region, page_pixel_size, parse_page_list
+from .pdf_vectors import page_segments
+from .roi import find_drawing_viewport
 from .units import parse_inches_per_foot, feet_per_pixel_from_scale, feet_to_arch
-from .wall_lines import wall_mask_from_pred, remove_sheet_margins, extract_wall_lines
-from .outer_contour import remove_border_touching_components, get_building_outer_contour
+from .wall_lines import (
+    LINE_ENGINES,
+    wall_mask_from_small,
+    wall_mask_from_margin,
+    remove_sheet_margins,
+    extract_wall_lines,
+)
+from .outer_contour import (
+    default_pre_dilate_k,
+    get_building_outer_contour_downsampled,
+    remove_border_touching_components,
+)
 from .visualize import save_lines_overlay, save_outer_contour_overlay
 
 
 # Fixed settings (no user control)
 WALL_LABEL = 23
-DPI = 300
+DPI = 300  # resolution of the wall mask and of all geometry (page pixels)
+NETWORK_SIZE = 1024  # long side of the network input with inference="full"
+RENDER_OVERSAMPLE = 2  # full inference renders at this multiple of NETWORK_SIZE, not at DPI
+CONTOUR_DOWNSAMPLE = 4  # the outline's dilate/close/fill run at DPI / this, refined at DPI
+
+# Bump when a change alters the geometry produced for the same page,
+# so cached results from older code are not reused.
+PIPELINE_VERSION = "4"
+
+LINES_OVERLAY = "lines_overlay.png"
+OUTER_OVERLAY = "outer_overlay.png"
+WALL_MASK = "wall.npz"  # the page's wall mask, kept with cached geometry for revisions
+
+INFERENCE_MODES = ("full", "tiled")
+
+
+class OptionsError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class PipelineOptions:
+    """
+    Per-request pipeline settings.
+
+    inference="full" runs the model once on the page scaled to 1024 px.
+    inference="tiled" runs it on overlapping tile_size tiles of the page
+    rendered at tile_dpi and blends the logits (see tiling.py).
+    roi=True renders and processes only the drawing viewport found by a
+    low-DPI pre-pass (see roi.py) instead of the whole sheet.
+    line_engine picks how wall lines are found in the mask (see
+    wall_lines.extract_wall_lines); "vector" takes them from the PDF's
+    drawing, with the wall mask deciding which strokes are walls,
+    "junctions" pairs the junction points the model finds (full inference
+    only). network_size is the long side of the network input with
+    inference="full". tta=True averages the model over the four quarter
+    turns of its input (see backends.RotationTTA), at four times the
+    inference cost.
+    """
+
+    inference: str = "full"
+    tile_size: int = 1024
+    tile_overlap: int = 128
+    tile_dpi: int = 150
+    tile_batch: int = 4
+    tile_memory_mb: int = 1024
+    roi: bool = False
+    line_engine: str = "hough"
+    network_size: int = NETWORK_SIZE
+    tta: bool = False
+
+    # only affect speed and memory, not the geometry
+    RUNTIME_FIELDS = ("tile_batch", "tile_memory_mb")
+
+    def __post_init__(self):
+        if self.inference not in INFERENCE_MODES:
+            raise OptionsError(f"inference must be one of {INFERENCE_MODES}, got {self.inference!r}")
+        if self.tile_size <= 0 or self.tile_size % 64:
+            raise OptionsError("tile_size must be a positive multiple of 64")
+        if not 0 <= self.tile_overlap < self.tile_size:
+            raise OptionsError("tile_overlap must be in [0, tile_size)")
+        if not 0 < self.tile_dpi <= DPI:
+            raise OptionsError(f"tile_dpi must be in (0, {DPI}]")
+        if self.line_engine not in LINE_ENGINES:
+            raise OptionsError(f"line_engine must be one of {LINE_ENGINES}, got {self.line_engine!r}")
+        if self.network_size <= 0 or self.network_size % 64:
+            raise OptionsError("network_size must be a positive multiple of 64")
+        if self.line_engine == "junctions" and self.inference == "tiled":
+            raise OptionsError('line_engine="junctions" needs inference="full"')
+
+    def cache_fields(self) -> dict:
+        out = {k: v for k, v in asdict(self).items() if k not in self.RUNTIME_FIELDS}
+        if self.inference != "tiled":
+            out = {k: v for k, v in out.items() if not k.startswith("tile_")}
+        else:
+            del out["network_size"]
+        return out
 
 
 def estimate_lengths_from_pdf(
-    pdf_path: str,
+    pdf_path: str | None,
     model: torch.nn.Module,
     device: str,
     page_index: int = 0,
     scale_inch_per_foot: str = "3/16",
     debug_outputs_dir: str | None = None,
+    cache: GeometryCache | None = None,
+    file_hash: str | None = None,
+    pdf_bytes: bytes | None = None,
+    options: PipelineOptions | None = None,
+    geometry_dir: str | None = None,
 ):
-    # units
-    inches_per_foot = parse_inches_per_foot(scale_inch_per_foot)
-    fpp = feet_per_pixel_from_scale(DPI, inches_per_foot)
+    """
+    Estimates one page of a PDF given by path, or by its bytes for in-memory uploads.
+    The result carries per-stage "timings" (see instrumentation.Timings).
 
-    # render PDF page
-    page_rgb = render_pdf_page(pdf_path, dpi=DPI, page_index=page_index)
-    h, w = page_rgb.shape[:2]
+    debug_outputs_dir gets the overlay PNGs right away; geometry_dir only the
+    page geometry (page_<i>.npz), from which results.ResultStore draws
+    overlays on demand.
+    """
+    timings = Timings()
+    key = None
+    if cache is not None:
+        with timings.stage("cache_lookup"):
+            key = cache.key(file_hash or _source_sha256(pdf_path, pdf_bytes), page_index, **cache_config(options))
+            hit = cache.get(key)
+        if hit is not None:
+            return _result_from_cache(hit, page_index, scale_inch_per_foot, debug_outputs_dir, timings, geometry_dir)
 
-    # segmentation
-    _orig, _pad, x, (nh, nw) = preprocess_image_rgb(page_rgb, target_long_side=1024)
-    x = x.to(device)
+    doc = open_pdf(pdf_path, pdf_bytes)
+    try:
+        page_rgb, origin, page_size, region_size = render_for_pipeline(doc, page_index, options, timings, pool=scratch)
+        segments = vector_segments_for_pipeline(doc, page_index, options, timings)
+    finally:
+        doc.close()
+    try:
+        return estimate_lengths_from_image(
+            page_rgb,
+            model=model,
+            device=device,
+            page_index=page_index,
+            scale_inch_per_foot=scale_inch_per_foot,
+            debug_outputs_dir=debug_outputs_dir,
+            cache=cache,
+            cache_key=key,
+            options=options,
+            origin=origin,
+            page_size=page_size,
+            timings=timings,
+            geometry_dir=geometry_dir,
+            region_size=region_size,
+            vector_segments=segments,
+        )
+    finally:
+        scratch.give(page_rgb)
+
+
+def inference_dpi(region_size: tuple[int, int], options: PipelineOptions | None = None) -> float:
+    """
+    Resolution the network needs of a region of region_size = (w, h) page pixels:
+    tile_dpi for tiled inference, otherwise RENDER_OVERSAMPLE times
+    options.network_size over the region's long side. Never more than DPI.
+    """
+    options = options or PipelineOptions()
+    if options.inference == "tiled":
+        return float(options.tile_dpi)
+    return min(float(DPI), DPI * RENDER_OVERSAMPLE * options.network_size / max(1, *region_size))
+
+
+def render_for_pipeline(
+    doc,
+    page_index: int,
+    options: PipelineOptions | None = None,
+    timings: Timings | None = None,
+    pool=None,
+):
+    """
+    Renders what the pipeline needs of a page: the whole page, or with
+    options.roi only its drawing viewport, at inference_dpi rather than DPI;
+    the geometry is measured on the wall mask scaled up to DPI.
+
+    Returns (rgb, origin, page_size, region_size): the (x, y) origin of rgb,
+    the (w, h) of the full page and the (w, h) rgb covers, all in page pixels.
+    With a buffers.BufferPool, rgb is taken from it (see pdf_render.render_page).
+    """
+    options = options or PipelineOptions()
+    timings = timings or Timings()
+    page_size = page_pixel_size(doc, DPI, page_index)
+    box = None
+    if options.roi:
+        with timings.stage("roi"):
+            box = find_drawing_viewport(doc, page_index, dpi=DPI)
+        if box is not None and not (box[2] > box[0] and box[3] > box[1]):
+            box = None
 
-    with torch.no_grad():
-        out = model(x)
+    if box is None:
+        dpi = inference_dpi(page_size, options)
+        with timings.stage("render"):
+            rgb = render_page(doc, dpi=dpi, page_index=page_index, pool=pool)
+            timings.array("page_rgb", rgb)
+        return rgb, (0, 0), page_size, page_size
+
+    dpi = inference_dpi((box[2] - box[0], box[3] - box[1]), options)
+    rgb, origin, region_size = render_region_for_pipeline(doc, page_index, box, dpi, page_size, timings, pool=pool)
+    return rgb, origin, page_size, region_size
+
+
+def render_region_for_pipeline(
+    doc,
+    page_index: int,
+    box: tuple[int, int, int, int],
+    dpi: float,
+    page_size: tuple[int, int],
+    timings: Timings | None = None,
+    pool=None,
+):
+    """
+    Renders box = (x0, y0, x1, y1) of the page, in page pixels, at dpi.
+    Returns (rgb, origin, region_size) as render_for_pipeline does.
+    """
+    timings = timings or Timings()
+    s = dpi / DPI
+    with timings.stage("render"):
+        box_r = (int(box[0] * s), int(box[1] * s), int(math.ceil(box[2] * s)), int(math.ceil(box[3] * s)))
+        rgb, (rx, ry) = render_page_region(doc, dpi, page_index, box_r, pool=pool)
+        timings.array("page_rgb", rgb)
+    origin = (int(round(rx / s)), int(round(ry / s)))
+    region_size = (
+        min(page_size[0] - origin[0], int(round(rgb.shape[1] / s))),
+        min(page_size[1] - origin[1], int(round(rgb.shape[0] / s))),
+    )
+    return rgb, origin, region_size
+
+
+def vector_segments_for_pipeline(
+    doc,
+    page_index: int,
+    options: PipelineOptions | None = None,
+    timings: Timings | None = None,
+):
+    """The page's vector strokes in page pixels for line_engine="vector", else None."""
+    options = options or PipelineOptions()
+    timings = timings or Timings()
+    if options.line_engine != "vector":
+        return None
+    with timings.stage("vector_paths"):
+        segments = page_segments(doc, page_index, dpi=DPI)
+        timings.array("vector_segments", segments)
+    return segments
 
-    seg = pick_seg_tensor(out)
-    logits = seg[0].detach().cpu()
-    pred = torch.argmax(logits, dim=0).numpy()
-    pred = pred[:nh, :nw]
+
+def estimate_lengths_from_image(
+    page_rgb,
+    model: torch.nn.Module,
+    device: str,
+    page_index: int = 0,
+    scale_inch_per_foot: str = "3/16",
+    debug_outputs_dir: str | None = None,
+    cache: GeometryCache | None = None,
+    cache_key: str | None = None,
+    options: PipelineOptions | None = None,
+    origin: tuple[int, int] = (0, 0),
+    page_size: tuple[int, int] | None = None,
+    timings: Timings | None = None,
+    geometry_dir: str | None = None,
+    region_size: tuple[int, int] | None = None,
+    vector_segments: np.ndarray | None = None,
+):
+    """
+    page_rgb may be a crop of the page and rendered below DPI (see
+    render_for_pipeline); origin, page_size and region_size (default: the size
+    of page_rgb) place it on the page and results are in page coordinates.
+    """
+    timings = timings or Timings()
+    geom = measure_page(
+        page_rgb,
+        model,
+        device,
+        options,
+        origin=origin,
+        page_size=page_size,
+        timings=timings,
+        region_size=region_size,
+        vector_segments=vector_segments,
+    )
+
+    try:
+        # Optional debug overlays
+        lines_overlay_path = None
+        outer_overlay_path = None
+        if debug_outputs_dir:
+            with timings.stage("overlays"):
+                lines_overlay_path, outer_overlay_path = save_debug_overlays(
+                    page_rgb, geom, debug_outputs_dir, origin=origin, region_size=region_size
+                )
+        wall_path = None
+        if geometry_dir:
+            with timings.stage("geometry_store"):
+                save_page_geometry(geom, geometry_dir, page_index)
+                wall_path = str(page_wall_path(geometry_dir, page_index))
+    finally:
+        # the mask is stored by now, its buffer goes to the next page
+        scratch.give(geom.wall)
+        geom.wall = None
+
+    result = lengths_from_geometry(geom, page_index, scale_inch_per_foot)
+    result["lines_overlay_path"] = lines_overlay_path
+    result["outer_overlay_path"] = outer_overlay_path
+
+    if cache is not None and cache_key is not None:
+        with timings.stage("cache_store"):
+            cache.put(
+                cache_key,
+                geom,
+                files={LINES_OVERLAY: lines_overlay_path, OUTER_OVERLAY: outer_overlay_path, WALL_MASK: wall_path},
+            )
+        result["cache_hit"] = False
+    result["timings"] = timings.to_dict()
+    return result
+
+
+def measure_page(
+    page_rgb,
+    model: torch.nn.Module,
+    device: str,
+    options: PipelineOptions | None = None,
+    origin: tuple[int, int] = (0, 0),
+    page_size: tuple[int, int] | None = None,
+    timings: Timings | None = None,
+    region_size: tuple[int, int] | None = None,
+    vector_segments: np.ndarray | None = None,
+) -> PageGeometry:
+    """
+    Runs segmentation and geometry extraction, everything that doesn't depend on
+    the scale. The wall mask is made region_size (page pixels at DPI) whatever
+    resolution page_rgb was rendered at; geom.wall is taken from
+    buffers.scratch (see measure_wall_mask). vector_segments (page pixels)
+    feed the "vector" line engine.
+    """
+    options = options or PipelineOptions()
+    timings = timings or Timings()
+    w, h = region_size or (page_rgb.shape[1], page_rgb.shape[0])
+    pw, ph = page_size or (w, h)
+    wall, junction_lines = measure_wall_mask(
+        page_rgb, model, device, options, origin, (pw, ph), timings, region_size=(w, h)
+    )
+    lines = measure_wall_lines(wall, options, origin, timings, vector_segments, junction_lines)
+    contour = measure_outer_contour(wall, origin, (pw, ph), timings)
+    return PageGeometry(
+        width=pw,
+        height=ph,
+        dpi=DPI,
+        lines=lines,
+        contour=contour,
+        wall=wall,
+        wall_origin=origin,
+    )
+
+
+def measure_wall_mask(
+    page_rgb,
+    model: torch.nn.Module,
+    device: str,
+    options: PipelineOptions,
+    origin: tuple[int, int],
+    page_size: tuple[int, int],
+    timings: Timings,
+    region_size: tuple[int, int] | None = None,
+):
+    """
+    (wall mask of region_size without the sheet margins, junction lines in
+    its pixels or None), see measure_page. The mask is taken from
+    buffers.scratch, for the caller to give back.
+    """
+    w, h = region_size or (page_rgb.shape[1], page_rgb.shape[0])
+    if options.tta:
+        model = RotationTTA(model)
 
     # wall mask in page resolution (ONLY label 23)
-    wall = wall_mask_from_pred(pred, wall_label=WALL_LABEL, out_w=w, out_h=h)
-    wall = remove_sheet_margins(wall, remove_left_titleblock=True)
+    junction_lines = None
+    wall = scratch.take((h, w), np.uint8)
+    try:
+        if options.inference == "tiled":
+            _tiled_wall_mask(page_rgb, model, device, options, timings, out_size=(w, h), dst=wall)
+        else:
+            _wall, junction_lines = _full_wall_mask(
+                page_rgb,
+                model,
+                device,
+                timings,
+                out_size=(w, h),
+                junctions=options.line_engine == "junctions",
+                network_size=options.network_size,
+                dst=wall,
+            )
+        with timings.stage("wall_mask"):
+            remove_sheet_margins(wall, remove_left_titleblock=True, origin=origin, page_size=page_size, dst=wall)
+            timings.array("wall", wall)
+    except BaseException:
+        scratch.give(wall)
+        raise
+    return wall, junction_lines
 
-    # TOTAL wall length from detected wall line segments
-    lines = extract_wall_lines(wall)
-    total_ft = 0.0
-    line_items = []
-    for i, l in enumerate(lines, start=1):
-        x1, y1, x2, y2 = map(float, l)
-        length_px = math.hypot(x2 - x1, y2 - y1)
-        length_ft = length_px * fpp
-        total_ft += length_ft
-        line_items.append(
-            {
-                "id": i,
-                "x1": x1,
-                "y1": y1,
-                "x2": x2,
-                "y2": y2,
-                "length_ft_decimal": length_ft,
-                "length_arch": feet_to_arch(length_ft),
-            }
+
+def measure_wall_lines(
+    wall: np.ndarray,
+    options: PipelineOptions,
+    origin: tuple[int, int],
+    timings: Timings,
+    vector_segments: np.ndarray | None = None,
+    junction_lines: np.ndarray | None = None,
+) -> np.ndarray:
+    """Wall line segments (for TOTAL length) of a wall mask at origin, [N,4] in page pixels."""
+    ox, oy = origin
+    with timings.stage("wall_lines"):
+        if vector_segments is not None:
+            vector_segments = vector_segments - (ox, oy, ox, oy)
+        lines = extract_wall_lines(
+            wall,
+            engine=options.line_engine,
+            vector_segments_in=vector_segments,
+            junction_lines_in=junction_lines,
         )
+        lines = np.asarray(lines, dtype=np.float64).reshape(-1, 4)
+        lines += (ox, oy, ox, oy)
+        timings.array("lines", lines)
+    return lines
 
-    # OUTER perimeter length
-    wall_nb = remove_border_touching_components(wall)
-    contour, _blob = get_building_outer_contour(wall_nb, close_k=121, close_iter=2)
 
-    if contour is None:
-        outer_ft = 0.0
-    else:
-        perim_px = cv2.arcLength(contour, True)
-        outer_ft = perim_px * fpp
+def measure_outer_contour(
+    wall: np.ndarray,
+    origin: tuple[int, int],
+    page_size: tuple[int, int],
+    timings: Timings,
+) -> np.ndarray | None:
+    """Building outline (for OUTER perimeter) of a wall mask at origin, in page pixels."""
+    pw, ph = page_size
+    cropped = (wall.shape[1], wall.shape[0]) != (pw, ph)
+    # on a full page the cleared margins mean nothing touches the border, a
+    # crop's edges are not the sheet border
+    with timings.stage("outer_contour"):
+        wall_nb = None if cropped else remove_border_touching_components(wall, dst=scratch.take(wall.shape))
+        try:
+            with scratch.borrow(wall.shape, np.uint8) as blob:
+                contour, _blob = get_building_outer_contour_downsampled(
+                    wall if wall_nb is None else wall_nb,
+                    close_k=121,
+                    close_iter=2,
+                    pre_dilate_k=default_pre_dilate_k(ph, pw),
+                    factor=CONTOUR_DOWNSAMPLE,
+                    dst=blob,
+                )
+        finally:
+            scratch.give(wall_nb)
+    if contour is not None:
+        contour = contour + np.array(origin, dtype=contour.dtype)
+    return contour
+
+
+def _full_wall_mask(
+    page_rgb,
+    model,
+    device: str,
+    timings: Timings,
+    out_size: tuple[int, int] | None = None,
+    junctions: bool = False,
+    network_size: int = NETWORK_SIZE,
+    dst: np.ndarray | None = None,
+):
+    """
+    (wall mask of out_size, junction wall lines in its pixels or None). The
+    junction lines are only made when asked for and the model gives heatmaps
+    (not a wall head). The mask is written into dst when given.
+    """
+    w, h = out_size or (page_rgb.shape[1], page_rgb.shape[0])
+
+    # segmentation
+    with timings.stage("preprocess"):
+        _orig, _pad, x, (nh, nw) = preprocess_image_rgb(page_rgb, target_long_side=network_size)
+        x = x.to(device)
+
+    with timings.stage("inference"):
+        with torch.no_grad():
+            out = model(x)
+
+        seg = pick_seg_tensor(out)
+        logits = seg[0].detach().cpu()
+        timings.array("logits", logits.numpy())
+        if logits.shape[0] == 1:
+            # a wall head (see wall_head.py) gives the wall margin only
+            wall_small = (logits[0] > 0).numpy()[:nh, :nw]
+        else:
+            pred = torch.argmax(logits, dim=0).numpy()
+            wall_small = pred[:nh, :nw] == WALL_LABEL
+
+    lines = None
+    if junctions and logits.shape[0] > WALL_JUNCTION_CHANNELS:
+        with timings.stage("junctions"):
+            lines = junction_wall_lines(logits.numpy()[:, :nh, :nw])
+            # network pixel centres to out_size pixels
+            lines = (lines + 0.5) * (w / nw, h / nh, w / nw, h / nh) - 0.5
+
+    with timings.stage("wall_mask"):
+        return wall_mask_from_small(wall_small, out_w=w, out_h=h, dst=dst), lines
+
+
+def _tiled_wall_mask(
+    page_rgb,
+    model,
+    device: str,
+    options: PipelineOptions,
+    timings: Timings,
+    out_size: tuple[int, int] | None = None,
+    dst: np.ndarray | None = None,
+):
+    w, h = out_size or (page_rgb.shape[1], page_rgb.shape[0])
+    scale = options.tile_dpi / DPI
+    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    rgb = page_rgb
+    if page_rgb.shape[1] > size[0]:
+        # rendered above tile_dpi (render_for_pipeline renders at tile_dpi already)
+        with timings.stage("preprocess"):
+            rgb = cv2.resize(page_rgb, size, interpolation=cv2.INTER_AREA)
+
+    with timings.stage("inference"):
+        margin = predict_wall_margin_tiled(
+            model,
+            rgb,
+            device=device,
+            wall_label=WALL_LABEL,
+            tile_size=options.tile_size,
+            overlap=options.tile_overlap,
+            batch_size=options.tile_batch,
+            memory_bytes=options.tile_memory_mb * 1024 * 1024,
+        )
+        timings.array("margin", margin)
+
+    with timings.stage("wall_mask"):
+        return wall_mask_from_margin(margin, out_w=w, out_h=h, dst=dst)
+
+
+def lengths_from_geometry(geom: PageGeometry, page_index: int, scale_inch_per_foot: str) -> dict:
+    """
+    Lengths of a page. "lines" stays the [N,4] array of segments with their
+    lengths in "line_lengths_ft"; encodings.py turns them into the response
+    (per line dicts with arch strings only for the verbose JSON).
+    """
+    # units
+    inches_per_foot = parse_inches_per_foot(scale_inch_per_foot)
+    fpp = feet_per_pixel_from_scale(geom.dpi, inches_per_foot)
+
+    # TOTAL wall length from detected wall line segments
+    lines = np.asarray(geom.lines, dtype=np.float64).reshape(-1, 4)
+    lengths_ft = np.hypot(lines[:, 2] - lines[:, 0], lines[:, 3] - lines[:, 1]) * fpp
+    total_ft = float(sum(lengths_ft.tolist()))
+
+    # OUTER perimeter length
+    outer_ft = geom.perimeter_px() * fpp
 
     # INNER = TOTAL - OUTER
     inner_ft = total_ft - outer_ft
     if inner_ft < 0:
         inner_ft = 0.0
 
-    # Optional debug overlays
-    lines_overlay_path = None
-    outer_overlay_path = None
-    if debug_outputs_dir:
-        debug_dir = Path(debug_outputs_dir)
-        debug_dir.mkdir(parents=True, exist_ok=True)
+    return {
+        "page_index": page_index,
+        "scale_inch_per_foot": scale_inch_per_foot,
+        "dpi_fixed": geom.dpi,
+        "wall_label_fixed": WALL_LABEL,
+        "feet_per_pixel": fpp,
+        "total_ft": total_ft,
+        "outer_ft": outer_ft,
+        "inner_ft": inner_ft,
+        "total_arch": feet_to_arch(total_ft),
+        "outer_arch": feet_to_arch(outer_ft),
+        "inner_arch": feet_to_arch(inner_ft),
+        "lines": lines,
+        "line_lengths_ft": lengths_ft,
+    }
+
+
+def save_debug_overlays(
+    page_rgb,
+    geom: PageGeometry,
+    debug_outputs_dir: str,
+    origin: tuple[int, int] = (0, 0),
+    region_size: tuple[int, int] | None = None,
+) -> tuple[str, str]:
+    """
+    Draws the geometry over page_rgb, a crop of the page at `origin` or the page
+    itself, covering region_size page pixels (default: its own size).
+    """
+    debug_dir = Path(debug_outputs_dir)
+    debug_dir.mkdir(parents=True, exist_ok=True)
+    ox, oy = origin
+    s = page_rgb.shape[1] / region_size[0] if region_size else 1.0
 
+    contour = geom.contour
+    if contour is not None:
+        contour = np.round((contour - np.array([ox, oy])) * s).astype(np.int32)
+    # both overlays are drawn in one page-size buffer, one after the other
+    with scratch.borrow(page_rgb.shape, np.uint8) as overlay:
         lines_overlay_path = save_lines_overlay(
             page_rgb=page_rgb,
-            lines=lines,
-            out_path=str(debug_dir / "lines_overlay.png"),
+            lines=(geom.lines - (ox, oy, ox, oy)) * s,
+            out_path=str(debug_dir / LINES_OVERLAY),
+            line_thickness=max(1, int(round(3 * s))),
+            dst=overlay,
         )
-
         outer_overlay_path = save_outer_contour_overlay(
             page_rgb=page_rgb,
             contour=contour,
-            out_path=str(debug_dir / "outer_overlay.png"),
+            out_path=str(debug_dir / OUTER_OVERLAY),
+            border_thickness=max(1, int(round(6 * s))),
+            dst=overlay,
         )
+    return lines_overlay_path, outer_overlay_path
+
+
+def save_page_geometry(geom: PageGeometry, geometry_dir: str, page_index: int) -> Path:
+    """page_<i>.npz, plus the wall mask (page_<i>.wall.npz) when geom still has it."""
+    path = page_geometry_path(geometry_dir, page_index)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    geom.save(path)
+    if geom.wall is not None:
+        save_wall_mask(page_wall_path(geometry_dir, page_index), geom.wall, geom.wall_origin)
+    return path
+
 
+def cache_config(options: PipelineOptions | None = None) -> dict:
+    """Pipeline settings that change the cached geometry, part of every cache key."""
+    options = options or PipelineOptions()
     return {
-        "page_index": page_index,
+        "version": PIPELINE_VERSION,
+        "dpi": DPI,
+        "render_oversample": RENDER_OVERSAMPLE,
+        "wall_label": WALL_LABEL,
+        **options.cache_fields(),
+    }
+
+
+def _source_sha256(pdf_path: str | None, pdf_bytes: bytes | None) -> str:
+    if pdf_bytes is not None:
+        return bytes_sha256(pdf_bytes)
+    return file_sha256(pdf_path)
+
+
+def _result_from_cache(
+    hit,
+    page_index: int,
+    scale_inch_per_foot: str,
+    debug_outputs_dir: str | None,
+    timings: Timings | None = None,
+    geometry_dir: str | None = None,
+) -> dict:
+    geom, entry = hit
+    result = lengths_from_geometry(geom, page_index, scale_inch_per_foot)
+    if geometry_dir:
+        save_page_geometry(geom, geometry_dir, page_index)
+        if (entry / WALL_MASK).exists():
+            shutil.copyfile(entry / WALL_MASK, page_wall_path(geometry_dir, page_index))
+
+    # overlays only depend on the geometry, reuse the ones stored with it
+    overlays = {}
+    for name in (LINES_OVERLAY, OUTER_OVERLAY):
+        src = entry / name
+        overlays[name] = None
+        if debug_outputs_dir and src.exists():
+            Path(debug_outputs_dir).mkdir(parents=True, exist_ok=True)
+            dst = Path(debug_outputs_dir) / name
+            shutil.copyfile(src, dst)
+            overlays[name] = str(dst)
+
+    result["lines_overlay_path"] = overlays[LINES_OVERLAY]
+    result["outer_overlay_path"] = overlays[OUTER_OVERLAY]
+    result["cache_hit"] = True
+    result["timings"] = (timings or Timings()).to_dict()
+    return result
+
+
+def estimate_document_from_pdf(
+    pdf_path: str | None,
+    model: torch.nn.Module,
+    device: str,
+    pages: str = "all",
+    scale_inch_per_foot: str = "3/16",
+    debug_outputs_dir: str | None = None,
+    max_parallel_pages: int | None = None,
+    cache: GeometryCache | None = None,
+    file_hash: str | None = None,
+    pdf_bytes: bytes | None = None,
+    options: PipelineOptions | None = None,
+    geometry_dir: str | None = None,
+):
+    """
+    Estimates every requested page of a PDF opened once (from pdf_path, or
+    from pdf_bytes for in-memory uploads).
+
+    Pages are rendered one after another in this thread (a PyMuPDF document
+    must not be shared between threads) and handed to a thread pool for
+    segmentation and geometry, so with a MicroBatcher in front of the model the
+    forward passes of concurrent pages are batched. At most max_parallel_pages
+    rendered pages are held in memory at a time. Pages found in `cache` are
+    answered from their stored geometry without being rendered. Each page
+    carries its own stage "timings", the document only its total wall time.
+    """
+    t0 = time.perf_counter()
+    if max_parallel_pages is None:
+        max_parallel_pages = min(4, os.cpu_count() or 1)
+    max_parallel_pages = max(1, max_parallel_pages)
+
+    if cache is not None and file_hash is None:
+        file_hash = _source_sha256(pdf_path, pdf_bytes)
+
+    def page_dir(page_index):
+        if not debug_outputs_dir:
+            return None
+        return str(Path(debug_outputs_dir) / f"page_{page_index}")
+
+    doc = open_pdf(pdf_path, pdf_bytes)
+    try:
+        page_indices = parse_page_list(pages, len(doc))
+        slots = threading.BoundedSemaphore(max_parallel_pages)
+
+        def run_page(page_index, rendered, segments, key, timings):
+            page_rgb, origin, page_size, region_size = rendered
+            try:
+                return estimate_lengths_from_image(
+                    page_rgb,
+                    model=model,
+                    device=device,
+                    page_index=page_index,
+                    scale_inch_per_foot=scale_inch_per_foot,
+                    debug_outputs_dir=page_dir(page_index),
+                    cache=cache,
+                    cache_key=key,
+                    options=options,
+                    origin=origin,
+                    page_size=page_size,
+                    timings=timings,
+                    geometry_dir=geometry_dir,
+                    region_size=region_size,
+                    vector_segments=segments,
+                )
+            finally:
+                scratch.give(page_rgb)
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=max_parallel_pages, thread_name_prefix="page") as ex:
+            futures = []
+            for page_index in page_indices:
+                timings = Timings()
+                key = None
+                if cache is not None:
+                    with timings.stage("cache_lookup"):
+                        key = cache.key(file_hash, page_index, **cache_config(options))
+                        hit = cache.get(key)
+                    if hit is not None:
+                        done = Future()
+                        done.set_result(
+                            _result_from_cache(
+                                hit, page_index, scale_inch_per_foot, page_dir(page_index), timings, geometry_dir
+                            )
+                        )
+                        futures.append(done)
+                        continue
+
+                slots.acquire()
+                try:
+                    rendered = render_for_pipeline(doc, page_index, options, timings, pool=scratch)
+                    segments = vector_segments_for_pipeline(doc, page_index, options, timings)
+                except BaseException:
+                    slots.release()
+                    raise
+                futures.append(ex.submit(run_page, page_index, rendered, segments, key, timings))
+            page_results = [f.result() for f in futures]
+    finally:
+        doc.close()
+
+    total_ft = sum(r["total_ft"] for r in page_results)
+    outer_ft = sum(r["outer_ft"] for r in page_results)
+    inner_ft = sum(r["inner_ft"] for r in page_results)
+    return {
+        "page_count": len(page_results),
         "scale_inch_per_foot": scale_inch_per_foot,
-        "dpi_fixed": DPI,
-        "wall_label_fixed": WALL_LABEL,
-        "feet_per_pixel": fpp,
         "total_ft": total_ft,
         "outer_ft": outer_ft,
         "inner_ft": inner_ft,
         "total_arch": feet_to_arch(total_ft),
         "outer_arch": feet_to_arch(outer_ft),
         "inner_arch": feet_to_arch(inner_ft),
-        "lines": line_items,
-        "lines_overlay_path": lines_overlay_path,
-        "outer_overlay_path": outer_overlay_path,
+        "pages": page_results,
+        "timings": {"total_s": time.perf_counter() - t0},
     }
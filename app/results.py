@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+import uuid
+
+import cv2
+import numpy as np
+
+from .buffers import scratch
+from .geometry import PageGeometry, page_geometry_path
+from .pdf_render import open_pdf, render_page, render_page_region
+from .visualize import draw_lines_overlay, draw_outer_contour_overlay
+
+OVERLAY_KINDS = ("lines", "outer")
+MIN_OVERLAY_DPI = 10
+
+
+class ResultStore:
+    """
+    Finished estimations kept for on-demand debug overlays.
+
+    A result is the uploaded PDF at <root>/<id>.pdf plus the PageGeometry of
+    each estimated page at <root>/<id>/page_<i>.npz (written by the pipeline
+    through its geometry_dir). Overlays are rendered from those the first time
+    they're asked for, at any DPI up to the geometry's and optionally for a
+    box of the page only, and kept as PNGs under <root>/<id>/overlays/.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def result_dir(self, result_id: str) -> Path:
+        # ids are uuids handed out by the API, anything else never reaches the disk
+        try:
+            result_id = str(uuid.UUID(result_id))
+        except ValueError:
+            raise KeyError(result_id) from None
+        return self.root / result_id
+
+    def source_path(self, result_id: str) -> Path:
+        return self.result_dir(result_id).with_suffix(".pdf")
+
+    def exists(self, result_id: str) -> bool:
+        """Whether the result's PDF and geometry are kept (e.g. for a revision to start from)."""
+        try:
+            return self.source_path(result_id).exists() and self.result_dir(result_id).is_dir()
+        except KeyError:
+            return False
+
+    def save_source(self, result_id: str, data: bytes):
+        """Keeps an upload that was processed from memory for later overlays."""
+        path = self.source_path(result_id)
+        if not path.exists():
+            tmp = path.with_suffix(f".tmp-{uuid.uuid4().hex}")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+
+    def overlay_png(
+        self,
+        result_id: str,
+        page_index: int,
+        kind: str,
+        dpi: int,
+        box: tuple[int, int, int, int] | None = None,
+    ) -> Path | None:
+        """
+        Path of the PNG overlay, rendered now if needed. `box` = (x0, y0, x1, y1)
+        in page pixels at `dpi` limits it to a tile of the page. None when the
+        result or page is unknown, ValueError for bad parameters.
+        """
+        if kind not in OVERLAY_KINDS:
+            raise ValueError(f"kind must be one of {OVERLAY_KINDS}, got {kind!r}")
+        if box is not None and (box[2] <= box[0] or box[3] <= box[1] or min(box) < 0):
+            raise ValueError("box must be x0,y0,x1,y1 with x0 < x1, y0 < y1, all >= 0")
+
+        try:
+            rdir = self.result_dir(result_id)
+        except KeyError:
+            return None
+        geom_path = page_geometry_path(rdir, page_index)
+        source = self.source_path(result_id)
+        if not geom_path.exists() or not source.exists():
+            return None
+        geom = PageGeometry.load(geom_path)
+        if not MIN_OVERLAY_DPI <= dpi <= geom.dpi:
+            raise ValueError(f"dpi must be in [{MIN_OVERLAY_DPI}, {geom.dpi}]")
+
+        name = f"{kind}_p{page_index}_d{dpi}"
+        if box is not None:
+            name += "_" + "_".join(str(v) for v in box)
+        out = rdir / "overlays" / f"{name}.png"
+        if out.exists():
+            return out
+
+        doc = open_pdf(str(source))
+        try:
+            if box is None:
+                rgb, origin = render_page(doc, dpi=dpi, page_index=page_index, pool=scratch), (0, 0)
+            else:
+                rgb, origin = render_page_region(doc, dpi, page_index, box, pool=scratch)
+        finally:
+            doc.close()
+
+        try:
+            # drawn and converted in place, the render is not needed again
+            overlay = render_overlay(rgb, geom, kind, dpi, origin, dst=rgb)
+            cv2.cvtColor(overlay, cv2.COLOR_RGB2BGR, dst=overlay)
+            ok, png = cv2.imencode(".png", overlay, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+        finally:
+            scratch.give(rgb)
+        if not ok:
+            raise RuntimeError("PNG encoding failed")
+
+        out.parent.mkdir(parents=True, exist_ok=True)
+        tmp = out.with_suffix(f".tmp-{uuid.uuid4().hex}")
+        tmp.write_bytes(png.tobytes())
+        os.replace(tmp, out)
+        return out
+
+
+def render_overlay(
+    rgb: np.ndarray,
+    geom: PageGeometry,
+    kind: str,
+    dpi: int,
+    origin: tuple[int, int] = (0, 0),
+    dst: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    Draws geometry (in page pixels at geom.dpi) over rgb, a render at `dpi`
+    placed at origin, into dst when given (dst=rgb draws in place).
+    """
+    s = dpi / geom.dpi
+    ox, oy = origin
+    if kind == "lines":
+        lines = geom.lines * s - (ox, oy, ox, oy)
+        return draw_lines_overlay(rgb, lines, line_thickness=max(1, int(round(3 * s))), dst=dst)
+
+    contour = geom.contour
+    if contour is not None:
+        contour = (np.round(contour * s) - (ox, oy)).astype(np.int32)
+    return draw_outer_contour_overlay(rgb, contour, border_thickness=max(1, int(round(6 * s))), dst=dst)
@@ -0,0 +1,437 @@
+from __future__ import annotations
+
+from dataclasses import replace
+import hashlib
+import math
+from pathlib import Path
+import shutil
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from .buffers import scratch
+from .geometry import PageGeometry, load_wall_mask, page_geometry_path, page_wall_path
+from .instrumentation import Timings
+from .pdf_render import open_pdf, page_pixel_size, parse_page_list, render_page
+from .pipeline import (
+    DPI,
+    PipelineOptions,
+    estimate_lengths_from_image,
+    inference_dpi,
+    lengths_from_geometry,
+    measure_outer_contour,
+    measure_wall_lines,
+    measure_wall_mask,
+    render_for_pipeline,
+    render_region_for_pipeline,
+    save_page_geometry,
+    vector_segments_for_pipeline,
+)
+from .units import feet_to_arch
+from .wall_lines import as_lines, dedup_overlapping_lines, merge_axis_aligned, sheet_drawing_area
+
+FINGERPRINT_DPI = 36  # pages are compared at this resolution
+TILE = 36  # fingerprint pixels per tile (one inch)
+PIXEL_TOLERANCE = 48  # gray levels a fingerprint pixel may move by (antialiasing, renderer noise)
+CONTEXT = 1.0  # inches of drawing rendered around a dirty region for the network
+MAX_DIRTY_FRACTION = 0.5  # pages with more of their tiles changed run whole
+
+LENGTHS = ("total_ft", "outer_ft", "inner_ft")
+
+
+def page_fingerprint(doc, page_index: int) -> np.ndarray:
+    """The page in gray at FINGERPRINT_DPI, what pages are compared on."""
+    return cv2.cvtColor(render_page(doc, dpi=FINGERPRINT_DPI, page_index=page_index), cv2.COLOR_RGB2GRAY)
+
+
+def dirty_tiles(prior: np.ndarray, new: np.ndarray) -> np.ndarray | None:
+    """
+    Bool grid of the TILE x TILE tiles of two fingerprints with a pixel that
+    changed by more than PIXEL_TOLERANCE; None if the pages differ in size.
+    """
+    if prior.shape != new.shape:
+        return None
+    changed = cv2.absdiff(prior, new) > PIXEL_TOLERANCE
+    h, w = changed.shape
+    gh, gw = -(-h // TILE), -(-w // TILE)
+    padded = np.zeros((gh * TILE, gw * TILE), dtype=bool)
+    padded[:h, :w] = changed
+    return padded.reshape(gh, TILE, gw, TILE).any(axis=(1, 3))
+
+
+def dirty_boxes(tiles: np.ndarray, page_size: tuple[int, int]) -> list[tuple[int, int, int, int]]:
+    """
+    The changed areas as disjoint (x0, y0, x1, y1) boxes in page pixels:
+    the bounding boxes of the 8-connected groups of dirty tiles, merged while
+    any two overlap. Changes in the sheet margins and title block, where no
+    walls are measured, are left out.
+    """
+    n, _labels, stats, _ = cv2.connectedComponentsWithStats(tiles.astype(np.uint8), connectivity=8)
+    s = TILE * DPI / FINGERPRINT_DPI
+    ax0, ay0, ax1, ay1 = sheet_drawing_area(page_size)
+    boxes = []
+    for x, y, w, h, _area in stats[1:n].tolist():
+        box = (
+            max(ax0, int(x * s)),
+            max(ay0, int(y * s)),
+            min(ax1, int(math.ceil((x + w) * s))),
+            min(ay1, int(math.ceil((y + h) * s))),
+        )
+        if box[0] < box[2] and box[1] < box[3]:
+            boxes.append(box)
+    return _merge_boxes(boxes)
+
+
+def _merge_boxes(boxes):
+    boxes = list(boxes)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    boxes[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return boxes
+
+
+def region_box(
+    box: tuple[int, int, int, int], page_size: tuple[int, int], options: PipelineOptions
+) -> tuple[tuple[int, int, int, int], PipelineOptions] | None:
+    """
+    What to render around a dirty box: the box plus CONTEXT, and the options
+    to run it with. With inference="full" the region is grown to a square
+    whose network input comes out at the full page's scale (a multiple of 64
+    network pixels), so walls are segmented as in a whole page run. None
+    when that covers the whole page.
+    """
+    pw, ph = page_size
+    c = int(CONTEXT * DPI)
+    x0, y0, x1, y1 = max(0, box[0] - c), max(0, box[1] - c), min(pw, box[2] + c), min(ph, box[3] + c)
+    if options.inference == "tiled":
+        region = (x0, y0, x1, y1)
+        return None if region == (0, 0, pw, ph) else (region, options)
+
+    unit = 64 * max(pw, ph) / options.network_size  # page pixels per 64 network pixels
+    side = math.ceil(max(x1 - x0, y1 - y0) / unit) * unit
+    if side >= max(pw, ph):
+        return None
+    w, h = min(pw, side), min(ph, side)
+    cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+    rx0 = int(min(max(0, cx - w / 2), pw - w))
+    ry0 = int(min(max(0, cy - h / 2), ph - h))
+    region = (rx0, ry0, min(pw, int(math.ceil(rx0 + w))), min(ph, int(math.ceil(ry0 + h))))
+    network_size = max(64, int(round(max(w, h) / unit)) * 64)
+    return region, replace(options, network_size=network_size)
+
+
+def _spans(x1, y1, dx, dy, boxes) -> list[tuple[float, float]]:
+    """Liang-Barsky: the sorted parameter ranges of a segment inside each box."""
+    spans = []
+    for bx0, by0, bx1, by1 in boxes:
+        t0, t1 = 0.0, 1.0
+        for p, q in ((-dx, x1 - bx0), (dx, bx1 - x1), (-dy, y1 - by0), (dy, by1 - y1)):
+            if p == 0:
+                if q < 0:
+                    t0, t1 = 1.0, 0.0
+            elif p < 0:
+                t0 = max(t0, q / p)
+            else:
+                t1 = min(t1, q / p)
+        if t0 < t1:
+            spans.append((t0, t1))
+    return sorted(spans)
+
+
+def split_lines(lines: np.ndarray, boxes) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Cuts [N,4] segments at the edges of disjoint boxes: (the pieces outside
+    every box, the pieces inside one), both [M,4].
+    """
+    outside, inside = [], []
+    for x1, y1, x2, y2 in as_lines(lines).tolist():
+        dx, dy = x2 - x1, y2 - y1
+        t = 0.0
+        for a, b in _spans(x1, y1, dx, dy, boxes):
+            if a > t:
+                outside.append((t, a, x1, y1, dx, dy))
+            inside.append((max(a, t), b, x1, y1, dx, dy))
+            t = max(t, b)
+        if t < 1.0:
+            outside.append((t, 1.0, x1, y1, dx, dy))
+
+    def pieces(spans):
+        a, b, x, y, dx, dy = np.array(spans, dtype=np.float64).reshape(-1, 6).T
+        return np.stack([x + a * dx, y + a * dy, x + b * dx, y + b * dy], axis=1)[b > a]
+
+    return pieces(outside), pieces(inside)
+
+
+def _grow(boxes, d: float):
+    return [(x0 - d, y0 - d, x1 + d, y1 + d) for x0, y0, x1, y1 in boxes]
+
+
+def merge_revised_lines(prior_lines: np.ndarray, new_lines: np.ndarray, boxes, band: float = 22) -> np.ndarray:
+    """
+    The prior lines outside the boxes plus the new ones inside them. The two
+    overlap by `band` around every box edge, so a wall on or across an edge
+    is seen from both sides; there, and for everything reaching into the
+    boxes, they're merged and deduplicated as extract_wall_lines does. The
+    prior lines away from the boxes stay as they were.
+    """
+    kept, _ = split_lines(prior_lines, _grow(boxes, -band))
+    _, fresh = split_lines(new_lines, _grow(boxes, band))
+    outer = _grow(boxes, band)
+    near = np.array([bool(_spans(x1, y1, x2 - x1, y2 - y1, outer)) for x1, y1, x2, y2 in kept.tolist()], dtype=bool)
+    joined = merge_axis_aligned(np.concatenate([kept[near], fresh]), band=band, gap=70)
+    return dedup_overlapping_lines(np.concatenate([kept[~near], joined]), band=band, overlap_gap=25)
+
+
+def revise_page(
+    doc,
+    page_index: int,
+    prior: PageGeometry,
+    boxes,
+    model: torch.nn.Module,
+    device: str,
+    options: PipelineOptions,
+    timings: Timings,
+) -> PageGeometry | None:
+    """
+    The page's geometry with only the boxes re-run: their wall mask patched
+    into the prior one (prior.wall), their lines merged with the prior lines
+    and the outline redone on the patched mask (taken from buffers.scratch,
+    as measure_page's). None when a region would cover the whole page.
+    """
+    page_size = (prior.width, prior.height)
+    regions = [region_box(b, page_size, options) for b in boxes]
+    if any(r is None for r in regions):
+        return None
+
+    # the patched mask covers the prior one and every box
+    ox, oy = prior.wall_origin
+    ph_, pw_ = prior.wall.shape
+    x0 = min([ox] + [b[0] for b in boxes])
+    y0 = min([oy] + [b[1] for b in boxes])
+    x1 = max([ox + pw_] + [b[2] for b in boxes])
+    y1 = max([oy + ph_] + [b[3] for b in boxes])
+    wall = scratch.take((y1 - y0, x1 - x0), np.uint8, fill=0)
+    try:
+        wall[oy - y0 : oy - y0 + ph_, ox - x0 : ox - x0 + pw_] = prior.wall
+
+        segments = vector_segments_for_pipeline(doc, page_index, options, timings)
+        dpi = inference_dpi(page_size, options)
+        new_lines = []
+        for box, (region, region_options) in zip(boxes, regions):
+            rgb, origin, region_size = render_region_for_pipeline(
+                doc, page_index, region, dpi, page_size, timings, pool=scratch
+            )
+            try:
+                region_wall, junction_lines = measure_wall_mask(
+                    rgb, model, device, region_options, origin, page_size, timings, region_size=region_size
+                )
+            finally:
+                scratch.give(rgb)
+            try:
+                new_lines.append(
+                    measure_wall_lines(region_wall, region_options, origin, timings, segments, junction_lines)
+                )
+                rh, rw = region_wall.shape
+                bx0, by0 = max(box[0], origin[0]), max(box[1], origin[1])
+                bx1, by1 = min(box[2], origin[0] + rw), min(box[3], origin[1] + rh)
+                wall[by0 - y0 : by1 - y0, bx0 - x0 : bx1 - x0] = region_wall[
+                    by0 - origin[1] : by1 - origin[1], bx0 - origin[0] : bx1 - origin[0]
+                ]
+            finally:
+                scratch.give(region_wall)
+
+        with timings.stage("wall_lines"):
+            lines = merge_revised_lines(prior.lines, np.concatenate(new_lines), boxes)
+        contour = measure_outer_contour(wall, (x0, y0), page_size, timings)
+    except BaseException:
+        scratch.give(wall)
+        raise
+    return PageGeometry(
+        width=prior.width,
+        height=prior.height,
+        dpi=DPI,
+        lines=lines,
+        contour=contour,
+        wall=wall,
+        wall_origin=(x0, y0),
+    )
+
+
+def _fingerprint_hash(fingerprint: np.ndarray) -> str:
+    h = hashlib.sha256(str(fingerprint.shape).encode())
+    h.update(fingerprint.tobytes())
+    return h.hexdigest()
+
+
+def _delta(result: dict, prior: dict | None) -> dict:
+    out = {}
+    for k in LENGTHS:
+        before = prior[k] if prior else 0.0
+        out[f"prior_{k}"] = before
+        out[f"delta_{k}"] = result[k] - before
+    return out
+
+
+def estimate_revision_from_pdf(
+    pdf_path: str | None,
+    model: torch.nn.Module,
+    device: str,
+    prior_pdf_path: str,
+    prior_geometry_dir: str,
+    pages: str = "all",
+    scale_inch_per_foot: str = "3/16",
+    pdf_bytes: bytes | None = None,
+    options: PipelineOptions | None = None,
+    geometry_dir: str | None = None,
+):
+    """
+    estimate_document_from_pdf for a revision of an estimated drawing set
+    (its PDF and the geometry_dir it was estimated into). Page i is compared
+    with page i of the prior set on a FINGERPRINT_DPI render: identical or
+    unchanged pages keep their prior geometry, changed ones re-run the
+    network and line extraction on the changed tiles only (revise_page) and
+    pages that are new, resized, mostly changed or have no stored wall mask
+    run whole. Every page gets a "revision" with its status ("unchanged",
+    "revised", "full" or "new"), dirty boxes and length deltas against the
+    prior page, the document a "revision" summary; pages the prior set had
+    beyond the end of this one count as removed. The prior run should have
+    used the same options.
+    """
+    t0 = time.perf_counter()
+    options = options or PipelineOptions()
+    prior_dir = Path(prior_geometry_dir)
+
+    doc = open_pdf(pdf_path, pdf_bytes)
+    prior_doc = open_pdf(prior_pdf_path)
+    try:
+        page_indices = parse_page_list(pages, len(doc))
+        page_results = []
+        for page_index in page_indices:
+            timings = Timings()
+            prior = None
+            if page_index < len(prior_doc) and page_geometry_path(prior_dir, page_index).exists():
+                prior = PageGeometry.load(page_geometry_path(prior_dir, page_index))
+            prior_lengths = lengths_from_geometry(prior, page_index, scale_inch_per_foot) if prior else None
+
+            status, boxes, fraction = "new", [], 1.0
+            if prior is not None:
+                with timings.stage("revision_diff"):
+                    new_fp = page_fingerprint(doc, page_index)
+                    prior_fp = page_fingerprint(prior_doc, page_index)
+                    page_size = page_pixel_size(doc, DPI, page_index)
+                    if page_size != (prior.width, prior.height):
+                        tiles = None
+                    elif _fingerprint_hash(new_fp) == _fingerprint_hash(prior_fp):
+                        tiles = np.zeros((1, 1), dtype=bool)
+                    else:
+                        tiles = dirty_tiles(prior_fp, new_fp)
+                if tiles is None:
+                    status = "full"
+                else:
+                    fraction = float(tiles.mean())
+                    boxes = dirty_boxes(tiles, page_size)
+                    status = "unchanged" if not boxes else "revised"
+
+            wall_path = page_wall_path(prior_dir, page_index)
+            if status == "revised" and (fraction > MAX_DIRTY_FRACTION or not wall_path.exists()):
+                status = "full"
+
+            geom = None
+            if status == "unchanged":
+                geom = prior
+                if geometry_dir:
+                    Path(geometry_dir).mkdir(parents=True, exist_ok=True)
+                    shutil.copyfile(page_geometry_path(prior_dir, page_index), page_geometry_path(geometry_dir, page_index))
+                    if wall_path.exists():
+                        shutil.copyfile(wall_path, page_wall_path(geometry_dir, page_index))
+            elif status == "revised":
+                prior.wall, prior.wall_origin = load_wall_mask(wall_path)
+                geom = revise_page(doc, page_index, prior, boxes, model, device, options, timings)
+                if geom is None:
+                    status = "full"
+                else:
+                    try:
+                        if geometry_dir:
+                            with timings.stage("geometry_store"):
+                                save_page_geometry(geom, geometry_dir, page_index)
+                    finally:
+                        scratch.give(geom.wall)
+                        geom.wall = None
+
+            if geom is not None:
+                result = lengths_from_geometry(geom, page_index, scale_inch_per_foot)
+                result["lines_overlay_path"] = None
+                result["outer_overlay_path"] = None
+                result["timings"] = timings.to_dict()
+            else:
+                page_rgb, origin, page_size, region_size = render_for_pipeline(
+                    doc, page_index, options, timings, pool=scratch
+                )
+                try:
+                    segments = vector_segments_for_pipeline(doc, page_index, options, timings)
+                    result = estimate_lengths_from_image(
+                        page_rgb,
+                        model=model,
+                        device=device,
+                        page_index=page_index,
+                        scale_inch_per_foot=scale_inch_per_foot,
+                        options=options,
+                        origin=origin,
+                        page_size=page_size,
+                        timings=timings,
+                        geometry_dir=geometry_dir,
+                        region_size=region_size,
+                        vector_segments=segments,
+                    )
+                finally:
+                    scratch.give(page_rgb)
+
+            result["revision"] = {
+                "status": status,
+                "dirty_boxes": [list(b) for b in boxes],
+                "dirty_fraction": fraction,
+                **_delta(result, prior_lengths),
+            }
+            page_results.append(result)
+
+        removed = []
+        for page_index in range(len(doc), len(prior_doc)):
+            if page_geometry_path(prior_dir, page_index).exists():
+                prior = PageGeometry.load(page_geometry_path(prior_dir, page_index))
+                removed.append(lengths_from_geometry(prior, page_index, scale_inch_per_foot))
+    finally:
+        prior_doc.close()
+        doc.close()
+
+    totals = {k: sum(r[k] for r in page_results) for k in LENGTHS}
+    revision = {}
+    for k in LENGTHS:
+        revision[f"delta_{k}"] = sum(r["revision"][f"delta_{k}"] for r in page_results) - sum(r[k] for r in removed)
+    revision["pages"] = {
+        status: sum(r["revision"]["status"] == status for r in page_results)
+        for status in ("unchanged", "revised", "full", "new")
+    }
+    revision["removed_pages"] = [r["page_index"] for r in removed]
+    return {
+        "page_count": len(page_results),
+        "scale_inch_per_foot": scale_inch_per_foot,
+        **totals,
+        "total_arch": feet_to_arch(totals["total_ft"]),
+        "outer_arch": feet_to_arch(totals["outer_ft"]),
+        "inner_arch": feet_to_arch(totals["inner_ft"]),
+        "revision": revision,
+        "pages": page_results,
+        "timings": {"total_s": time.perf_counter() - t0},
+    }
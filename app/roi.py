@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+
+from .pdf_render import page_pixel_size
+from .wall_lines import remove_sheet_margins
+
+
+def find_drawing_viewport(
+    doc: fitz.Document,
+    page_index: int,
+    dpi: int,
+    probe_dpi: int = 36,
+    ink_threshold: int = 200,
+    min_component_frac: float = 0.02,
+    pad_in: float = 1.0,
+) -> tuple[int, int, int, int] | None:
+    """
+    Finds the drawing area of a sheet from a cheap low-DPI render.
+
+    Ink outside the sheet margins and title block (the regions remove_sheet_margins
+    discards anyway) is grouped into connected components; components smaller
+    than min_component_frac of the largest one (notes, stamps, specks) are
+    ignored and the bounding box of the rest, padded by pad_in inches, is
+    returned as (x0, y0, x1, y1) in page pixels at `dpi`. None if there's no ink.
+    """
+    page = doc[page_index]
+    zoom = probe_dpi / 72.0
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+    gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+
+    ink = (gray < ink_threshold).astype(np.uint8) * 255
+    ink = remove_sheet_margins(ink, remove_left_titleblock=True)
+
+    # join strokes of the same drawing (~0.1" at probe resolution)
+    k = max(3, int(round(0.1 * probe_dpi)) | 1)
+    ink = cv2.dilate(ink, cv2.getStructuringElement(cv2.MORPH_RECT, (k, k)))
+
+    num, _lab, stats, _ = cv2.connectedComponentsWithStats((ink > 0).astype(np.uint8), connectivity=8)
+    if num <= 1:
+        return None
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    keep = stats[1:][areas >= min_component_frac * areas.max()]
+
+    x0 = keep[:, cv2.CC_STAT_LEFT].min()
+    y0 = keep[:, cv2.CC_STAT_TOP].min()
+    x1 = (keep[:, cv2.CC_STAT_LEFT] + keep[:, cv2.CC_STAT_WIDTH]).max()
+    y1 = (keep[:, cv2.CC_STAT_TOP] + keep[:, cv2.CC_STAT_HEIGHT]).max()
+
+    # probe pixels -> page pixels at dpi, padded and clipped to the page
+    s = dpi / probe_dpi
+    pad = pad_in * dpi
+    page_w, page_h = page_pixel_size(doc, dpi, page_index)
+    return (
+        max(0, int(np.floor(x0 * s - pad))),
+        max(0, int(np.floor(y0 * s - pad))),
+        min(page_w, int(np.ceil(x1 * s + pad))),
+        min(page_h, int(np.ceil(y1 * s + pad))),
+    )
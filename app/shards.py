@@ -0,0 +1,314 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from pathlib import Path
+import sys
+import time
+import uuid
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from .augment import HEATMAP_CHANNELS, BatchAugment, RandomCropOrResize
+
+SHARD_FORMAT = 1
+INDEX = "index.json"
+ALIGN = 64  # every array starts on a 64 byte boundary of its shard
+
+
+def _shard_name(i: int) -> str:
+    return f"shard_{i:05d}.bin"
+
+
+def _points_array(heatmaps: dict) -> np.ndarray:
+    """FloorplanSVG heatmap points ({channel: [(x, y), ...]}) as [N,3] int32 rows of channel, x, y."""
+    rows = [(int(ch), int(round(float(x))), int(round(float(y)))) for ch, pts in heatmaps.items() for x, y in pts]
+    return np.array(rows, dtype=np.int32).reshape(-1, 3)
+
+
+def _as_uint8(t, what: str) -> np.ndarray:
+    a = t.numpy() if isinstance(t, torch.Tensor) else np.asarray(t)
+    if a.size and (a.min() < 0 or a.max() > 255 or not np.array_equal(a, np.round(a))):
+        raise ValueError(f"{what} values must be integers in [0, 255] (untransformed samples)")
+    return np.ascontiguousarray(a, dtype=np.uint8)
+
+
+class ShardWriter:
+    """
+    Writes FloorplanSVG samples to a shard store: shard_<i>.bin files of raw
+    arrays (image uint8 [3,H,W], label uint8 [2,H,W], heatmap points int32
+    [N,3]), each aligned to ALIGN bytes, plus index.json with their offsets.
+    A shard is closed once it passes shard_bytes. index.json is written last,
+    so a store without it is incomplete.
+    """
+
+    def __init__(self, root: str, shard_bytes: int = 1 << 30):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.shard_bytes = shard_bytes
+        self.samples = []
+        self._shard = -1
+        self._file = None
+        self._pos = 0
+
+    def _write(self, a: np.ndarray) -> int:
+        pad = -self._pos % ALIGN
+        self._file.write(b"\0" * pad)
+        offset = self._pos + pad
+        self._file.write(a.tobytes())
+        self._pos = offset + a.nbytes
+        return offset
+
+    def add(self, sample: dict):
+        image = _as_uint8(sample["image"], "image")
+        label = _as_uint8(sample["label"], "label")
+        points = _points_array(sample["heatmaps"])
+        if self._file is None or self._pos >= self.shard_bytes:
+            self._next_shard()
+
+        self.samples.append(
+            {
+                "folder": str(sample.get("folder", len(self.samples))),
+                "shard": self._shard,
+                "image": self._write(image),
+                "label": self._write(label),
+                "points": self._write(points),
+                "height": image.shape[1],
+                "width": image.shape[2],
+                "label_channels": label.shape[0],
+                "point_count": len(points),
+                "scale": float(sample.get("scale", 1.0)),
+            }
+        )
+
+    def _next_shard(self):
+        if self._file is not None:
+            self._file.close()
+        self._shard += 1
+        self._file = open(self.root / _shard_name(self._shard), "wb")
+        self._pos = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        index = {"format": SHARD_FORMAT, "shards": self._shard + 1, "samples": self.samples}
+        tmp = self.root / f"{INDEX}.tmp-{uuid.uuid4().hex}"
+        tmp.write_text(json.dumps(index), encoding="utf-8")
+        os.replace(tmp, self.root / INDEX)
+
+
+class ShardDataset(Dataset):
+    """
+    Samples of a shard store. raw() returns numpy views into the memory-mapped
+    shards (nothing is read until used, no copies). Indexing returns the
+    sample FloorplanSVG would (float image and label tensors, heatmaps as
+    {channel: [(x, y)]}) with `augmentations` and `is_transform` applied the
+    same way, so it can replace FloorplanSVG in an existing training script.
+    """
+
+    def __init__(self, root: str, augmentations=None, is_transform: bool = True):
+        self.root = Path(root)
+        index = json.loads((self.root / INDEX).read_text(encoding="utf-8"))
+        if index["format"] != SHARD_FORMAT:
+            raise ValueError(f"Unsupported shard format {index['format']} in {self.root}")
+        self.samples = index["samples"]
+        self.augmentations = augmentations
+        self.is_transform = is_transform
+        self._maps = {}
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getstate__(self):
+        # DataLoader workers map the shards themselves
+        return {**self.__dict__, "_maps": {}}
+
+    def _map(self, shard: int) -> np.memmap:
+        m = self._maps.get(shard)
+        if m is None:
+            # copy-on-write: writable views for torch, the file is never changed
+            m = self._maps[shard] = np.memmap(self.root / _shard_name(shard), dtype=np.uint8, mode="c")
+        return m
+
+    def raw(self, index: int) -> dict:
+        """image uint8 [3,H,W], label uint8 [C,H,W], points int32 [N,3] (channel, x, y), scale, folder."""
+        s = self.samples[index]
+        m = self._map(s["shard"])
+        h, w = s["height"], s["width"]
+        return {
+            "image": m[s["image"] : s["image"] + 3 * h * w].reshape(3, h, w),
+            "label": m[s["label"] : s["label"] + s["label_channels"] * h * w].reshape(-1, h, w),
+            "points": m[s["points"] : s["points"] + 12 * s["point_count"]].view(np.int32).reshape(-1, 3),
+            "scale": s["scale"],
+            "folder": s["folder"],
+        }
+
+    def __getitem__(self, index: int) -> dict:
+        r = self.raw(index)
+        heatmaps = {ch: [] for ch in range(HEATMAP_CHANNELS)}
+        for ch, x, y in r["points"].tolist():
+            heatmaps[ch].append((x, y))
+        sample = {
+            "image": torch.from_numpy(r["image"]).float(),
+            "label": torch.from_numpy(r["label"]).float(),
+            "folder": r["folder"],
+            "heatmaps": heatmaps,
+            "scale": r["scale"],
+        }
+        if self.augmentations is not None:
+            sample = self.augmentations(sample)
+        if self.is_transform:
+            sample["image"] = 2 * (sample["image"] / 255.0) - 1
+        return sample
+
+
+class _Crops(Dataset):
+    """Raw samples cut to size x size in the worker, the rest happens per batch."""
+
+    def __init__(self, shards: ShardDataset, size: int):
+        self.shards = shards
+        self.crop = RandomCropOrResize(size)
+
+    def __len__(self):
+        return len(self.shards)
+
+    def __getitem__(self, index: int) -> dict:
+        return self.crop(self.shards.raw(index))
+
+
+def make_loader(
+    root: str,
+    batch_size: int = 26,
+    size: int = 256,
+    workers: int = 4,
+    prefetch_factor: int = 4,
+    shuffle: bool = True,
+    pin_memory: bool = False,
+) -> DataLoader:
+    """
+    Training batches from a shard store: {"image": [B,3,size,size] in [-1, 1],
+    "label": [B,21+C,size,size] heatmaps then segmentation}, i.e. what the
+    CubiCasa training loop gets from FloorplanSVG with crop-or-resize,
+    rotations, DictToTensor and ColorJitterTorch. Cropping runs per sample,
+    the other augmentations once per batch (augment.BatchAugment), both in the
+    worker processes, with prefetch_factor batches queued per worker.
+    """
+    kwargs = {}
+    if workers > 0:
+        kwargs.update(persistent_workers=True, prefetch_factor=prefetch_factor)
+    return DataLoader(
+        _Crops(ShardDataset(root), size),
+        batch_size=batch_size,
+        shuffle=shuffle,
+        num_workers=workers,
+        collate_fn=BatchAugment(size),
+        pin_memory=pin_memory,
+        drop_last=True,
+        **kwargs,
+    )
+
+
+def _sample(x):
+    return x
+
+
+def build(
+    data_folder: str,
+    data_file: str,
+    out_dir: str,
+    format: str = "txt",
+    original_size: bool = False,
+    lmdb_folder: str = "cubi_lmdb/",
+    workers: int = 4,
+    shard_bytes: int = 1 << 30,
+    log=sys.stderr,
+) -> int:
+    """
+    Converts a FloorplanSVG dataset (format "txt": PNG + SVG parsed with
+    House, or "lmdb": its pickled samples) into a shard store once, parsing
+    in `workers` processes. Returns the sample count.
+    """
+    from . import model_loader  # noqa: F401, puts vendor/ on sys.path
+    from floortrans.loaders.svg_loader import FloorplanSVG
+
+    data = FloorplanSVG(
+        data_folder,
+        data_file,
+        is_transform=False,
+        format=format,
+        original_size=original_size,
+        lmdb_folder=lmdb_folder,
+    )
+    loader = DataLoader(data, batch_size=None, num_workers=workers, collate_fn=_sample)
+    writer = ShardWriter(out_dir, shard_bytes=shard_bytes)
+    t0 = time.perf_counter()
+    for i, sample in enumerate(loader, start=1):
+        writer.add(sample)
+        if i % 100 == 0 or i == len(data):
+            print(f"[{i}/{len(data)}] {time.perf_counter() - t0:.1f}s", file=log)
+    writer.close()
+    return len(writer.samples)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.shards", description="Shard store of training samples")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("build", help="convert a FloorplanSVG dataset (txt or lmdb) into a shard store")
+    p.add_argument("data_folder", help="dataset root, as for FloorplanSVG (with trailing /)")
+    p.add_argument("data_file", help="list of sample folders, e.g. train.txt")
+    p.add_argument("out_dir")
+    p.add_argument("--format", choices=("txt", "lmdb"), default="txt")
+    p.add_argument("--lmdb-folder", default="cubi_lmdb/")
+    p.add_argument("--original-size", action="store_true")
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    p.add_argument("--shard-mb", type=float, default=1024)
+
+    p = sub.add_parser("bench", help="time the training loader on a shard store")
+    p.add_argument("out_dir")
+    p.add_argument("--batch-size", type=int, default=26)
+    p.add_argument("--size", type=int, default=256)
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    p.add_argument("--batches", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        n = build(
+            args.data_folder,
+            args.data_file,
+            args.out_dir,
+            format=args.format,
+            original_size=args.original_size,
+            lmdb_folder=args.lmdb_folder,
+            workers=args.workers,
+            shard_bytes=int(args.shard_mb * 1024 * 1024),
+        )
+        print(json.dumps({"samples": n, "out_dir": args.out_dir}))
+        return
+
+    loader = make_loader(args.out_dir, batch_size=args.batch_size, size=args.size, workers=args.workers)
+    batches = iter(loader)
+    t0 = time.perf_counter()
+    next(batches)  # includes worker start-up
+    first_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    n = 0
+    for n, _batch in zip(range(1, args.batches + 1), batches):
+        pass
+    elapsed = time.perf_counter() - t0
+    print(
+        json.dumps(
+            {
+                "first_batch_s": first_s,
+                "batches": n,
+                "samples_per_s": n * args.batch_size / elapsed if elapsed > 0 else 0.0,
+            }
+        )
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+
+from .pipeline import DPI
+
+SHEETS = {"12x8": (12.0, 8.0), "24x18": (24.0, 18.0), "36x24": (36.0, 24.0), "48x36": (48.0, 36.0)}
+DENSITIES = {"sparse": (3, 2), "dense": (12, 8)}  # rooms across, down
+
+
+@dataclass(frozen=True)
+class PlanSpec:
+    """A synthetic floor plan: sheet size in inches, a grid of rooms, wall thickness on paper."""
+
+    sheet_in: tuple[float, float]
+    rooms: tuple[int, int]
+    wall_in: float = 0.125
+    seed: int = 0
+
+    @property
+    def name(self) -> str:
+        w, h = self.sheet_in
+        return f"{w:g}x{h:g}in_{self.rooms[0]}x{self.rooms[1]}rooms"
+
+
+def wall_rects(spec: PlanSpec) -> list[tuple[float, float, float, float]]:
+    """Wall rectangles (x0, y0, x1, y1) in points: a grid of rooms with doors and some open partitions."""
+    rng = np.random.default_rng(spec.seed)
+    W, H = spec.sheet_in[0] * 72, spec.sheet_in[1] * 72
+    # inside the margins and left title block that remove_sheet_margins clears
+    x0, x1, y0, y1 = 0.22 * W, 0.9 * W, 0.12 * H, 0.88 * H
+    nx, ny = spec.rooms
+    cw, ch = (x1 - x0) / nx, (y1 - y0) / ny
+    t = spec.wall_in * 72
+    door = min(0.25 * 72, 0.4 * min(cw, ch))
+
+    def pieces(a, b, outer):
+        if not outer and rng.random() < 0.15:
+            return []
+        if rng.random() < (0.1 if outer else 0.7):
+            g = rng.uniform(a + t, b - t - door)
+            return [(a, g), (g + door, b)]
+        return [(a, b)]
+
+    rects = []
+    for j in range(ny + 1):
+        y = y0 + j * ch
+        for i in range(nx):
+            for a, b in pieces(x0 + i * cw, x0 + (i + 1) * cw, j in (0, ny)):
+                rects.append((a - t / 2, y - t / 2, b + t / 2, y + t / 2))
+    for i in range(nx + 1):
+        x = x0 + i * cw
+        for j in range(ny):
+            for a, b in pieces(y0 + j * ch, y0 + (j + 1) * ch, i in (0, nx)):
+                rects.append((x - t / 2, a - t / 2, x + t / 2, b + t / 2))
+    return rects
+
+
+def synthetic_plan(spec: PlanSpec, dpi: int = DPI) -> tuple[bytes, np.ndarray]:
+    """
+    PDF of a synthetic plan (filled walls, room labels, a dimension line and a
+    title block, like a CAD export) and its exact wall mask (0/255) at `dpi`.
+    """
+    W, H = spec.sheet_in[0] * 72, spec.sheet_in[1] * 72
+    rects = wall_rects(spec)
+
+    doc = fitz.open()
+    page = doc.new_page(width=W, height=H)
+    shape = page.new_shape()
+    for r in rects:
+        shape.draw_rect(fitz.Rect(*r))
+    shape.finish(fill=(0, 0, 0), color=None)
+    shape.draw_rect(fitz.Rect(0.03 * W, 0.05 * H, 0.16 * W, 0.95 * H))
+    shape.draw_line((0.22 * W, 0.93 * H), (0.9 * W, 0.93 * H))
+    shape.finish(width=0.5, color=(0, 0, 0))
+    shape.commit()
+    nx, ny = spec.rooms
+    for j in range(ny):
+        for i in range(nx):
+            x = 0.22 * W + (i + 0.3) * (0.68 * W / nx)
+            y = 0.12 * H + (j + 0.5) * (0.76 * H / ny)
+            page.insert_text((x, y), f"ROOM {j * nx + i + 1}", fontsize=6)
+    page.insert_text((0.04 * W, 0.9 * H), "SHEET A1", fontsize=14)
+    pdf = doc.tobytes()
+    doc.close()
+
+    s = dpi / 72.0
+    mask = np.zeros((int(round(H * s)), int(round(W * s))), dtype=np.uint8)
+    for x0, y0, x1, y1 in rects:
+        cv2.rectangle(mask, (int(x0 * s), int(y0 * s)), (int(np.ceil(x1 * s)) - 1, int(np.ceil(y1 * s)) - 1), 255, -1)
+    return pdf, mask
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import numpy as np
+import torch
+
+from .preprocess import pick_seg_tensor
+
+
+def tile_starts(length: int, tile: int, overlap: int) -> list[int]:
+    """Start offsets of tiles covering [0, length), the last one flush with the end."""
+    if length <= tile:
+        return [0]
+    stride = max(1, tile - overlap)
+    starts = list(range(0, length - tile, stride))
+    starts.append(length - tile)
+    return starts
+
+
+def _ramp(tile: int, overlap: int) -> np.ndarray:
+    """1D blending weights: linear ramps over the overlap, flat in the middle, never zero."""
+    i = np.arange(tile, dtype=np.float32)
+    r = float(overlap + 1)
+    return np.minimum(1.0, np.minimum((i + 1) / r, (tile - i) / r))
+
+
+def wall_margin_from_logits(seg: torch.Tensor, wall_label: int) -> torch.Tensor:
+    """
+    [B,C,H,W] -> [B,H,W] wall logit minus the best competing channel.
+
+    margin > 0 exactly where argmax over channels picks wall_label (up to ties).
+    A single-channel seg is taken to be that margin already (see wall_head.py).
+    """
+    if seg.shape[1] == 1:
+        return seg[:, 0]
+    others = seg.clone()
+    others[:, wall_label] = float("-inf")
+    return seg[:, wall_label] - others.amax(dim=1)
+
+
+def predict_wall_margin_tiled(
+    model,
+    rgb: np.ndarray,
+    device: str,
+    wall_label: int,
+    tile_size: int = 1024,
+    overlap: int = 128,
+    batch_size: int = 4,
+    memory_bytes: int = 1 << 30,
+) -> np.ndarray:
+    """
+    Runs the model on overlapping tiles of `rgb` and stitches a wall margin map.
+
+    tile_size should be a multiple of 64 (the hourglass downsamples 64x).
+    Returns float32 [H,W] (same size as rgb) with wall_margin_from_logits values
+    blended across tile overlaps. Only the single-channel margin of each tile is
+    kept, so besides the tiles in flight the memory cost is one float32 map;
+    tiles are sent through the model in batches sized to stay under memory_bytes.
+    """
+    h0, w0 = rgb.shape[:2]
+    if h0 < tile_size or w0 < tile_size:
+        # small pages are zero padded (as in preprocess_image_rgb) so every tile
+        # has the size the network was set up for
+        padded = np.zeros((max(h0, tile_size), max(w0, tile_size), 3), np.uint8)
+        padded[:h0, :w0] = rgb
+        rgb = padded
+    h, w = rgb.shape[:2]
+    th = tw = tile_size
+    ys = tile_starts(h, th, overlap)
+    xs = tile_starts(w, tw, overlap)
+
+    # the window is separable and tiles form a grid, so the blending weights
+    # sum to a product of two 1D sums
+    wy, wx = _ramp(th, overlap), _ramp(tw, overlap)
+    norm_y = np.zeros(h, np.float32)
+    norm_x = np.zeros(w, np.float32)
+    for y0 in ys:
+        norm_y[y0:y0 + th] += wy
+    for x0 in xs:
+        norm_x[x0:x0 + tw] += wx
+    window = np.outer(wy, wx)
+
+    # the logits of a tile (all channels, float32, plus the copy taken for the
+    # margin) dominate peak memory; assume a CubiCasa-sized head of ~64 channels
+    per_tile_bytes = (3 + 2 * 64) * th * tw * 4
+    batch_size = max(1, min(batch_size, memory_bytes // per_tile_bytes))
+
+    acc = np.zeros((h, w), np.float32)
+    positions = [(y0, x0) for y0 in ys for x0 in xs]
+    for b in range(0, len(positions), batch_size):
+        chunk = positions[b:b + batch_size]
+        tiles = np.stack([rgb[y0:y0 + th, x0:x0 + tw] for y0, x0 in chunk])
+        x = torch.from_numpy(tiles).to(device).permute(0, 3, 1, 2).float() / 255.0
+
+        with torch.no_grad():
+            seg = pick_seg_tensor(model(x))
+            margin = wall_margin_from_logits(seg, wall_label).cpu().numpy()
+        del seg, x
+
+        for (y0, x0), m in zip(chunk, margin):
+            acc[y0:y0 + th, x0:x0 + tw] += m * window
+
+    acc /= norm_y[:, None]
+    acc /= norm_x[None, :]
+    return acc[:h0, :w0]
@@ -2,12 +2,23 @@ from __future__ import annotations
 import math
 
 
+class InvalidRequestError(ValueError):
+    """A page selection or scale the caller got wrong (the API answers 400)."""
+
+
 def parse_inches_per_foot(s: str) -> float:
-    s = s.strip().lower().replace('"', "")
-    if "/" in s:
-        a, b = s.split("/", 1)
-        return float(a) / float(b)
-    return float(s)
+    t = s.strip().lower().replace('"', "")
+    try:
+        if "/" in t:
+            a, b = t.split("/", 1)
+            value = float(a) / float(b)
+        else:
+            value = float(t)
+    except (ValueError, ZeroDivisionError):
+        value = float("nan")
+    if not value > 0 or math.isinf(value):
+        raise InvalidRequestError(f"Invalid scale {s!r}, expected inches per foot like 3/16 or 0.25")
+    return value
 
 
 def feet_per_pixel_from_scale(dpi: int, inches_per_foot: float) -> float:
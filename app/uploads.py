@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+import hashlib
+from pathlib import Path
+
+import anyio
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import Request
+
+PDF_MAGIC = b"%PDF-"
+MAGIC_SEARCH_BYTES = 1024  # the PDF header may follow some leading garbage
+MAX_FIELD_BYTES = 64 * 1024  # form fields other than the PDF are short strings
+WRITE_BYTES = 1 << 20  # file data is written in pieces of about this size
+
+
+class UploadRejected(ValueError):
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass
+class SpooledPdf:
+    """An uploaded PDF, either kept in memory (`data`) or spooled to `path`."""
+
+    sha256: str
+    size: int
+    data: bytes | None = None
+    path: Path | None = None
+
+    def source_kwargs(self) -> dict:
+        if self.data is not None:
+            return {"pdf_path": None, "pdf_bytes": self.data}
+        return {"pdf_path": str(self.path)}
+
+    def discard(self):
+        if self.path is not None:
+            self.path.unlink(missing_ok=True)
+
+
+@dataclass
+class PdfForm:
+    """A multipart form with one PDF file part (see receive_pdf_form)."""
+
+    pdf: SpooledPdf
+    filename: str
+    fields: dict[str, str] = field(default_factory=dict)
+
+
+class _PdfSink:
+    """
+    The PDF's bytes: hashed and size checked as they arrive, kept in memory up
+    to memory_bytes, then streamed to dest (in a worker thread, off the event loop).
+    """
+
+    def __init__(self, dest: Path, max_bytes: int, memory_bytes: int):
+        self.dest = dest
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.buf = bytearray()
+        self.checked = False
+        self.file = None
+
+    def add(self, chunk: bytes):
+        """Takes a piece of the part (called from the parser, nothing is written yet)."""
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadRejected(f"PDF exceeds the {self.max_bytes / (1024 * 1024):g} MB upload limit", status_code=413)
+        self.hash.update(chunk)
+        self.buf += chunk
+        if not self.checked and len(self.buf) >= MAGIC_SEARCH_BYTES:
+            _check_magic(self.buf)
+            self.checked = True
+
+    async def flush(self, final: bool = False):
+        """Writes what add() took once there is enough of it or more than fits in memory."""
+        if self.file is None:
+            if len(self.buf) <= self.memory_bytes:
+                return
+        elif not final and len(self.buf) < WRITE_BYTES:
+            return
+        if not self.checked:
+            _check_magic(self.buf)
+            self.checked = True
+        if self.file is None:
+            self.file = await anyio.to_thread.run_sync(open, self.dest, "wb")
+        data, self.buf = bytes(self.buf), bytearray()
+        await anyio.to_thread.run_sync(self.file.write, data)
+
+    async def finish(self) -> SpooledPdf:
+        await self.flush(final=True)
+        if not self.checked:
+            _check_magic(self.buf)
+        if self.file is None:
+            return SpooledPdf(sha256=self.hash.hexdigest(), size=self.size, data=bytes(self.buf))
+        await anyio.to_thread.run_sync(self.file.close)
+        self.file = None
+        return SpooledPdf(sha256=self.hash.hexdigest(), size=self.size, path=self.dest)
+
+    async def discard(self):
+        if self.file is not None:
+            await anyio.to_thread.run_sync(self.file.close)
+            self.file = None
+        self.dest.unlink(missing_ok=True)
+
+
+async def receive_pdf_form(
+    request: Request,
+    dest: Path,
+    max_bytes: int,
+    memory_bytes: int,
+    file_field: str = "pdf",
+) -> PdfForm:
+    """
+    Reads a multipart/form-data body straight from the request stream: the
+    file_field part is hashed on the way and kept in memory up to
+    memory_bytes (PyMuPDF opens it from the buffer), larger ones are streamed
+    once to `dest`; the other parts are returned as strings.
+
+    Raises UploadRejected when the body is not such a form, the file is not
+    a .pdf or doesn't start like a PDF, or exceeds max_bytes (413, checked
+    against Content-Length before anything is read, then while streaming).
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadRejected("Expected a multipart/form-data upload")
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > max_bytes + MAX_FIELD_BYTES:
+        raise UploadRejected(f"PDF exceeds the {max_bytes / (1024 * 1024):g} MB upload limit", status_code=413)
+
+    sink = _PdfSink(dest, max_bytes, memory_bytes)
+    fields: dict[str, str] = {}
+    filename = None
+    part = {}  # the part being parsed: headers, then "name" and "data" (None for the PDF)
+    header = [b"", b""]
+    ended = []  # the closing boundary was seen
+
+    def on_part_begin():
+        part.clear()
+        part["headers"] = {}
+
+    def on_header_field(data, start, end):
+        header[0] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header[1] += data[start:end]
+
+    def on_header_end():
+        part["headers"][header[0].lower()] = header[1]
+        header[0], header[1] = b"", b""
+
+    def on_headers_finished():
+        nonlocal filename
+        _disposition, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        part["name"] = name
+        part["data"] = bytearray()
+        if name == file_field:
+            if filename is not None:
+                raise UploadRejected(f"More than one {file_field} file")
+            filename = options.get(b"filename", b"").decode("utf-8", "replace")
+            if not filename.lower().endswith(".pdf"):
+                raise UploadRejected("Only PDF files are supported")
+            part["data"] = None
+
+    def on_part_data(data, start, end):
+        if part["data"] is None:
+            sink.add(data[start:end])
+            return
+        part["data"] += data[start:end]
+        if len(part["data"]) > MAX_FIELD_BYTES:
+            raise UploadRejected(f"Form field {part['name']!r} is too long")
+
+    def on_part_end():
+        if part["data"] is not None:
+            fields[part["name"]] = part["data"].decode("utf-8", "replace")
+
+    def on_end():
+        ended.append(True)
+
+    parser = MultipartParser(
+        params[b"boundary"],
+        {
+            "on_part_begin": on_part_begin,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_end": on_end,
+        },
+    )
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            await sink.flush()
+        parser.finalize()
+        if not ended:
+            raise UploadRejected("Incomplete form data")
+        if filename is None:
+            raise UploadRejected(f"Missing {file_field} file")
+        pdf = await sink.finish()
+    except MultipartParseError as e:
+        await sink.discard()
+        raise UploadRejected(f"Malformed form data: {e}") from e
+    except BaseException:
+        await sink.discard()
+        raise
+    return PdfForm(pdf=pdf, filename=filename, fields=fields)
+
+
+def _check_magic(head: bytes):
+    if PDF_MAGIC not in head[:MAGIC_SEARCH_BYTES]:
+        raise UploadRejected("Uploaded file is not a PDF")
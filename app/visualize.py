@@ -7,32 +7,53 @@ import numpy as np
 from PIL import Image
 
 
-def save_lines_overlay(
+def draw_lines_overlay(
     page_rgb: np.ndarray,
-    lines: list,
-    out_path: str,
+    lines,
     pdf_alpha: float = 0.45,
     line_thickness: int = 3,
-):
-    """
-    Draws detected lines on the page and saves as PNG (or PDF if you pass .pdf).
-    """
-    base = (page_rgb.astype(np.float32) * pdf_alpha).astype(np.uint8)
-    overlay = base.copy()
+    dst: np.ndarray | None = None,
+) -> np.ndarray:
+    """Dimmed copy of the page with the lines drawn on it (RGB), in dst when given."""
+    overlay = cv2.convertScaleAbs(page_rgb, dst=dst, alpha=pdf_alpha)
 
     for l in lines:
         x1, y1, x2, y2 = map(float, l)
         X1, Y1, X2, Y2 = int(round(x1)), int(round(y1)), int(round(x2)), int(round(y2))
         cv2.line(overlay, (X1, Y1), (X2, Y2), (255, 0, 0), line_thickness)
+    return overlay
 
-    out_path = str(out_path)
-    Path(os.path.dirname(out_path) or ".").mkdir(parents=True, exist_ok=True)
 
-    if out_path.lower().endswith(".pdf"):
-        Image.fromarray(overlay).save(out_path, "PDF")
-    else:
-        Image.fromarray(overlay).save(out_path)
-    return out_path
+def draw_outer_contour_overlay(
+    page_rgb: np.ndarray,
+    contour,
+    pdf_alpha: float = 0.45,
+    border_thickness: int = 6,
+    dst: np.ndarray | None = None,
+) -> np.ndarray:
+    """Dimmed copy of the page with the outer contour drawn on it (RGB), in dst when given."""
+    overlay = cv2.convertScaleAbs(page_rgb, dst=dst, alpha=pdf_alpha)
+
+    if contour is not None:
+        # (0, 255, 255) in BGR
+        cv2.drawContours(overlay, [contour], -1, (255, 255, 0), border_thickness)
+    return overlay
+
+
+def save_lines_overlay(
+    page_rgb: np.ndarray,
+    lines: list,
+    out_path: str,
+    pdf_alpha: float = 0.45,
+    line_thickness: int = 3,
+    dst: np.ndarray | None = None,
+):
+    """
+    Draws detected lines on the page and saves as PNG (or PDF if you pass .pdf).
+    dst (page_rgb's shape) is used for the drawing when given.
+    """
+    overlay = draw_lines_overlay(page_rgb, lines, pdf_alpha=pdf_alpha, line_thickness=line_thickness, dst=dst)
+    return _save(overlay, out_path)
 
 
 def save_outer_contour_overlay(
@@ -41,18 +62,19 @@ def save_outer_contour_overlay(
     out_path: str,
     pdf_alpha: float = 0.45,
     border_thickness: int = 6,
+    dst: np.ndarray | None = None,
 ):
     """
     Draws the outer contour on the page and saves as PNG (or PDF).
+    dst (page_rgb's shape) is used for the drawing when given.
     """
-    base = (page_rgb.astype(np.float32) * pdf_alpha).astype(np.uint8)
-    overlay = base.copy()
+    overlay = draw_outer_contour_overlay(
+        page_rgb, contour, pdf_alpha=pdf_alpha, border_thickness=border_thickness, dst=dst
+    )
+    return _save(overlay, out_path)
 
-    if contour is not None:
-        overlay_bgr = cv2.cvtColor(overlay, cv2.COLOR_RGB2BGR)
-        cv2.drawContours(overlay_bgr, [contour], -1, (0, 255, 255), border_thickness)
-        overlay = cv2.cvtColor(overlay_bgr, cv2.COLOR_BGR2RGB)
 
+def _save(overlay: np.ndarray, out_path: str) -> str:
     out_path = str(out_path)
     Path(os.path.dirname(out_path) or ".").mkdir(parents=True, exist_ok=True)
 
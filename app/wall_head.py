@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import torch
+import torch.nn.functional as F
+
+# CubiCasa output layout: junction heatmaps (sigmoid), room classes, icon classes
+HEATMAP_CHANNELS = 21
+ROOM_CLASSES = 12
+
+# full        every channel at full resolution, argmax in the pipeline (default)
+# wall        only the wall margin against all other channels, same decision as full
+# wall-rooms  only the wall margin against the room classes (heatmaps and icons ignored)
+HEADS = ("full", "wall", "wall-rooms")
+
+
+class WallHead(torch.nn.Module):
+    """
+    hg_furukawa_original with a head that returns only the wall margin,
+    [B,1,H,W] = wall logit minus the best competing channel (> 0 where the
+    wall class wins), instead of all channels.
+
+    The 4x transposed-conv upsample of the head doesn't overlap, so each
+    output channel can be produced on its own: the low-res logits are
+    computed for all classes (cheap), but only the wall plane and the
+    competitors are upsampled, `chunk` planes at a time with a running max.
+    Sigmoid is monotonic, so the heatmap competitors need one sigmoid of
+    their max instead of one per channel.
+    """
+
+    def __init__(self, model: torch.nn.Module, wall_label: int, competitors: str = "all", chunk: int = 8):
+        super().__init__()
+        n_classes = model.conv4_.out_channels
+        if competitors == "all":
+            others = [c for c in range(n_classes) if c != wall_label]
+        elif competitors == "rooms":
+            others = [c for c in range(HEATMAP_CHANNELS, HEATMAP_CHANNELS + ROOM_CLASSES) if c != wall_label]
+        else:
+            raise ValueError(f"competitors must be 'all' or 'rooms', got {competitors!r}")
+
+        self.model = model
+        self.wall_label = wall_label
+        self.heat = [c for c in others if c < HEATMAP_CHANNELS]
+        self.logits = [c for c in others if c >= HEATMAP_CHANNELS]
+        self.chunk = max(1, chunk)
+
+    def _planes_max(self, low: torch.Tensor, channels: list[int]) -> torch.Tensor:
+        up = self.model.upsample
+        best = None
+        for i in range(0, len(channels), self.chunk):
+            idx = channels[i:i + self.chunk]
+            planes = F.conv_transpose2d(low, up.weight[:, idx], up.bias[idx], stride=up.stride)
+            m = planes.amax(dim=1, keepdim=True)
+            best = m if best is None else torch.maximum(best, m)
+        return best
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        low = self.model.conv4_(self.model.forward_features(x))
+        wall = self._planes_max(low, [self.wall_label])
+
+        best = None
+        if self.logits:
+            best = self._planes_max(low, self.logits)
+        if self.heat:
+            heat = torch.sigmoid(self._planes_max(low, self.heat))
+            best = heat if best is None else torch.maximum(best, heat)
+        return wall - best
+
+
+def wall_head(model: torch.nn.Module, head: str, wall_label: int) -> torch.nn.Module:
+    """Wraps a loaded hg_furukawa_original for `head` (see HEADS)."""
+    if head == "full":
+        return model
+    if head == "wall":
+        return WallHead(model, wall_label, competitors="all").eval()
+    if head == "wall-rooms":
+        return WallHead(model, wall_label, competitors="rooms").eval()
+    raise ValueError(f"head must be one of {HEADS}, got {head!r}")
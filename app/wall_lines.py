@@ -1,37 +1,97 @@
 from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor
 import math
+import os
 import cv2
 import numpy as np
 from skimage.morphology import skeletonize
 
+from .buffers import scratch
+
 
 def wall_mask_from_pred(pred_small: np.ndarray, wall_label: int, out_w: int, out_h: int) -> np.ndarray:
-    wall_small = ((pred_small == wall_label).astype(np.uint8) * 255)
-    wall = cv2.resize(wall_small, (out_w, out_h), interpolation=cv2.INTER_NEAREST)
+    return wall_mask_from_small(pred_small == wall_label, out_w, out_h)
+
+
+def wall_mask_from_small(wall_small: np.ndarray, out_w: int, out_h: int, dst: np.ndarray | None = None) -> np.ndarray:
+    """
+    Page-size wall mask from a boolean wall map at model resolution, written
+    into dst (uint8 [out_h,out_w]) when given.
+    """
+    wall_small = wall_small.astype(np.uint8) * 255
+    wall = cv2.resize(wall_small, (out_w, out_h), dst=dst, interpolation=cv2.INTER_NEAREST)
+    return clean_wall_mask(wall, dst=wall)
+
+
+def wall_mask_from_margin(margin: np.ndarray, out_w: int, out_h: int, dst: np.ndarray | None = None) -> np.ndarray:
+    """
+    Wall mask from a wall-vs-rest logit margin map (see tiling.wall_margin_from_logits),
+    written into dst (uint8 [out_h,out_w]) when given.
+
+    The margin is upsampled bilinearly before thresholding, which keeps thin
+    walls that a nearest-neighbour upsample of the label map would break up.
+    It is quantized to int16 first so the page-size intermediate stays small.
+    """
+    q = np.clip(margin * 256.0, -32767, 32767).astype(np.int16)
+    if q.shape[:2] == (out_h, out_w):
+        wall = cv2.compare(q, 0, cv2.CMP_GT, dst=dst)
+    else:
+        with scratch.borrow((out_h, out_w), np.int16) as up:
+            cv2.resize(q, (out_w, out_h), dst=up, interpolation=cv2.INTER_LINEAR)
+            wall = cv2.compare(up, 0, cv2.CMP_GT, dst=dst)
+    return clean_wall_mask(wall, dst=wall)
+
 
-    wall = cv2.medianBlur(wall, 3)
+def clean_wall_mask(wall: np.ndarray, dst: np.ndarray | None = None) -> np.ndarray:
+    """Median, close and dilate of a wall mask, into dst when given (dst=wall works in place)."""
+    wall = cv2.medianBlur(wall, 3, dst=dst)
     k_close = cv2.getStructuringElement(cv2.MORPH_RECT, (9, 9))
-    wall = cv2.morphologyEx(wall, cv2.MORPH_CLOSE, k_close, iterations=2)
+    cv2.morphologyEx(wall, cv2.MORPH_CLOSE, k_close, dst=wall, iterations=2)
     k_dil = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
-    wall = cv2.dilate(wall, k_dil, iterations=1)
+    cv2.dilate(wall, k_dil, dst=wall, iterations=1)
     return wall
 
 
-def remove_sheet_margins(wall: np.ndarray, remove_left_titleblock: bool = True) -> np.ndarray:
+def remove_sheet_margins(
+    wall: np.ndarray,
+    remove_left_titleblock: bool = True,
+    origin: tuple[int, int] = (0, 0),
+    page_size: tuple[int, int] | None = None,
+    dst: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    Zeroes the sheet margins (and the left title block) of a page mask, in a
+    copy or in dst (dst=wall clears them in place).
+
+    For a crop of the page pass its (x, y) origin and the full page (w, h):
+    margins are measured on the page and cleared where they overlap the crop.
+    """
     h, w = wall.shape[:2]
-    mx = int(0.06 * w)
-    my = int(0.06 * h)
-    wall2 = wall.copy()
-    wall2[:my, :] = 0
-    wall2[-my:, :] = 0
-    wall2[:, :mx] = 0
-    wall2[:, -mx:] = 0
-    if remove_left_titleblock:
-        wall2[:, :int(0.18 * w)] = 0
+    ox, oy = origin
+    x0, y0, x1, y1 = sheet_drawing_area(page_size or (w, h), remove_left_titleblock)
+    if dst is None:
+        wall2 = wall.copy()
+    else:
+        wall2 = dst
+        if dst is not wall:
+            np.copyto(dst, wall)
+    wall2[:max(0, y0 - oy), :] = 0
+    wall2[max(0, y1 - oy):, :] = 0
+    wall2[:, :max(0, x0 - ox)] = 0
+    wall2[:, max(0, x1 - ox):] = 0
     return wall2
 
 
+def sheet_drawing_area(page_size: tuple[int, int], remove_left_titleblock: bool = True) -> tuple[int, int, int, int]:
+    """(x0, y0, x1, y1) of the page that remove_sheet_margins keeps."""
+    pw, ph = page_size
+    mx = int(0.06 * pw)
+    my = int(0.06 * ph)
+    left = int(0.18 * pw) if remove_left_titleblock else mx
+    return max(mx, left), my, pw - mx, ph - my
+
+
 def snap_hv(line, angle_tol=20):
     x1, y1, x2, y2 = map(float, line)
     ang = abs(math.degrees(math.atan2(y2 - y1, x2 - x1))) % 180
@@ -47,6 +107,30 @@ def snap_hv(line, angle_tol=20):
     return None
 
 
+def as_lines(lines_in) -> np.ndarray:
+    """Any sequence of [x1, y1, x2, y2] -> float64 array [N,4]."""
+    return np.asarray(lines_in, dtype=np.float64).reshape(-1, 4)
+
+
+def snap_hv_lines(lines_in, angle_tol=20) -> np.ndarray:
+    """Array version of snap_hv; lines that are neither near-horizontal nor near-vertical are dropped."""
+    L = as_lines(lines_in)
+    x1, y1, x2, y2 = L.T
+    ang = np.abs(np.degrees(np.arctan2(y2 - y1, x2 - x1))) % 180
+
+    h = np.minimum(ang, 180 - ang) < angle_tol
+    v = ~h & (np.abs(ang - 90) < angle_tol)
+
+    out = L.copy()
+    ym = (y1 + y2) / 2
+    xm = (x1 + x2) / 2
+    out[h, 1] = ym[h]
+    out[h, 3] = ym[h]
+    out[v, 0] = xm[v]
+    out[v, 2] = xm[v]
+    return out[h | v]
+
+
 def normalize_line(l):
     x1, y1, x2, y2 = map(float, l)
     if abs(y2 - y1) < abs(x2 - x1):
@@ -60,185 +144,442 @@ def normalize_line(l):
     return [x1, y1, x2, y2]
 
 
-def is_horizontal(l, tol=2.5):
-    x1, y1, x2, y2 = l
-    return abs(y2 - y1) <= tol and abs(x2 - x1) > 20
-
+def normalize_lines(lines_in) -> np.ndarray:
+    """Array version of normalize_line."""
+    L = as_lines(lines_in).copy()
+    dx = np.abs(L[:, 2] - L[:, 0])
+    dy = np.abs(L[:, 3] - L[:, 1])
+    swap = np.where(dy < dx, L[:, 2] < L[:, 0], L[:, 3] < L[:, 1])
+    L[swap] = L[swap][:, [2, 3, 0, 1]]
+    return L
 
-def is_vertical(l, tol=2.5):
-    x1, y1, x2, y2 = l
-    return abs(x2 - x1) <= tol and abs(y2 - y1) > 20
-
-
-def merge_1d_intervals(items, gap=70):
-    if not items:
-        return []
-    items = sorted(items, key=lambda t: t[1])
-    out = []
-    fc, a, b = items[0]
-    for fc2, a2, b2 in items[1:]:
-        if a2 <= b + gap:
-            b = max(b, b2)
-            fc = (fc + fc2) / 2.0
-        else:
-            out.append((fc, a, b))
-            fc, a, b = fc2, a2, b2
-    out.append((fc, a, b))
-    return out
 
+def is_horizontal(l, tol=2.5):
+    """Works on one line or on an [N,4] array (returns a mask)."""
+    l = np.asarray(l, dtype=np.float64)
+    return (np.abs(l[..., 3] - l[..., 1]) <= tol) & (np.abs(l[..., 2] - l[..., 0]) > 20)
 
-def merge_axis_aligned(lines_in, band=22, gap=70):
-    lines_in = [normalize_line(l) for l in lines_in]
-    hs = [l for l in lines_in if is_horizontal(l)]
-    vs = [l for l in lines_in if is_vertical(l)]
-
-    merged = []
 
-    hs = sorted(hs, key=lambda l: l[1])
-    used = [False] * len(hs)
-    for i in range(len(hs)):
-        if used[i]:
-            continue
-        y_ref = hs[i][1]
-        cluster = []
-        for j in range(i, len(hs)):
-            if used[j]:
-                continue
-            if abs(hs[j][1] - y_ref) <= band:
-                x1, y1, x2, y2 = hs[j]
-                cluster.append((y1, min(x1, x2), max(x1, x2)))
-                used[j] = True
-        for y, x1, x2 in merge_1d_intervals(cluster, gap=gap):
-            merged.append([x1, y, x2, y])
-
-    vs = sorted(vs, key=lambda l: l[0])
-    used = [False] * len(vs)
-    for i in range(len(vs)):
+def is_vertical(l, tol=2.5):
+    """Works on one line or on an [N,4] array (returns a mask)."""
+    l = np.asarray(l, dtype=np.float64)
+    return (np.abs(l[..., 2] - l[..., 0]) <= tol) & (np.abs(l[..., 3] - l[..., 1]) > 20)
+
+
+def _merge_band_intervals(coord, lo, hi, band, gap):
+    """
+    Greedy band clustering followed by 1D interval merging, vectorized.
+
+    Lines are taken in order of `coord` (stable); a cluster is every line
+    within `band` of the first unclustered one. Within a cluster intervals are
+    sorted by start and merged while the next start is within `gap` of the
+    running end; the merged coordinate is the running pairwise average of the
+    members, in that order. Returns (coord, lo, hi) arrays of merged intervals.
+    """
+    order = np.argsort(coord, kind="stable")
+    coord, lo, hi = coord[order], lo[order], hi[order]
+    n = len(coord)
+
+    out_c, out_a, out_b = [], [], []
+    i = 0
+    while i < n:
+        ref = coord[i]
+        # coords are sorted, so the cluster is a prefix of the window
+        k = int(np.searchsorted(coord, ref + band + 1.0, side="right"))
+        k = i + int(np.count_nonzero(coord[i:k] - ref <= band))
+
+        c_order = np.argsort(lo[i:k], kind="stable")
+        c, a, b = coord[i:k][c_order], lo[i:k][c_order], hi[i:k][c_order]
+
+        run_b = np.maximum.accumulate(b)
+        starts = np.flatnonzero(np.r_[True, a[1:] > run_b[:-1] + gap])
+        ends = np.r_[starts[1:], len(a)]
+        for s0, e0 in zip(starts, ends):
+            fc = float(c[s0])
+            for v in c[s0 + 1:e0]:
+                fc = (fc + float(v)) / 2.0
+            out_c.append(fc)
+            out_a.append(a[s0])
+            out_b.append(run_b[e0 - 1])
+        i = k
+
+    return np.array(out_c, np.float64), np.array(out_a, np.float64), np.array(out_b, np.float64)
+
+
+def merge_axis_aligned(lines_in, band=22, gap=70) -> np.ndarray:
+    L = normalize_lines(lines_in)
+    hs = L[is_horizontal(L)]
+    vs = L[is_vertical(L)]
+
+    y, x1, x2 = _merge_band_intervals(hs[:, 1], np.minimum(hs[:, 0], hs[:, 2]), np.maximum(hs[:, 0], hs[:, 2]), band, gap)
+    x, y1, y2 = _merge_band_intervals(vs[:, 0], np.minimum(vs[:, 1], vs[:, 3]), np.maximum(vs[:, 1], vs[:, 3]), band, gap)
+
+    merged_h = np.stack([x1, y, x2, y], axis=1)
+    merged_v = np.stack([x, y1, x, y2], axis=1)
+    return np.concatenate([merged_h, merged_v]).reshape(-1, 4)
+
+
+def filter_lines_on_wall(lines_in, wall_mask_255, dist_tol=7.0, keep_ratio=0.55, samples=90) -> np.ndarray:
+    L = as_lines(lines_in)
+    if len(L) == 0:
+        return L
+
+    # all sample points of all lines at once, [N, samples]
+    h, w = wall_mask_255.shape[:2]
+    t = np.linspace(0, 1, samples)
+    xs = np.rint(L[:, 0:1] + (L[:, 2:3] - L[:, 0:1]) * t).astype(np.int64)
+    ys = np.rint(L[:, 1:2] + (L[:, 3:4] - L[:, 1:2]) * t).astype(np.int64)
+    inside = (xs >= 0) & (xs < w) & (ys >= 0) & (ys < h)
+
+    with scratch.borrow((h, w), np.uint8) as inv, scratch.borrow((h, w), np.float32) as dist:
+        cv2.bitwise_not(wall_mask_255, dst=inv)
+        cv2.distanceTransform(inv, cv2.DIST_L2, 5, dst=dist)
+        near = dist[np.clip(ys, 0, h - 1), np.clip(xs, 0, w - 1)] <= dist_tol
+    ok = np.count_nonzero(inside & near, axis=1)
+
+    length_px = np.hypot(L[:, 2] - L[:, 0], L[:, 3] - L[:, 1])
+    kr = np.where(length_px > 120, keep_ratio, 0.45)
+    return L[ok / samples >= kr]
+
+
+def dedup_overlapping_lines(lines_in, band=22, overlap_gap=25) -> np.ndarray:
+    """
+    Greedy dedup: each line not yet taken seeds a cluster of the later parallel
+    lines within `band` whose spans overlap it (up to overlap_gap), and the
+    longest line of the cluster is kept. Candidates are looked up in lines
+    sorted by their center coordinate instead of scanning all pairs.
+    """
+    norm = as_lines(lines_in).copy()
+    n = len(norm)
+    if n == 0:
+        return norm
+
+    tol = 2.5
+    h = np.abs(norm[:, 3] - norm[:, 1]) <= tol
+    swap = h & (norm[:, 2] < norm[:, 0])
+    norm[swap] = norm[swap][:, [2, 3, 0, 1]]
+    v = np.abs(norm[:, 2] - norm[:, 0]) <= tol
+    swap = v & (norm[:, 3] < norm[:, 1])
+    norm[swap] = norm[swap][:, [2, 3, 0, 1]]
+
+    length = np.hypot(norm[:, 2] - norm[:, 0], norm[:, 3] - norm[:, 1])
+    yc = (norm[:, 1] + norm[:, 3]) / 2
+    xc = (norm[:, 0] + norm[:, 2]) / 2
+
+    h_idx = np.flatnonzero(h)
+    h_idx = h_idx[np.argsort(yc[h_idx], kind="stable")]
+    h_key = yc[h_idx]
+    v_idx = np.flatnonzero(v)
+    v_idx = v_idx[np.argsort(xc[v_idx], kind="stable")]
+    v_key = xc[v_idx]
+
+    def window(idx, key, center):
+        lo = np.searchsorted(key, center - band - 1.0, side="left")
+        hi = np.searchsorted(key, center + band + 1.0, side="right")
+        return idx[lo:hi]
+
+    used = np.zeros(n, dtype=bool)
+    kept = []
+    for i in range(n):
         if used[i]:
             continue
-        x_ref = vs[i][0]
-        cluster = []
-        for j in range(i, len(vs)):
-            if used[j]:
-                continue
-            if abs(vs[j][0] - x_ref) <= band:
-                x1, y1, x2, y2 = vs[j]
-                cluster.append((x1, min(y1, y2), max(y1, y2)))
-                used[j] = True
-        for x, y1, y2 in merge_1d_intervals(cluster, gap=gap):
-            merged.append([x, y1, x, y2])
+        used[i] = True
+        members = []
 
-    return merged
+        if h[i]:
+            j = window(h_idx, h_key, yc[i])
+            j = j[(j > i) & ~used[j]]
+            j = j[np.abs(yc[i] - yc[j]) <= band]
+            a1, a2 = norm[i, 0], norm[i, 2]
+            j = j[~((norm[j, 0] > a2 + overlap_gap) | (a1 > norm[j, 2] + overlap_gap))]
+            members.append(j)
 
+        if v[i]:
+            j = window(v_idx, v_key, xc[i])
+            j = j[(j > i) & ~used[j]]
+            if h[i]:
+                j = j[~h[j]]  # horizontal pairs were decided above
+            j = j[np.abs(xc[i] - xc[j]) <= band]
+            a1, a2 = norm[i, 1], norm[i, 3]
+            j = j[~((norm[j, 1] > a2 + overlap_gap) | (a1 > norm[j, 3] + overlap_gap))]
+            members.append(j)
 
-def filter_lines_on_wall(lines_in, wall_mask_255, dist_tol=7.0, keep_ratio=0.55, samples=90):
-    inv = (255 - wall_mask_255).astype(np.uint8)
-    dist = cv2.distanceTransform(inv, cv2.DIST_L2, 5)
+        cluster = np.sort(np.concatenate([[i], *members]).astype(np.int64))
+        used[cluster] = True
+        kept.append(cluster[np.argmax(length[cluster])])
 
-    kept = []
-    h, w = wall_mask_255.shape[:2]
-    for l in lines_in:
-        x1, y1, x2, y2 = map(float, l)
-        ok = 0
-        for t in np.linspace(0, 1, samples):
-            x = int(round(x1 + (x2 - x1) * t))
-            y = int(round(y1 + (y2 - y1) * t))
-            if 0 <= x < w and 0 <= y < h and dist[y, x] <= dist_tol:
-                ok += 1
-
-        length_px = math.hypot(x2 - x1, y2 - y1)
-        kr = keep_ratio if length_px > 120 else 0.45
-        if ok / samples >= kr:
-            kept.append(l)
-
-    return kept
-
-
-def dedup_overlapping_lines(lines_in, band=22, overlap_gap=25):
-    def is_h(l):
-        x1, y1, x2, y2 = l
-        return abs(y2 - y1) <= 2.5
-
-    def is_v(l):
-        x1, y1, x2, y2 = l
-        return abs(x2 - x1) <= 2.5
-
-    def length(l):
-        x1, y1, x2, y2 = l
-        return math.hypot(x2 - x1, y2 - y1)
-
-    norm = []
-    for l in lines_in:
-        x1, y1, x2, y2 = map(float, l)
-        if is_h([x1, y1, x2, y2]) and x2 < x1:
-            x1, x2 = x2, x1
-            y1, y2 = y2, y1
-        if is_v([x1, y1, x2, y2]) and y2 < y1:
-            y1, y2 = y2, y1
-            x1, x2 = x2, x1
-        norm.append([x1, y1, x2, y2])
+    return norm[np.array(kept, dtype=np.int64)]
 
-    used = [False] * len(norm)
-    kept = []
 
-    for i in range(len(norm)):
-        if used[i]:
-            continue
-        li = norm[i]
-        cluster = [li]
-        used[i] = True
+LINE_ENGINES = ("hough", "components", "runs", "vector", "junctions")
+
+# HoughLinesP settings of the hough and components engines
+HOUGH_MIN_LINE_LENGTH = 60
+HOUGH_MAX_LINE_GAP = 140
 
-        for j in range(i + 1, len(norm)):
-            if used[j]:
-                continue
-            lj = norm[j]
-
-            if is_h(li) and is_h(lj):
-                yi = (li[1] + li[3]) / 2
-                yj = (lj[1] + lj[3]) / 2
-                if abs(yi - yj) > band:
-                    continue
-                a1, a2 = li[0], li[2]
-                b1, b2 = lj[0], lj[2]
-                if not (b1 > a2 + overlap_gap or a1 > b2 + overlap_gap):
-                    cluster.append(lj)
-                    used[j] = True
-
-            elif is_v(li) and is_v(lj):
-                xi = (li[0] + li[2]) / 2
-                xj = (lj[0] + lj[2]) / 2
-                if abs(xi - xj) > band:
-                    continue
-                a1, a2 = li[1], li[3]
-                b1, b2 = lj[1], lj[3]
-                if not (b1 > a2 + overlap_gap or a1 > b2 + overlap_gap):
-                    cluster.append(lj)
-                    used[j] = True
-
-        kept.append(max(cluster, key=length))
-
-    return kept
-
-
-def extract_wall_lines(wall_255: np.ndarray):
-    skel = (skeletonize(wall_255 > 0).astype(np.uint8) * 255)
 
+def hough_segments(wall_255: np.ndarray) -> np.ndarray:
+    """Skeleton of the whole mask + probabilistic Hough, [N,4] raw segments."""
+    with scratch.borrow(wall_255.shape, bool) as mask:
+        np.greater(wall_255, 0, out=mask)
+        skel = skeletonize(mask)
+
+    # Hough takes any non-zero pixel, the 0/1 bytes of the bool skeleton will do
     lines = cv2.HoughLinesP(
-        skel,
+        skel.view(np.uint8),
         rho=1,
         theta=np.pi / 180,
         threshold=10,
-        minLineLength=60,
-        maxLineGap=140,
+        minLineLength=HOUGH_MIN_LINE_LENGTH,
+        maxLineGap=HOUGH_MAX_LINE_GAP,
     )
     if lines is None:
-        return []
+        return as_lines([])
+    return as_lines(lines)
+
+
+def component_segments(wall_255: np.ndarray, max_workers: int | None = None) -> np.ndarray:
+    """
+    Same as hough_segments, but run per connected component on its bounding box
+    crop, in a thread pool, so the cost follows the wall pixels instead of the
+    sheet. Components too small to hold a minLineLength segment are skipped.
+    The skeleton is the same as the full-page one (thinning never crosses
+    between components); Hough can no longer bridge gaps between components,
+    merge_axis_aligned still joins collinear pieces up to its gap.
+    """
+    with scratch.borrow(wall_255.shape, np.int32) as labels:
+        return _component_segments(wall_255, labels, max_workers)
+
+
+def _component_segments(wall_255: np.ndarray, labels: np.ndarray, max_workers: int | None) -> np.ndarray:
+    num, labels, stats, _ = cv2.connectedComponentsWithStats(wall_255, labels=labels, connectivity=8)
+    ids = [
+        i for i in range(1, num)
+        if max(stats[i, cv2.CC_STAT_WIDTH], stats[i, cv2.CC_STAT_HEIGHT]) >= HOUGH_MIN_LINE_LENGTH
+    ]
+    if not ids:
+        return as_lines([])
+
+    def run(i):
+        x, y = stats[i, cv2.CC_STAT_LEFT], stats[i, cv2.CC_STAT_TOP]
+        w, h = stats[i, cv2.CC_STAT_WIDTH], stats[i, cv2.CC_STAT_HEIGHT]
+        crop = np.zeros((h + 2, w + 2), np.uint8)
+        crop[1:-1, 1:-1] = (labels[y:y + h, x:x + w] == i).astype(np.uint8) * 255
+        seg = hough_segments(crop)
+        return seg + (x - 1, y - 1, x - 1, y - 1)
+
+    if max_workers is None:
+        max_workers = min(4, os.cpu_count() or 1)
+    if max_workers <= 1 or len(ids) == 1:
+        parts = [run(i) for i in ids]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="lines") as ex:
+            parts = list(ex.map(run, ids))
+    return np.concatenate(parts)
+
+
+def _runs_mask(mask: np.ndarray, min_len: int) -> np.ndarray:
+    """Pixels of `mask` (bool) lying in a row run of at least min_len pixels."""
+    h, w = mask.shape
+    padded = np.zeros((h, w + 2), np.int8)
+    padded[:, 1:-1] = mask
+    d = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(d == 1)
+    _, ends = np.nonzero(d == -1)  # same row-major order as the starts
+    keep = ends - starts >= min_len
+    rows, starts, ends = rows[keep], starts[keep], ends[keep]
+
+    # paint the kept runs back: +1 at each start, -1 past each end, cumsum per row
+    marks = np.zeros((h, w + 1), np.int32)
+    np.add.at(marks, (rows, starts), 1)
+    np.add.at(marks, (rows, ends), -1)
+    return np.cumsum(marks[:, :w], axis=1) > 0
+
+
+def _bands_to_lines(runs: np.ndarray) -> np.ndarray:
+    """Horizontal lines [N,4] from the connected bands of a row-runs mask."""
+    num, _labels, stats, centroids = cv2.connectedComponentsWithStats(runs.astype(np.uint8), connectivity=8)
+    x = stats[1:, cv2.CC_STAT_LEFT].astype(np.float64)
+    w = stats[1:, cv2.CC_STAT_WIDTH].astype(np.float64)
+    t = stats[1:, cv2.CC_STAT_HEIGHT].astype(np.float64)
+    y = centroids[1:, 1]
+
+    # a band's centerline ends half a wall thickness inside its ends, as a skeleton does
+    keep = w >= 2 * t
+    x1 = x + t / 2
+    x2 = x + w - 1 - t / 2
+    return np.stack([x1, y, x2, y], axis=1)[keep]
+
+
+def run_segments(wall_255: np.ndarray, min_len: int = HOUGH_MIN_LINE_LENGTH) -> np.ndarray:
+    """
+    Axis-aligned wall segments from row and column run-length scans.
+
+    Wall pixels in horizontal runs of at least min_len form horizontal bands
+    (and likewise for columns); each band gives one line along its centroid.
+    Only the bounding box of the wall pixels is scanned. Slanted walls are not
+    found, as with the hough engine after snapping.
+    """
+    pts = cv2.findNonZero(wall_255)
+    if pts is None:
+        return as_lines([])
+    bx, by, bw, bh = cv2.boundingRect(pts)
+    mask = wall_255[by:by + bh, bx:bx + bw] > 0
+
+    h_lines = _bands_to_lines(_runs_mask(mask, min_len))
+    # column runs are row runs of the transpose, swap x and y back
+    v_lines = _bands_to_lines(_runs_mask(np.ascontiguousarray(mask.T), min_len))[:, [1, 0, 3, 2]]
+    return np.concatenate([h_lines, v_lines]) + (bx, by, bx, by)
+
+
+def _center_offsets(wall_255: np.ndarray, lines: np.ndarray, max_offset: int, samples: int, chunk: int = 1024):
+    """center_on_wall for horizontal lines (x1, y, x2, y): the shift of each line in y, 0 if none."""
+    if len(lines) > chunk:
+        return np.concatenate(
+            [_center_offsets(wall_255, lines[i:i + chunk], max_offset, samples, chunk) for i in range(0, len(lines), chunk)]
+        )
+    h, w = wall_255.shape[:2]
+    t = (np.arange(samples) + 0.5) / samples
+    xs = np.rint(lines[:, 0:1] + (lines[:, 2:3] - lines[:, 0:1]) * t).astype(np.int64)  # [N,S]
+    offsets = np.arange(-max_offset, max_offset + 1)
+    ys = np.rint(lines[:, 1]).astype(np.int64)[:, None, None] + offsets  # [N,1,O]
+
+    inside = (xs[:, :, None] >= 0) & (xs[:, :, None] < w) & (ys >= 0) & (ys < h)
+    on = inside & (wall_255[np.clip(ys, 0, h - 1), np.clip(xs, 0, w - 1)[:, :, None]] > 0)  # [N,S,O]
+
+    # the run of wall pixels nearest to the line in each sample column
+    idx = np.arange(len(offsets))
+    near = np.argmin(np.where(on, np.abs(offsets), len(offsets)), axis=2)[:, :, None]
+    lower = np.where(~on & (idx < near), idx, -1).max(axis=2)
+    upper = np.where(~on & (idx > near), idx, len(offsets)).min(axis=2)
+    center = (lower + upper) / 2.0 - max_offset
+    center[~on.any(axis=2)] = np.nan
+
+    shift = np.zeros(len(lines))
+    found = ~np.isnan(center).all(axis=1)
+    shift[found] = np.nanmedian(center[found], axis=1)
+    return shift
+
+
+def center_on_wall(lines_in, wall_255: np.ndarray, max_offset: int = 60, samples: int = 16) -> np.ndarray:
+    """
+    Moves horizontal and vertical lines across onto the middle of the wall under
+    them, so both faces of a drawn wall (and its hatching) land on its
+    centerline. At `samples` points along a line the run of wall pixels within
+    max_offset px nearest to it is found, and the line moves to the median of
+    the run centers. Lines with no wall pixel in reach stay where they are.
+    """
+    L = as_lines(lines_in).copy()
+    if len(L) == 0:
+        return L
+    h = np.abs(L[:, 3] - L[:, 1]) <= np.abs(L[:, 2] - L[:, 0])
+
+    L[h, 1] += _center_offsets(wall_255, L[h], max_offset, samples)
+    L[h, 3] = L[h, 1]
+    v = ~h
+    L[v, 0] += _center_offsets(wall_255.T, L[v][:, [1, 0, 3, 2]], max_offset, samples)
+    L[v, 2] = L[v, 0]
+    return L
+
+
+def _snap_ends(ends: np.ndarray, along: np.ndarray, others: np.ndarray, tol: float, chunk: int = 1024) -> np.ndarray:
+    """
+    ends [N,2] endpoint coordinates of lines at `along` [N], others [M,3] = (coord, lo, hi)
+    of the perpendicular lines; each end moves to the nearest coord within tol whose
+    line spans `along` (give or take tol).
+    """
+    out = ends.copy()
+    if len(others) == 0:
+        return out
+    for i in range(0, len(ends), chunk):
+        a = along[i:i + chunk, None]
+        spans = (others[:, 1] - tol <= a) & (a <= others[:, 2] + tol)  # [n,M]
+        for k in (0, 1):
+            d = np.abs(ends[i:i + chunk, k:k + 1] - others[:, 0])
+            d = np.where(spans & (d <= tol), d, np.inf)
+            j = np.argmin(d, axis=1)
+            hit = np.isfinite(d[np.arange(len(j)), j])
+            out[i:i + chunk, k][hit] = others[j[hit], 0]
+    return out
+
+
+def snap_corners(lines_in, tol: float = 40.0) -> np.ndarray:
+    """
+    Moves the ends of horizontal and vertical lines onto the perpendicular line
+    they stop within tol px of, so centerlines meet at corners and junctions
+    instead of stopping short of or running past them.
+    """
+    L = normalize_lines(lines_in).copy()
+    h = np.abs(L[:, 3] - L[:, 1]) <= np.abs(L[:, 2] - L[:, 0])
+    H, V = L[h], L[~h]
+    h_spans = np.stack([H[:, 1], np.minimum(H[:, 0], H[:, 2]), np.maximum(H[:, 0], H[:, 2])], axis=1)
+    v_spans = np.stack([V[:, 0], np.minimum(V[:, 1], V[:, 3]), np.maximum(V[:, 1], V[:, 3])], axis=1)
+
+    L[np.flatnonzero(h)[:, None], [0, 2]] = _snap_ends(H[:, [0, 2]], H[:, 1], v_spans, tol)
+    L[np.flatnonzero(~h)[:, None], [1, 3]] = _snap_ends(V[:, [1, 3]], V[:, 0], h_spans, tol)
+    return L
+
+
+# pages with fewer axis-aligned strokes than this are taken for scans, "vector" uses hough then
+MIN_VECTOR_SEGMENTS = 8
+
+
+def vector_segments(segments_in, wall_255: np.ndarray, min_len: int = HOUGH_MIN_LINE_LENGTH) -> np.ndarray:
+    """
+    Raw wall segments from the strokes of a vector PDF (see pdf_vectors.page_segments),
+    in the mask's pixels. Only axis-aligned strokes are used; they are centered
+    on the wall mask, joined where collinear, made to meet at corners and kept
+    from min_len px on, like the Hough segments. Their extent comes from the
+    drawing, not the mask.
+    """
+    snapped = snap_hv_lines(segments_in, angle_tol=2)
+    centered = center_on_wall(snapped, wall_255)
+    merged = snap_corners(merge_axis_aligned(centered, band=3, gap=2))
+    length = np.hypot(merged[:, 2] - merged[:, 0], merged[:, 3] - merged[:, 1])
+    return merged[length >= min_len]
+
+
+def extract_wall_lines(
+    wall_255: np.ndarray,
+    engine: str = "hough",
+    vector_segments_in: np.ndarray | None = None,
+    junction_lines_in: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    Wall centerlines of a page mask, [N,4] float64 (x1, y1, x2, y2).
+
+    `engine` picks how raw segments are found (see LINE_ENGINES): "hough" on the
+    skeleton of the whole page, "components" the same per connected component,
+    "runs" from row/column run-length scans, "vector" from the PDF strokes in
+    vector_segments_in (hough for pages without enough of them), "junctions"
+    the lines the model's junction heatmaps give (junction_lines_in, see
+    junctions.py; hough without them). Snapping, merging, the on-wall check
+    and dedup are the same for all of them.
+    """
+    if engine == "vector":
+        if vector_segments_in is not None and len(snap_hv_lines(vector_segments_in, 2)) >= MIN_VECTOR_SEGMENTS:
+            segments = vector_segments(vector_segments_in, wall_255)
+        else:
+            segments = hough_segments(wall_255)
+    elif engine == "junctions":
+        if junction_lines_in is not None and len(junction_lines_in):
+            segments = np.asarray(junction_lines_in, dtype=np.float64).reshape(-1, 4)
+        else:
+            segments = hough_segments(wall_255)
+    elif engine == "components":
+        segments = component_segments(wall_255)
+    elif engine == "runs":
+        segments = run_segments(wall_255)
+    elif engine == "hough":
+        segments = hough_segments(wall_255)
+    else:
+        raise ValueError(f"line engine must be one of {LINE_ENGINES}, got {engine!r}")
 
-    lines = lines.reshape(-1, 4)
-    snapped = [s for s in (snap_hv(l, angle_tol=20) for l in lines) if s is not None]
+    snapped = snap_hv_lines(segments, angle_tol=20)
     merged = merge_axis_aligned(snapped, band=22, gap=70)
 
-    wall_for_check = cv2.dilate(wall_255, cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5)), 1)
-    final_lines = filter_lines_on_wall(merged, wall_for_check, dist_tol=7.0, keep_ratio=0.55, samples=90)
+    with scratch.borrow(wall_255.shape, np.uint8) as wall_for_check:
+        cv2.dilate(wall_255, cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5)), dst=wall_for_check, iterations=1)
+        final_lines = filter_lines_on_wall(merged, wall_for_check, dist_tol=7.0, keep_ratio=0.55, samples=90)
     final_lines = dedup_overlapping_lines(final_lines, band=22, overlap_gap=25)
     return final_lines
@@ -0,0 +1,58 @@
+"""
+WorkerPool bookkeeping when its executor can't take jobs: the capacity slot
+and the job entry of a failed submit must be given back.
+"""
+from __future__ import annotations
+
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from app.jobs import PoolUnavailableError, QueueFullError, WorkerPool
+
+
+class _BrokenExecutor:
+    def submit(self, *args, **kwargs):
+        raise BrokenProcessPool("A child process terminated abruptly")
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def _pool(**kwargs) -> WorkerPool:
+    pool = WorkerPool("missing.pth", device="cpu", workers=1, queue_size=1, **kwargs)
+    pool._loading = []  # don't load a model, only the bookkeeping is tested
+    return pool
+
+
+def _noop(model, device):
+    return {}
+
+
+def test_broken_pool_gives_back_capacity():
+    pool = _pool()
+    pool._executor = _BrokenExecutor()
+    for _ in range(pool.capacity + 2):
+        with pytest.raises(PoolUnavailableError):
+            pool.submit(_noop)
+    stats = pool.stats()
+    assert stats["in_flight"] == 0
+    assert stats["tracked_jobs"] == 0
+
+
+def test_submit_after_shutdown():
+    pool = _pool()
+    pool.shutdown()
+    with pytest.raises(PoolUnavailableError):
+        pool.submit(_noop)
+    assert pool.stats()["in_flight"] == 0
+    assert pool.stats()["tracked_jobs"] == 0
+
+
+def test_full_queue_still_rejected():
+    pool = _pool()
+    pool._executor = _BrokenExecutor()
+    pool._in_flight = pool.capacity
+    with pytest.raises(QueueFullError):
+        pool.submit(_noop)
+    assert pool.stats()["in_flight"] == pool.capacity
@@ -0,0 +1,88 @@
+"""
+heatmap_peaks against floortrans post_prosessing.extract_local_max (with
+close point suppression, as get_wall_lines calls it) on fixed heatmaps.
+"""
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from app import model_loader  # noqa: F401, puts vendor/ on sys.path
+from app.junctions import JUNCTION_GAP, JUNCTION_THRESHOLD, MAX_POINTS, heatmap_peaks
+from floortrans.post_prosessing import extract_local_max
+
+H, W, CHANNELS = 72, 96, 13
+
+
+def vendor_peaks(heatmaps: np.ndarray, threshold=JUNCTION_THRESHOLD, max_points=MAX_POINTS) -> np.ndarray:
+    rows = []
+    for c, heatmap in enumerate(heatmaps):
+        points = extract_local_max(heatmap.copy(), max_points, [c], threshold, close_point_suppression=True, gap=JUNCTION_GAP)
+        rows += [[x, y, c, rank] for rank, (x, y, _c, _v) in enumerate(points)]
+    return np.array(rows, dtype=np.int64).reshape(-1, 4)
+
+
+def blob(x: float, y: float, sigma: float, value: float) -> np.ndarray:
+    yy, xx = np.mgrid[0:H, 0:W]
+    return (value * np.exp(-((xx - x) ** 2 + (yy - y) ** 2) / (2 * sigma**2))).astype(np.float32)
+
+
+def junction_heatmaps(seed: int, saturate: bool = False) -> np.ndarray:
+    """Junction blobs on a jittered grid (no closer than the gap box plus a blob's
+    radius above threshold), some at the last row and column, on sub-threshold noise.
+    With saturate, strong blobs clip at 1.0 into plateaus, as a float32 sigmoid does."""
+    rng = np.random.default_rng(seed)
+    heat = rng.uniform(0, 0.15, (CHANNELS, H, W)).astype(np.float32)
+    for cy in range(6, H, 17):
+        for cx in range(6, W, 17):
+            c = rng.integers(CHANNELS)
+            x = min(W - 1, cx + rng.integers(-1, 3) * (cx + 17 >= W) * 4 + rng.normal(0, 1))
+            y = min(H - 1, cy + rng.integers(-1, 3) * (cy + 17 >= H) * 4 + rng.normal(0, 1))
+            peak = blob(x, y, rng.uniform(1.2, 2.0), rng.uniform(0.3, 1.6 if saturate else 1.0))
+            heat[c] = np.maximum(heat[c], np.minimum(peak, 1.0))
+    return heat
+
+
+@pytest.mark.parametrize("saturate", [False, True])
+@pytest.mark.parametrize("seed", range(8))
+def test_matches_extract_local_max(seed, saturate):
+    heat = junction_heatmaps(seed, saturate)
+    np.testing.assert_array_equal(heatmap_peaks(heat), vendor_peaks(heat))
+
+
+def test_plateau_is_one_point():
+    heat = np.zeros((1, H, W), np.float32)
+    heat[0, 20:24, 10:60] = 1.0  # wider than the gap box
+    heat[0, 50, 70:74] = 0.9
+    heat[0, 50, 74] = 0.95  # a plateau running up into a higher pixel is its slope
+    expected = vendor_peaks(heat)
+    np.testing.assert_array_equal(expected, [[10, 20, 0, 0], [74, 50, 0, 1]])
+    np.testing.assert_array_equal(heatmap_peaks(heat), expected)
+
+
+def test_last_row_and_column_escape_the_box():
+    heat = np.zeros((1, H, W), np.float32)
+    heat[0, H - 3, 40] = 0.9
+    heat[0, H - 1, 43] = 0.8  # in the box, but extract_local_max's box stops short of the last row
+    heat[0, 30, W - 1] = 0.7
+    heat[0, 28, W - 4] = 0.9
+    heat[0, 10, 10] = 0.8
+    heat[0, 12, 13] = 0.7  # suppressed
+    expected = vendor_peaks(heat)
+    assert len(expected) == 5
+    np.testing.assert_array_equal(heatmap_peaks(heat), expected)
+
+
+def test_max_points():
+    heat = junction_heatmaps(0)
+    np.testing.assert_array_equal(heatmap_peaks(heat, max_points=2), vendor_peaks(heat, max_points=2))
+
+
+def test_box_edge_slope_is_not_a_point():
+    # the documented difference: the box around the first point cuts the
+    # second blob's top off, and extract_local_max takes its slope outside
+    # the box as a point of its own
+    heat = (blob(30, 30, 1.5, 1.0) + blob(30 + JUNCTION_GAP - 1, 30, 3.0, 0.9))[None]
+    ours, theirs = heatmap_peaks(heat), vendor_peaks(heat)
+    np.testing.assert_array_equal(ours, [[30, 30, 0, 0]])
+    assert len(theirs) == 2 and theirs[1, 0] == 30 + JUNCTION_GAP
@@ -0,0 +1,107 @@
+"""
+The one-pass border relabel against the per-component loop it replaced, and
+the downsampled outline against the full-resolution engine, including plans
+with doors in the exterior walls.
+"""
+from __future__ import annotations
+
+import cv2
+import numpy as np
+import pytest
+
+from app.synthetic import DENSITIES, SHEETS, PlanSpec, synthetic_plan
+from app.outer_contour import (
+    default_pre_dilate_k,
+    get_building_outer_contour,
+    get_building_outer_contour_downsampled,
+    remove_border_touching_components,
+)
+
+
+def _ref_remove_border_touching_components(bin255):
+    bin01 = (bin255 > 0).astype(np.uint8)
+    num, lab, stats, _ = cv2.connectedComponentsWithStats(bin01, connectivity=8)
+    h, w = bin01.shape
+    out = np.zeros_like(bin01)
+    for cid in range(1, num):
+        x, y, ww, hh, _area = stats[cid]
+        touches = (x == 0) or (y == 0) or (x + ww >= w) or (y + hh >= h)
+        if not touches:
+            out[lab == cid] = 1
+    return (out * 255).astype(np.uint8)
+
+
+def random_blobs(rng: np.random.Generator, h: int = 700, w: int = 900) -> np.ndarray:
+    mask = np.zeros((h, w), np.uint8)
+    for _ in range(40):
+        x, y = int(rng.integers(-20, w + 20)), int(rng.integers(-20, h + 20))
+        cv2.rectangle(mask, (x, y), (x + int(rng.integers(2, 120)), y + int(rng.integers(2, 120))), 255, -1)
+    return mask
+
+
+def door_plan(gap: int) -> np.ndarray:
+    """A two-room building with doors `gap` px wide in its top and right walls (gap 0: none)."""
+    mask = np.zeros((1500, 2100), np.uint8)
+    cv2.rectangle(mask, (300, 250), (1800, 1250), 255, 10)
+    cv2.line(mask, (1000, 250), (1000, 1250), 255, 6)
+    if gap:
+        mask[240:262, 600 : 600 + gap] = 0
+        mask[900 : 900 + gap, 1790:1812] = 0
+    return mask
+
+
+def outlines(wall255: np.ndarray, **kwargs):
+    pre_dilate_k = default_pre_dilate_k(*wall255.shape)
+    full = get_building_outer_contour(wall255, 121, 2, pre_dilate_k)
+    down = get_building_outer_contour_downsampled(wall255, 121, 2, pre_dilate_k, **kwargs)
+    return full, down
+
+
+def iou(a: np.ndarray, b: np.ndarray) -> float:
+    a, b = a > 0, b > 0
+    return (a & b).sum() / (a | b).sum()
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_border_relabel_matches_reference(seed):
+    mask = random_blobs(np.random.default_rng(seed))
+    expected = _ref_remove_border_touching_components(mask)
+    np.testing.assert_array_equal(remove_border_touching_components(mask), expected)
+    dst = np.full(mask.shape, 7, np.uint8)
+    assert remove_border_touching_components(mask, dst=dst) is dst
+    np.testing.assert_array_equal(dst, expected)
+
+
+@pytest.mark.parametrize("gap", [0, 20, 60, 150])
+def test_door_gaps_keep_the_perimeter(gap):
+    (c_full, blob_full), (c_down, blob_down) = outlines(door_plan(gap))
+    (c_base, _), _ = outlines(door_plan(0))
+    # the close bridges the doors: the outline is the one without them
+    assert cv2.arcLength(c_full, True) == pytest.approx(cv2.arcLength(c_base, True), rel=1e-3)
+    assert cv2.arcLength(c_down, True) == pytest.approx(cv2.arcLength(c_full, True), rel=1e-3)
+    assert iou(blob_full, blob_down) > 0.995
+
+
+@pytest.mark.parametrize("density", sorted(DENSITIES))
+@pytest.mark.parametrize("seed", range(3))
+def test_downsampled_matches_full_engine(density, seed):
+    _pdf, mask = synthetic_plan(PlanSpec(SHEETS["12x8"], DENSITIES[density], seed=seed))
+    wall = remove_border_touching_components(mask)
+    (c_full, blob_full), (c_down, blob_down) = outlines(wall)
+    assert cv2.arcLength(c_down, True) == pytest.approx(cv2.arcLength(c_full, True), rel=1e-3)
+    assert iou(blob_full, blob_down) > 0.999
+
+
+def test_downsampled_writes_into_dst():
+    wall = door_plan(60)
+    dst = np.full(wall.shape, 9, np.uint8)
+    _, (contour, blob) = outlines(wall, dst=dst)
+    assert blob is dst
+    assert set(np.unique(dst)) == {0, 255}
+    _, (contour2, _) = outlines(wall)
+    np.testing.assert_array_equal(contour, contour2)
+
+
+def test_empty_mask():
+    contour, blob = get_building_outer_contour_downsampled(np.zeros((400, 600), np.uint8))
+    assert contour is None and not blob.any()
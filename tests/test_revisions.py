@@ -0,0 +1,94 @@
+"""
+Change detection and line merging of incremental re-estimation: which
+tiles of a revised page count as changed, where prior lines are cut and
+which of them survive.
+"""
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from app.revisions import PIXEL_TOLERANCE, TILE, dirty_boxes, dirty_tiles, merge_revised_lines, split_lines
+
+# a 24x18" sheet: page pixels at 300 DPI, its fingerprint at 36
+PAGE = (7200, 5400)
+FINGERPRINT = (648, 864)
+
+
+def _rows(lines) -> set[tuple[float, ...]]:
+    return {tuple(np.round(l, 6)) for l in np.asarray(lines).reshape(-1, 4).tolist()}
+
+
+def test_split_at_box_edges():
+    outside, inside = split_lines([[0, 100, 1000, 100]], [(200, 0, 400, 200), (600, 50, 700, 150)])
+    assert _rows(outside) == {(0, 100, 200, 100), (400, 100, 600, 100), (700, 100, 1000, 100)}
+    assert _rows(inside) == {(200, 100, 400, 100), (600, 100, 700, 100)}
+
+
+def test_split_vertical_and_diagonal():
+    outside, inside = split_lines([[50, 0, 50, 100], [0, 0, 100, 100]], [(0, 40, 100, 60)])
+    assert _rows(outside) == {(50, 0, 50, 40), (50, 60, 50, 100), (0, 0, 40, 40), (60, 60, 100, 100)}
+    assert _rows(inside) == {(50, 40, 50, 60), (40, 40, 60, 60)}
+
+
+def test_split_lines_away_from_boxes_untouched():
+    lines = np.array([[0, 500, 1000, 500], [2000, 0, 2000, 1000], [300, 300, 350, 350]], dtype=np.float64)
+    outside, inside = split_lines(lines, [(100, 0, 250, 250)])
+    np.testing.assert_array_equal(outside, lines)
+    assert inside.shape == (0, 4)
+
+
+def test_split_line_inside_a_box():
+    outside, inside = split_lines([[120, 10, 180, 10]], [(100, 0, 250, 250)])
+    assert outside.shape == (0, 4)
+    assert _rows(inside) == {(120, 10, 180, 10)}
+
+
+def test_merge_keeps_prior_lines_away_from_boxes():
+    box = (3000, 3000, 3400, 3400)
+    far = [[1500, 1000, 2500, 1000], [5000, 500, 5000, 2000], [1500, 4500, 2500, 4500]]
+    prior = far + [[3100, 3100, 3300, 3100]]  # a wall the revision removed
+    new = [[3100, 3200, 3300, 3200], [1500, 2000, 2500, 2000]]  # a new wall, and noise outside the box
+    merged = _rows(merge_revised_lines(np.array(prior, float), np.array(new, float), [box]))
+    assert _rows(far) <= merged
+    assert (3100, 3200, 3300, 3200) in merged
+    assert (3100, 3100, 3300, 3100) not in merged
+    assert (1500, 2000, 2500, 2000) not in merged
+    assert len(merged) == len(far) + 1
+
+
+def test_merge_without_boxes_is_the_prior():
+    prior = np.array([[1500, 1000, 2500, 1000], [5000, 500, 5000, 2000]], float)
+    assert _rows(merge_revised_lines(prior, np.zeros((0, 4)), [])) == _rows(prior)
+
+
+def test_unchanged_fingerprint_has_no_dirty_boxes():
+    rng = np.random.default_rng(0)
+    prior = rng.integers(0, 256, FINGERPRINT, dtype=np.uint8)
+    new = prior.copy()
+    new[100:110, 200:210] = np.clip(new[100:110, 200:210].astype(int) + PIXEL_TOLERANCE, 0, 255)  # renderer noise
+    tiles = dirty_tiles(prior, new)
+    assert tiles.shape == (FINGERPRINT[0] // TILE, FINGERPRINT[1] // TILE)
+    assert not tiles.any()
+    assert dirty_boxes(tiles, PAGE) == []
+
+
+def test_changed_tile_becomes_a_page_box():
+    prior = np.full(FINGERPRINT, 255, dtype=np.uint8)
+    new = prior.copy()
+    new[9 * TILE + 5, 12 * TILE + 5] = 0
+    tiles = dirty_tiles(prior, new)
+    assert np.argwhere(tiles).tolist() == [[9, 12]]
+    assert dirty_boxes(tiles, PAGE) == [(3600, 2700, 3900, 3000)]
+
+
+def test_changes_in_the_title_block_are_ignored():
+    prior = np.full(FINGERPRINT, 255, dtype=np.uint8)
+    new = prior.copy()
+    new[300, 10] = 0  # left title block
+    assert dirty_boxes(dirty_tiles(prior, new), PAGE) == []
+
+
+@pytest.mark.parametrize("shape", [(648, 900), (600, 864)])
+def test_resized_page_is_not_compared(shape):
+    assert dirty_tiles(np.zeros(FINGERPRINT, np.uint8), np.zeros(shape, np.uint8)) is None
@@ -0,0 +1,141 @@
+"""
+The streaming multipart reader (receive_pdf_form) on bodies fed in pieces
+by a fake request stream: limits, the PDF magic check, malformed forms and
+spooling to disk.
+"""
+from __future__ import annotations
+
+import hashlib
+
+import anyio
+import pytest
+
+from app.uploads import MAGIC_SEARCH_BYTES, MAX_FIELD_BYTES, UploadRejected, receive_pdf_form
+
+BOUNDARY = "test-boundary"
+PDF = b"%PDF-1.7\n" + bytes(range(256)) * 40 + b"\n%%EOF\n"
+
+
+class FakeRequest:
+    def __init__(self, body: bytes, chunk: int = 1000, content_length: bool = True, boundary: str = BOUNDARY):
+        self.body = body
+        self.chunk = chunk
+        self.headers = {"content-type": f"multipart/form-data; boundary={boundary}"}
+        if content_length:
+            self.headers["content-length"] = str(len(body))
+        self.read = 0
+
+    async def stream(self):
+        for i in range(0, len(self.body), self.chunk):
+            self.read += min(self.chunk, len(self.body) - i)
+            yield self.body[i : i + self.chunk]
+
+
+def form(*parts: tuple[str, bytes, str | None], close: bool = True) -> bytes:
+    """A multipart body of (name, data, filename or None) parts."""
+    out = b""
+    for name, data, filename in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+        out += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + data + b"\r\n"
+    if close:
+        out += f"--{BOUNDARY}--\r\n".encode()
+    return out
+
+
+def receive(request, tmp_path, max_bytes=1 << 20, memory_bytes=1 << 20):
+    return anyio.run(receive_pdf_form, request, tmp_path / "upload.pdf", max_bytes, memory_bytes)
+
+
+@pytest.mark.parametrize("chunk", [1, 7, 1000, 1 << 20])
+def test_pdf_and_fields_in_memory(tmp_path, chunk):
+    body = form(("scale_inch_per_foot", b"1/4", None), ("pdf", PDF, "plan.pdf"), ("page_index", b"2", None))
+    result = receive(FakeRequest(body, chunk), tmp_path)
+    assert result.filename == "plan.pdf"
+    assert result.fields == {"scale_inch_per_foot": "1/4", "page_index": "2"}
+    assert result.pdf.data == PDF
+    assert result.pdf.path is None
+    assert result.pdf.size == len(PDF)
+    assert result.pdf.sha256 == hashlib.sha256(PDF).hexdigest()
+    assert not (tmp_path / "upload.pdf").exists()
+
+
+@pytest.mark.parametrize("chunk", [1, 3, 4096])
+def test_spools_to_disk_beyond_memory_bytes(tmp_path, chunk):
+    body = form(("pdf", PDF, "plan.pdf"))
+    result = receive(FakeRequest(body, chunk), tmp_path, memory_bytes=len(PDF) // 3)
+    assert result.pdf.data is None
+    assert result.pdf.path == tmp_path / "upload.pdf"
+    assert result.pdf.path.read_bytes() == PDF
+    assert result.pdf.sha256 == hashlib.sha256(PDF).hexdigest()
+    assert result.pdf.source_kwargs() == {"pdf_path": str(tmp_path / "upload.pdf")}
+
+
+def test_content_length_over_limit_rejected_before_reading(tmp_path):
+    # the limit leaves MAX_FIELD_BYTES for the other fields
+    request = FakeRequest(form(("pdf", PDF + bytes(MAX_FIELD_BYTES), "plan.pdf")))
+    with pytest.raises(UploadRejected) as e:
+        receive(request, tmp_path, max_bytes=len(PDF) - 1)
+    assert e.value.status_code == 413
+    assert request.read == 0
+
+
+@pytest.mark.parametrize("memory_bytes", [1 << 20, 64])
+def test_over_limit_while_streaming(tmp_path, memory_bytes):
+    # no Content-Length (chunked transfer), so only the streamed size can tell
+    request = FakeRequest(form(("pdf", PDF, "plan.pdf")), chunk=512, content_length=False)
+    with pytest.raises(UploadRejected) as e:
+        receive(request, tmp_path, max_bytes=len(PDF) // 2, memory_bytes=memory_bytes)
+    assert e.value.status_code == 413
+    assert request.read < len(request.body)
+    assert not (tmp_path / "upload.pdf").exists()
+
+
+@pytest.mark.parametrize("chunk", [1, 2, 3])
+def test_magic_split_across_chunks(tmp_path, chunk):
+    pdf = b"junk before the header " + PDF
+    result = receive(FakeRequest(form(("pdf", pdf, "plan.pdf")), chunk), tmp_path, memory_bytes=32)
+    assert result.pdf.path.read_bytes() == pdf
+
+
+@pytest.mark.parametrize("memory_bytes", [1 << 20, 32])
+def test_not_a_pdf(tmp_path, memory_bytes):
+    data = b"x" * MAGIC_SEARCH_BYTES + PDF  # the header is too far in
+    with pytest.raises(UploadRejected, match="not a PDF"):
+        receive(FakeRequest(form(("pdf", data, "plan.pdf")), chunk=5), tmp_path, memory_bytes=memory_bytes)
+    assert not (tmp_path / "upload.pdf").exists()
+
+
+def test_short_file_without_magic(tmp_path):
+    with pytest.raises(UploadRejected, match="not a PDF"):
+        receive(FakeRequest(form(("pdf", b"hello", "plan.pdf"))), tmp_path)
+
+
+def test_duplicate_pdf_part(tmp_path):
+    body = form(("pdf", PDF, "a.pdf"), ("pdf", PDF, "b.pdf"))
+    with pytest.raises(UploadRejected, match="More than one pdf"):
+        receive(FakeRequest(body), tmp_path, memory_bytes=64)
+    assert not (tmp_path / "upload.pdf").exists()
+
+
+def test_truncated_body(tmp_path):
+    body = form(("pdf", PDF, "plan.pdf"), close=False)[:-100]
+    with pytest.raises(UploadRejected, match="Incomplete form data"):
+        receive(FakeRequest(body), tmp_path, memory_bytes=64)
+    assert not (tmp_path / "upload.pdf").exists()
+
+
+def test_missing_pdf_part(tmp_path):
+    with pytest.raises(UploadRejected, match="Missing pdf"):
+        receive(FakeRequest(form(("page_index", b"0", None))), tmp_path)
+
+
+def test_non_pdf_filename(tmp_path):
+    with pytest.raises(UploadRejected, match="Only PDF"):
+        receive(FakeRequest(form(("pdf", PDF, "plan.png"))), tmp_path)
+
+
+def test_not_multipart(tmp_path):
+    request = FakeRequest(PDF)
+    request.headers["content-type"] = "application/pdf"
+    with pytest.raises(UploadRejected, match="multipart"):
+        receive(request, tmp_path)
@@ -0,0 +1,257 @@
+"""
+The vectorized line post-processing against the list-based implementation it
+replaced (kept below as the reference), on random line sets and plan-like
+masks. Outputs must be identical, order included.
+"""
+from __future__ import annotations
+
+import math
+
+import cv2
+import numpy as np
+import pytest
+
+from app.wall_lines import dedup_overlapping_lines, filter_lines_on_wall, merge_axis_aligned, snap_hv, snap_hv_lines
+
+
+# ---- reference: the loop implementation before vectorization ----
+
+
+def _ref_normalize_line(l):
+    x1, y1, x2, y2 = map(float, l)
+    if abs(y2 - y1) < abs(x2 - x1):
+        if x2 < x1:
+            x1, x2 = x2, x1
+            y1, y2 = y2, y1
+    else:
+        if y2 < y1:
+            x1, x2 = x2, x1
+            y1, y2 = y2, y1
+    return [x1, y1, x2, y2]
+
+
+def _ref_is_horizontal(l, tol=2.5):
+    x1, y1, x2, y2 = l
+    return abs(y2 - y1) <= tol and abs(x2 - x1) > 20
+
+
+def _ref_is_vertical(l, tol=2.5):
+    x1, y1, x2, y2 = l
+    return abs(x2 - x1) <= tol and abs(y2 - y1) > 20
+
+
+def _ref_merge_1d_intervals(items, gap=70):
+    if not items:
+        return []
+    items = sorted(items, key=lambda t: t[1])
+    out = []
+    fc, a, b = items[0]
+    for fc2, a2, b2 in items[1:]:
+        if a2 <= b + gap:
+            b = max(b, b2)
+            fc = (fc + fc2) / 2.0
+        else:
+            out.append((fc, a, b))
+            fc, a, b = fc2, a2, b2
+    out.append((fc, a, b))
+    return out
+
+
+def _ref_merge_axis_aligned(lines_in, band=22, gap=70):
+    lines_in = [_ref_normalize_line(l) for l in lines_in]
+    hs = [l for l in lines_in if _ref_is_horizontal(l)]
+    vs = [l for l in lines_in if _ref_is_vertical(l)]
+
+    merged = []
+
+    hs = sorted(hs, key=lambda l: l[1])
+    used = [False] * len(hs)
+    for i in range(len(hs)):
+        if used[i]:
+            continue
+        y_ref = hs[i][1]
+        cluster = []
+        for j in range(i, len(hs)):
+            if used[j]:
+                continue
+            if abs(hs[j][1] - y_ref) <= band:
+                x1, y1, x2, y2 = hs[j]
+                cluster.append((y1, min(x1, x2), max(x1, x2)))
+                used[j] = True
+        for y, x1, x2 in _ref_merge_1d_intervals(cluster, gap=gap):
+            merged.append([x1, y, x2, y])
+
+    vs = sorted(vs, key=lambda l: l[0])
+    used = [False] * len(vs)
+    for i in range(len(vs)):
+        if used[i]:
+            continue
+        x_ref = vs[i][0]
+        cluster = []
+        for j in range(i, len(vs)):
+            if used[j]:
+                continue
+            if abs(vs[j][0] - x_ref) <= band:
+                x1, y1, x2, y2 = vs[j]
+                cluster.append((x1, min(y1, y2), max(y1, y2)))
+                used[j] = True
+        for x, y1, y2 in _ref_merge_1d_intervals(cluster, gap=gap):
+            merged.append([x, y1, x, y2])
+
+    return merged
+
+
+def _ref_filter_lines_on_wall(lines_in, wall_mask_255, dist_tol=7.0, keep_ratio=0.55, samples=90):
+    inv = (255 - wall_mask_255).astype(np.uint8)
+    dist = cv2.distanceTransform(inv, cv2.DIST_L2, 5)
+
+    kept = []
+    h, w = wall_mask_255.shape[:2]
+    for l in lines_in:
+        x1, y1, x2, y2 = map(float, l)
+        ok = 0
+        for t in np.linspace(0, 1, samples):
+            x = int(round(x1 + (x2 - x1) * t))
+            y = int(round(y1 + (y2 - y1) * t))
+            if 0 <= x < w and 0 <= y < h and dist[y, x] <= dist_tol:
+                ok += 1
+
+        length_px = math.hypot(x2 - x1, y2 - y1)
+        kr = keep_ratio if length_px > 120 else 0.45
+        if ok / samples >= kr:
+            kept.append(l)
+
+    return kept
+
+
+def _ref_dedup_overlapping_lines(lines_in, band=22, overlap_gap=25):
+    def is_h(l):
+        return abs(l[3] - l[1]) <= 2.5
+
+    def is_v(l):
+        return abs(l[2] - l[0]) <= 2.5
+
+    def length(l):
+        return math.hypot(l[2] - l[0], l[3] - l[1])
+
+    norm = []
+    for l in lines_in:
+        x1, y1, x2, y2 = map(float, l)
+        if is_h([x1, y1, x2, y2]) and x2 < x1:
+            x1, x2 = x2, x1
+            y1, y2 = y2, y1
+        if is_v([x1, y1, x2, y2]) and y2 < y1:
+            y1, y2 = y2, y1
+            x1, x2 = x2, x1
+        norm.append([x1, y1, x2, y2])
+
+    used = [False] * len(norm)
+    kept = []
+    for i in range(len(norm)):
+        if used[i]:
+            continue
+        li = norm[i]
+        cluster = [li]
+        used[i] = True
+        for j in range(i + 1, len(norm)):
+            if used[j]:
+                continue
+            lj = norm[j]
+            if is_h(li) and is_h(lj):
+                if abs((li[1] + li[3]) / 2 - (lj[1] + lj[3]) / 2) > band:
+                    continue
+                if not (lj[0] > li[2] + overlap_gap or li[0] > lj[2] + overlap_gap):
+                    cluster.append(lj)
+                    used[j] = True
+            elif is_v(li) and is_v(lj):
+                if abs((li[0] + li[2]) / 2 - (lj[0] + lj[2]) / 2) > band:
+                    continue
+                if not (lj[1] > li[3] + overlap_gap or li[1] > lj[3] + overlap_gap):
+                    cluster.append(lj)
+                    used[j] = True
+        kept.append(max(cluster, key=length))
+    return kept
+
+
+# ---- inputs ----
+
+
+def random_lines(rng: np.random.Generator, n: int, size: int = 3000) -> np.ndarray:
+    """Wall-like segments: near-axis lines on a few shared coordinates (so bands and overlaps occur),
+    reversed ends, duplicates, short and diagonal strays, on integer and fractional coordinates."""
+    coords = rng.integers(0, size, 12).astype(np.float64)
+    out = []
+    for _ in range(n):
+        kind = rng.random()
+        c = rng.choice(coords) + rng.normal(0, 8)
+        a, b = np.sort(rng.uniform(0, size, 2))
+        d = rng.normal(0, 1.5)
+        if kind < 0.45:
+            line = [a, c, b, c + d]
+        elif kind < 0.9:
+            line = [c, a, c + d, b]
+        else:
+            line = list(rng.uniform(0, size, 4))
+        if rng.random() < 0.5:
+            line = line[2:] + line[:2]
+        if rng.random() < 0.5:
+            line = list(np.round(line))
+        out.append(line)
+        if rng.random() < 0.1:
+            out.append(list(out[-1]))
+    return np.array(out, dtype=np.float64).reshape(-1, 4)
+
+
+def plan_mask(rng: np.random.Generator, size: int = 1200) -> np.ndarray:
+    """0/255 mask of a few rooms with thick walls and door gaps."""
+    mask = np.zeros((size, size), np.uint8)
+    for _ in range(6):
+        x0, y0 = rng.integers(50, size // 2, 2)
+        x1, y1 = x0 + rng.integers(150, size // 2), y0 + rng.integers(150, size // 2)
+        cv2.rectangle(mask, (int(x0), int(y0)), (int(x1), int(y1)), 255, int(rng.integers(6, 20)))
+        gx = int(rng.integers(x0, x1))
+        mask[y0 - 12 : y0 + 12, gx : gx + 40] = 0
+    return mask
+
+
+SEEDS = range(25)
+
+
+# ---- tests ----
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_snap_matches_reference(seed):
+    lines = random_lines(np.random.default_rng(seed), 150)
+    expected = [s for s in (snap_hv(l) for l in lines) if s is not None]
+    np.testing.assert_array_equal(snap_hv_lines(lines), np.array(expected, dtype=np.float64).reshape(-1, 4))
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_merge_matches_reference(seed):
+    lines = snap_hv_lines(random_lines(np.random.default_rng(seed), 200))
+    expected = np.array(_ref_merge_axis_aligned(lines.tolist()), dtype=np.float64).reshape(-1, 4)
+    np.testing.assert_array_equal(merge_axis_aligned(lines), expected)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_filter_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    mask = plan_mask(rng)
+    lines = merge_axis_aligned(snap_hv_lines(random_lines(rng, 200, size=mask.shape[0])))
+    expected = np.array(_ref_filter_lines_on_wall(lines, mask), dtype=np.float64).reshape(-1, 4)
+    np.testing.assert_array_equal(filter_lines_on_wall(lines, mask), expected)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_dedup_matches_reference(seed):
+    lines = random_lines(np.random.default_rng(seed), 200)
+    expected = np.array(_ref_dedup_overlapping_lines(lines), dtype=np.float64).reshape(-1, 4)
+    np.testing.assert_array_equal(dedup_overlapping_lines(lines), expected)
+
+
+def test_empty_inputs():
+    mask = np.zeros((10, 10), np.uint8)
+    for fn in (snap_hv_lines, merge_axis_aligned, dedup_overlapping_lines):
+        assert fn([]).shape == (0, 4)
+    assert filter_lines_on_wall([], mask).shape == (0, 4)